@@ -0,0 +1,151 @@
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from hashlib import md5
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.db import transaction
+
+# Counter updates are serialized through this many lock files, not one per key
+LOCK_STRIPES = 64
+
+# Writes per process between two looks at the cache size. In between, every process
+# can add up to this many entries over MAX_ENTRIES before the next cull catches up.
+CULL_INTERVAL = 1000
+
+class LockingFileBasedCache(FileBasedCache):
+    """
+    File cache shared by every worker on the host.
+    add() and incr() run under an OS file lock, so throttle counters stay exact across processes.
+    The directory is only listed to cull it every CULL_INTERVAL writes, not on every set().
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._writes = 0
+
+    def _cull(self):
+        # FileBasedCache counts every cache file here, once per write
+        self._writes += 1
+        if self._writes % CULL_INTERVAL:
+            return
+        super()._cull()
+
+    def _lock_file(self, key, version):
+        stripe = int(md5(self.make_key(key, version).encode(), usedforsecurity=False).hexdigest(), 16) % LOCK_STRIPES
+        self._createdir()
+        return open(os.path.join(self._dir, f"{stripe}.lock"), 'ab')
+
+    def _read(self, fname):
+        """
+        (expiry, value) of a live entry, None when missing or expired.
+        """
+        try:
+            with open(fname, 'rb') as f:
+                if self._is_expired(f):
+                    return None
+                f.seek(0)
+                expiry = pickle.load(f)
+                return expiry, pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._lock_file(key, version) as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                return super().add(key, value, timeout, version)
+            finally:
+                locks.unlock(lock)
+
+    def incr(self, key, delta=1, version=None):
+        fname = self._key_to_file(key, version)
+        with self._lock_file(key, version) as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                entry = self._read(fname)
+                if entry is None:
+                    raise ValueError(f"Key '{key}' not found")
+                expiry, value = entry
+                new_value = value + delta
+                # Keep the original expiry, a counter must not outlive its window
+                timeout = None if expiry is None else max(expiry - time.time(), 0.001)
+                self.set(key, new_value, timeout, version)
+                return new_value
+            finally:
+                locks.unlock(lock)
+
+def user_version_key(user_id):
+    return f"user:{user_id}:cache-version"
+
+def get_user_version(user_id):
+    """
+    Current cache generation of the user's data, part of every per-user response key.
+    """
+    key = user_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a lost counter never brings back an old generation
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+def bump_user_version(user_id):
+    """
+    Moves the user to a new cache generation once the current transaction commits.
+    Entries from older generations are never read again and simply expire.
+    """
+    def bump():
+        try:
+            cache.incr(user_version_key(user_id))
+        except ValueError:
+            get_user_version(user_id)
+
+    transaction.on_commit(bump)
+
+def user_cache_key(user_id, name, *parts):
+    """
+    Versioned key for a per-user response, parts are whatever makes the response differ (query string, host...).
+    """
+    digest = md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+    return f"{name}:{user_id}:v{get_user_version(user_id)}:{digest}"
+
+class TTLCache:
+    """
+    Small in-process LRU whose entries expire after ttl seconds.
+    For data that is cheap to reload and fine to be briefly stale in one worker.
+    """
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
@@ -0,0 +1,289 @@
+"""
+In-process metrics with a Prometheus text exposition (served by core.views.metrics).
+Each worker counts on its own, with METRICS_DIR set workers also dump snapshots there
+and the endpoint sums them, so a scrape of any worker sees the whole host.
+"""
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.files import locks
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Snapshots are written at most this often per worker (seconds)
+SNAPSHOT_INTERVAL = 5
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+    @staticmethod
+    def merge(total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(key)} {value}"
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self._lock:
+            row = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[index] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(row) for key, row in self.values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for key, row in values.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], row)]
+            else:
+                total[key] = list(row)
+
+    def render(self, values):
+        for key, row in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(key, [('le', bound)])} {cumulative}"
+            cumulative += row[len(self.buckets)]
+            yield f"{self.name}_bucket{format_labels(key, [('le', '+Inf')])} {cumulative}"
+            yield f"{self.name}_sum{format_labels(key)} {row[-1]}"
+            yield f"{self.name}_count{format_labels(key)} {cumulative}"
+
+registry = []
+
+REQUEST_DURATION = Histogram('vinno_http_request_duration_seconds', "Request latency by endpoint, method and status")
+DB_QUERIES = Counter('vinno_db_queries_total', "Database queries run by requests, by endpoint")
+DB_QUERY_SECONDS = Counter('vinno_db_query_seconds_total', "Time spent in database queries by requests, by endpoint")
+SLOW_REQUESTS = Counter('vinno_slow_requests_total', "Requests slower than SLOW_REQUEST_THRESHOLD, by endpoint")
+BLOB_BYTES_READ = Counter('vinno_blob_bytes_read_total', "Bytes read from the blob store")
+BLOB_BYTES_WRITTEN = Counter('vinno_blob_bytes_written_total', "Bytes written to the blob store and upload staging")
+DEDUP_LOOKUPS = Counter('vinno_dedup_lookups_total', "Uploaded files whose content was already stored (hit) or not (miss)")
+CHUNK_LOOKUPS = Counter('vinno_chunk_lookups_total', "Chunks of new chunked blobs that were already stored (hit) or not (miss)")
+THROTTLED = Counter('vinno_throttled_requests_total', "Requests rejected by a throttle, by scope")
+
+def record_dedup(hits=0, misses=0):
+    if hits:
+        DEDUP_LOOKUPS.inc(hits, result='hit')
+    if misses:
+        DEDUP_LOOKUPS.inc(misses, result='miss')
+
+def record_chunk_dedup(hits=0, misses=0):
+    if hits:
+        CHUNK_LOOKUPS.inc(hits, result='hit')
+    if misses:
+        CHUNK_LOOKUPS.inc(misses, result='miss')
+
+# Per request database stats
+
+current_request = contextvars.ContextVar('vinno_request_stats', default=None)
+
+# Queries kept per request for the slow request log
+MAX_SAMPLED_QUERIES = 200
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.samples = []
+
+    def record(self, sql, duration):
+        self.queries += 1
+        self.query_seconds += duration
+        if len(self.samples) < MAX_SAMPLED_QUERIES:
+            self.samples.append((sql, duration))
+
+def instrument_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper, charges each query to the request running it.
+    A context variable, so it follows the request into sync_to_async threads.
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - started)
+
+def install_query_wrapper(sender, connection, **kwargs):
+    # connection_created fires again on reconnect, the wrapper list survives it
+    if instrument_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrument_queries)
+
+# Exposition
+
+_last_snapshot = 0.0
+
+# Counts of workers that exited, their own snapshots are folded into it (retire_dead_workers)
+RETIRED_SNAPSHOT = 'retired.json'
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in registry}
+
+def write_snapshot(path, data):
+    encoded = {name: [[list(map(list, key)), value] for key, value in values.items()] for name, values in data.items()}
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(encoded, f)
+    os.replace(temp_path, path)
+
+def read_snapshot(path):
+    """
+    A snapshot written by write_snapshot, None when it's gone or unreadable.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {name: {tuple(map(tuple, key)): value for key, value in values} for name, values in data.items()}
+
+def dump_snapshot(force=False):
+    """
+    Writes this worker's metrics to METRICS_DIR, at most every SNAPSHOT_INTERVAL seconds.
+    """
+    global _last_snapshot
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_snapshot < SNAPSHOT_INTERVAL:
+        return
+    _last_snapshot = now
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    write_snapshot(os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json"), snapshot())
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def retire_dead_workers():
+    """
+    Folds the snapshots of workers that exited into RETIRED_SNAPSHOT and removes them,
+    so restarts don't pile up files and the totals never go down.
+    """
+    dead = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        pid = os.path.basename(path)[:-len('.json')]
+        if pid.isdigit() and not process_alive(int(pid)):
+            dead.append(path)
+    if not dead:
+        return
+
+    # Scrapes in other workers may be retiring the same files
+    with open(os.path.join(settings.METRICS_DIR, 'retired.lock'), 'ab') as lock:
+        locks.lock(lock, locks.LOCK_EX)
+        try:
+            retired_path = os.path.join(settings.METRICS_DIR, RETIRED_SNAPSHOT)
+            totals = read_snapshot(retired_path) or {}
+            retired = []
+            for path in dead:
+                data = read_snapshot(path)
+                if data is None:
+                    continue
+                for metric in registry:
+                    metric.merge(totals.setdefault(metric.name, {}), data.get(metric.name, {}))
+                retired.append(path)
+
+            if retired:
+                write_snapshot(retired_path, totals)
+                for path in retired:
+                    os.remove(path)
+        finally:
+            locks.unlock(lock)
+
+def load_snapshots():
+    """
+    Snapshots of the other workers and of the retired ones, ours is always taken live.
+    """
+    if not settings.METRICS_DIR:
+        return []
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    retire_dead_workers()
+
+    own = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        if path == own:
+            continue
+        data = read_snapshot(path)
+        if data is not None:
+            snapshots.append(data)
+    return snapshots
+
+def render():
+    """
+    All metrics in the Prometheus text format, summed over the workers of this host.
+    """
+    totals = {metric.name: {} for metric in registry}
+    for data in [snapshot()] + load_snapshots():
+        for metric in registry:
+            metric.merge(totals[metric.name], data.get(metric.name, {}))
+
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(totals[metric.name]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,97 @@
+import json
+import logging
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from . import metrics
+
+request_logger = logging.getLogger('vinno.requests')
+slow_logger = logging.getLogger('vinno.slow')
+
+# Slowest queries written out for a slow request
+SLOW_LOG_QUERIES = 20
+
+class InstrumentationMiddleware:
+    """
+    Times every request and counts its database queries into core.metrics.
+    Optionally logs one JSON line per request (METRICS_LOG_REQUESTS), and logs the SQL
+    of requests slower than SLOW_REQUEST_THRESHOLD (sampled at SLOW_REQUEST_SAMPLE_RATE).
+    Works for both the sync and the async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(metrics.install_query_wrapper, dispatch_uid='vinno_instrument_queries')
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    def start(self):
+        # Connections opened before the middleware was loaded missed connection_created
+        for connection in connections.all(initialized_only=True):
+            metrics.install_query_wrapper(None, connection)
+
+        stats = metrics.RequestStats()
+        return stats, metrics.current_request.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        # Streamed bodies are still being sent, this is the time to the first byte
+        duration = time.perf_counter() - started
+
+        # The route name, not the path, so ids don't explode the label set
+        match = request.resolver_match
+        endpoint = (match.view_name if match else None) or 'unmatched'
+
+        metrics.REQUEST_DURATION.observe(
+            duration, endpoint=endpoint, method=request.method, status=response.status_code
+        )
+        metrics.DB_QUERIES.inc(stats.queries, endpoint=endpoint)
+        metrics.DB_QUERY_SECONDS.inc(stats.query_seconds, endpoint=endpoint)
+
+        line = {
+            'endpoint': endpoint,
+            'method': request.method,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': stats.queries,
+            'query_ms': round(stats.query_seconds * 1000, 2),
+        }
+
+        if settings.METRICS_LOG_REQUESTS:
+            request_logger.info(json.dumps(line))
+
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            metrics.SLOW_REQUESTS.inc(endpoint=endpoint)
+            if random.random() < settings.SLOW_REQUEST_SAMPLE_RATE:
+                slowest = sorted(stats.samples, key=lambda sample: sample[1], reverse=True)[:SLOW_LOG_QUERIES]
+                line['path'] = request.path
+                line['sql'] = [{'ms': round(seconds * 1000, 2), 'sql': sql} for sql, seconds in slowest]
+                slow_logger.warning(json.dumps(line))
+
+        metrics.dump_snapshot()
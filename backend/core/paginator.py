@@ -0,0 +1,34 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Filtered change lists stop counting here, the last pages are then approximate
+COUNT_LIMIT = 10000
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin paginator for very large tables.
+    Unfiltered lists use the planner's row estimate (Postgres) instead of COUNT(*),
+    filtered ones count at most COUNT_LIMIT rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = queryset.query
+        connection = connections[queryset.db]
+
+        if not query.where:
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [queryset.model._meta.db_table]
+                    )
+                    row = cursor.fetchone()
+                # -1 / 0 until the table has been analyzed
+                if row and row[0] > 0:
+                    return row[0]
+            return super().count
+
+        return queryset.values('pk')[:COUNT_LIMIT].count()
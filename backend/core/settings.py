@@ -40,14 +40,14 @@ ALLOWED_HOSTS = ["*"]
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "user.authentication.StatelessJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'core.throttles.AtomicAnonRateThrottle',
+        'core.throttles.AtomicUserRateThrottle'
     ],
     
     'DEFAULT_THROTTLE_RATES': {
@@ -56,11 +56,92 @@ REST_FRAMEWORK = {
     }
 }
 
+# Resumable uploads: fixed chunk size handed out to clients
+UPLOAD_CHUNK_SIZE = int(os.getenv('VINNO_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+
+# Chunk store (drive.chunkstore): blobs are kept as content-defined chunks, each chunk stored once,
+# so versions of a big file share everything but the chunks around an edit. Enables chunked upload
+# sessions and the chunk_blobs command, which converts blobs of at least CHUNK_STORE_MIN_BLOB_SIZE.
+# Clients chunking on their side must use the same sizes, they're sent back with every upload session.
+CHUNK_STORE = os.getenv('VINNO_CHUNK_STORE', '').lower() in ('1', 'true', 'yes')
+CHUNK_MIN_SIZE = int(os.getenv('VINNO_CHUNK_MIN_SIZE', 256 * 1024))
+CHUNK_AVG_SIZE = int(os.getenv('VINNO_CHUNK_AVG_SIZE', 1024 * 1024))
+CHUNK_MAX_SIZE = int(os.getenv('VINNO_CHUNK_MAX_SIZE', 4 * 1024 * 1024))
+CHUNK_STORE_MIN_BLOB_SIZE = int(os.getenv('VINNO_CHUNK_STORE_MIN_BLOB_SIZE', 4 * 1024 * 1024))
+
+# Blob compression (drive.compression): the compress_blobs command stores compressible blobs as 'gzip'
+# (default) or 'zstd' (needs the zstandard package, also to read them back). Empty turns it off.
+BLOB_COMPRESSION = os.getenv('VINNO_BLOB_COMPRESSION', 'gzip')
+
+# Previews (drive.previews): thumbnail sizes in pixels (longest side, needs Pillow) and text excerpts,
+# made by the generate_previews command in PREVIEW_WORKERS processes.
+PREVIEW_SIZES = [int(size) for size in os.getenv('VINNO_PREVIEW_SIZES', '256,1024').split(',') if size.strip()]
+PREVIEW_WORKERS = int(os.getenv('VINNO_PREVIEW_WORKERS', 2))
+
+# Blob garbage collection: unreferenced blobs are kept this long (seconds) before being reclaimed,
+# so re-uploads in the meantime are free. Also the minimum age of stray files and stale upload sessions.
+BLOB_GC_GRACE_PERIOD = int(os.getenv('VINNO_BLOB_GC_GRACE_PERIOD', 24 * 60 * 60))
+
+# Downloads: signed download links stay valid this long (seconds)
+DOWNLOAD_URL_MAX_AGE = int(os.getenv('VINNO_DOWNLOAD_URL_MAX_AGE', 6 * 60 * 60))
+
+# Let the front proxy send the bytes: None, 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd).
+# For x-accel, DOWNLOAD_ACCEL_PREFIX is the internal nginx location that maps to MEDIA_ROOT.
+DOWNLOAD_SENDFILE_MODE = os.getenv('VINNO_DOWNLOAD_SENDFILE_MODE') or None
+DOWNLOAD_ACCEL_PREFIX = os.getenv('VINNO_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+
+# Shared cache (throttle counters, cached listings/stats/profiles), it must be shared by all workers.
+# 'file' (default, no extra service), 'redis' (needs the redis package, set VINNO_REDIS_URL) or 'locmem' (single process dev)
+CACHE_BACKEND = os.getenv('VINNO_CACHE_BACKEND', 'file')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('VINNO_REDIS_URL', 'redis://127.0.0.1:6379/0'),
+        }
+    }
+elif CACHE_BACKEND == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.LockingFileBasedCache',
+            'LOCATION': os.getenv('VINNO_CACHE_DIR', str(BASE_DIR / 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Serve listing, download and chunked upload with the async views (drive.async_views), for ASGI deployments.
+# Their blocking file I/O and hashing share a pool of ASYNC_IO_THREADS threads per process.
+ASYNC_VIEWS = os.getenv('VINNO_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+ASYNC_IO_THREADS = int(os.getenv('VINNO_ASYNC_IO_THREADS', 8))
+
+# Instrumentation (core.middleware, core.metrics): Prometheus text at /metrics with Bearer VINNO_METRICS_TOKEN,
+# without a token it's only served in DEBUG. With METRICS_DIR every worker drops a snapshot there and /metrics sums the whole host.
+METRICS_TOKEN = os.getenv('VINNO_METRICS_TOKEN') or None
+METRICS_DIR = os.getenv('VINNO_METRICS_DIR') or None
+METRICS_LOG_REQUESTS = os.getenv('VINNO_METRICS_LOG_REQUESTS', '').lower() in ('1', 'true', 'yes')
+
+# Requests slower than this (seconds) get their SQL logged, for this share of them
+SLOW_REQUEST_THRESHOLD = float(os.getenv('VINNO_SLOW_REQUEST_THRESHOLD', 1.0))
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv('VINNO_SLOW_REQUEST_SAMPLE_RATE', 1.0))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    "TOKEN_OBTAIN_SERIALIZER": "user.serializers.SessionTokenObtainPairSerializer",
 }
 
+# Token auth: full user rows are cached per worker this long (seconds),
+# and logouts made in other workers are picked up within TOKEN_BLACKLIST_REFRESH seconds
+AUTH_USER_CACHE_TTL = int(os.getenv('VINNO_AUTH_USER_CACHE_TTL', 60))
+TOKEN_BLACKLIST_REFRESH = int(os.getenv('VINNO_TOKEN_BLACKLIST_REFRESH', 30))
+
 
 # Application definition
 
@@ -80,6 +161,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -165,4 +247,16 @@ STATIC_URL = 'static/'
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173", # Vite + React default port
     "http://127.0.0.1:5173",
-]
\ No newline at end of file
+]
+
+# Request lines and slow request samples are JSON, one per line
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'vinno': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -1,5 +1,65 @@
-from rest_framework.throttling import UserRateThrottle
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+from . import metrics
 
-class TwoSecondThrottle(UserRateThrottle):
+class AtomicRateThrottleMixin:
+    """
+    Fixed window throttling on a shared counter.
+    One cache.add + cache.incr per request instead of DRF's read-modify-write of a timestamp list,
+    so every worker counts against the same budget.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        self.window_end = (window + 1) * self.duration
+        key = f"{self.key}:{window}"
+
+        # The counter lives slightly longer than its window, later windows use a new key anyway
+        self.cache.add(key, 0, self.duration + 1)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            self.cache.add(key, 1, self.duration + 1)
+            count = 1
+
+        if count > self.num_requests:
+            metrics.THROTTLED.inc(scope=self.scope)
+            return False
+        return True
+
+    def wait(self):
+        return max(self.window_end - self.now, 0)
+
+class AtomicAnonRateThrottle(AtomicRateThrottleMixin, AnonRateThrottle):
+    pass
+
+class AtomicUserRateThrottle(AtomicRateThrottleMixin, UserRateThrottle):
+    pass
+
+class TwoSecondThrottle(AtomicUserRateThrottle):
     # Translates to 1 request per 2 seconds
-    rate = '30/min'
\ No newline at end of file
+    scope = 'two_second'
+    rate = '30/min'
+
+class ChunkUploadThrottle(AtomicUserRateThrottle):
+    # Resumable uploads send many chunks in parallel, so they get their own budget
+    scope = 'upload_chunk'
+    rate = '30/second'
+
+class DownloadThrottle(AtomicUserRateThrottle):
+    # Video players seek with bursts of range requests
+    scope = 'download'
+    rate = '20/second'
+
+class PreviewThrottle(AtomicUserRateThrottle):
+    # A grid view loads a whole page of thumbnails at once
+    scope = 'preview'
+    rate = '100/second'
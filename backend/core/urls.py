@@ -3,12 +3,14 @@ from django.urls import path, include
 
 from django.conf import settings
 from django.conf.urls.static import static
+from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     path('api/drive/', include('drive.urls')),
-    path('api/user/', include('user.urls'))
+    path('api/user/', include('user.urls')),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 # Serve media files during development (Local Storage)
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from . import metrics as registry
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint. Needs METRICS_TOKEN (Bearer), only open to anyone in DEBUG without a token.
+    """
+    if settings.METRICS_TOKEN:
+        if request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
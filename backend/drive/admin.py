@@ -1,3 +1,206 @@
-from django.contrib import admin
+from collections import defaultdict
+from django.contrib import admin, messages
+from django.contrib.auth.models import User
+from core.paginator import EstimatedCountPaginator
+from .models import PhysicalBlob, FileReference, MaintenanceJob, Derivative
+from .services import delete_references
 
-# Register your models here.
+# Past this many selected blobs the job should be queued for "all blobs" or the selection narrowed
+MAX_JOB_SELECTION = 100_000
+
+MB = 1024 * 1024
+
+def format_size(size):
+    return f"{size / MB:.2f} MB"
+
+def size_bucket_filter(field):
+    """
+    List filter on a size field by ranges, each one an index range scan.
+    """
+    class SizeBucketFilter(admin.SimpleListFilter):
+        title = 'size'
+        parameter_name = 'size_bucket'
+        buckets = {
+            'small': (0, MB),
+            'medium': (MB, 100 * MB),
+            'large': (100 * MB, None),
+        }
+
+        def lookups(self, request, model_admin):
+            return [('small', "< 1 MB"), ('medium', "1 - 100 MB"), ('large', "> 100 MB")]
+
+        def queryset(self, request, queryset):
+            if self.value() not in self.buckets:
+                return queryset
+            low, high = self.buckets[self.value()]
+            queryset = queryset.filter(**{f"{field}__gte": low})
+            if high is not None:
+                queryset = queryset.filter(**{f"{field}__lt": high})
+            return queryset
+
+    return SizeBucketFilter
+
+def content_type_filter(field):
+    """
+    Filters on the content type family (image/, video/...) with a prefix match,
+    instead of the DISTINCT over the whole table a plain list_filter would run.
+    """
+    class ContentTypeFilter(admin.SimpleListFilter):
+        title = 'content type'
+        parameter_name = 'type'
+        families = ['image', 'video', 'audio', 'text', 'application']
+
+        def lookups(self, request, model_admin):
+            return [(family, family) for family in self.families]
+
+        def queryset(self, request, queryset):
+            if self.value() not in self.families:
+                return queryset
+            return queryset.filter(**{f"{field}__startswith": f"{self.value()}/"})
+
+    return ContentTypeFilter
+
+class RefCountFilter(admin.SimpleListFilter):
+    title = 'references'
+    parameter_name = 'refs'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('tombstoned', "Unreferenced (tombstoned)"),
+            ('single', "One reference"),
+            ('shared', "Shared (deduplicated)"),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'tombstoned':
+            return queryset.filter(ref_count=0)
+        if self.value() == 'single':
+            return queryset.filter(ref_count=1)
+        if self.value() == 'shared':
+            return queryset.filter(ref_count__gt=1)
+        return queryset
+
+@admin.register(PhysicalBlob)
+class PhysicalBlobAdmin(admin.ModelAdmin):
+    list_display = ('short_hash', 'size_mb', 'content_type', 'ref_count', 'chunked', 'codec', 'created_at', 'deleted_at')
+    list_filter = (size_bucket_filter('size'), content_type_filter('content_type'), RefCountFilter)
+    search_fields = ('^sha256_hash',)
+    readonly_fields = (
+        'sha256_hash', 'file', 'chunked', 'codec', 'stored_size', 'size', 'content_type',
+        'ref_count', 'created_at', 'deleted_at'
+    )
+    actions = ('recompute_ref_counts', 'purge_tombstones')
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
+
+    @admin.display(description='hash', ordering='sha256_hash')
+    def short_hash(self, obj):
+        return f"{obj.sha256_hash[:16]}..."
+
+    @admin.display(description='size', ordering='size')
+    def size_mb(self, obj):
+        return format_size(obj.size)
+
+    def has_add_permission(self, request):
+        # Blobs only come from uploads
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Deleting a blob by hand would skip ref counts and leave its file, use the purge action
+        return False
+
+    def queue_job(self, request, queryset, kind):
+        # "Select all" on an unfiltered list means every blob, without listing millions of hashes
+        filtered = any(key not in ('o', 'p') for key in request.GET)
+        if request.POST.get('select_across') == '1' and not filtered:
+            hashes = None
+        else:
+            hashes = list(queryset.values_list('sha256_hash', flat=True)[:MAX_JOB_SELECTION + 1])
+            if len(hashes) > MAX_JOB_SELECTION:
+                self.message_user(
+                    request,
+                    f"More than {MAX_JOB_SELECTION} blobs selected, narrow the filters or run it on all blobs.",
+                    messages.ERROR
+                )
+                return
+
+        job = MaintenanceJob.objects.create(kind=kind, blob_hashes=hashes, created_by=request.user)
+        self.message_user(request, f"Queued: {job}. It runs in the background (run_maintenance_jobs).")
+
+    @admin.action(description="Recompute ref counts (background)")
+    def recompute_ref_counts(self, request, queryset):
+        self.queue_job(request, queryset, MaintenanceJob.RECOMPUTE_REF_COUNTS)
+
+    @admin.action(description="Purge unreferenced blobs now (background)")
+    def purge_tombstones(self, request, queryset):
+        self.queue_job(request, queryset, MaintenanceJob.PURGE_TOMBSTONES)
+
+@admin.register(FileReference)
+class FileReferenceAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'user', 'blob_size', 'content_type', 'is_primary_uploader', 'upload_timestamp')
+    list_select_related = ('user', 'blob')
+    list_filter = ('is_primary_uploader', size_bucket_filter('blob__size'), content_type_filter('blob__content_type'))
+    search_fields = ('=user__username', '=blob__sha256_hash')
+    # Owner, content and who pays for it only change through uploads and deletes (ref counts, quota)
+    readonly_fields = ('user', 'blob', 'is_primary_uploader', 'parent_path', 'upload_timestamp')
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
+
+    @admin.display(description='size', ordering='blob__size')
+    def blob_size(self, obj):
+        return format_size(obj.blob.size)
+
+    @admin.display(description='content type', ordering='blob__content_type')
+    def content_type(self, obj):
+        return obj.blob.content_type
+
+    def has_add_permission(self, request):
+        # Files only come from uploads
+        return False
+
+    def delete_model(self, request, obj):
+        # Same bookkeeping as a delete from the drive: ref counts, quota, folders, summary
+        delete_references(obj.user, FileReference.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        by_user = defaultdict(list)
+        for ref_id, user_id in queryset.values_list('id', 'user_id'):
+            by_user[user_id].append(ref_id)
+        users = User.objects.in_bulk(by_user)
+        for user_id, ref_ids in by_user.items():
+            delete_references(users[user_id], FileReference.objects.filter(id__in=ref_ids))
+
+@admin.register(MaintenanceJob)
+class MaintenanceJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'processed', 'changed', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    list_select_related = ('created_by',)
+    # The hash selection can be huge, it stays out of the form
+    exclude = ('blob_hashes',)
+    readonly_fields = [field.name for field in MaintenanceJob._meta.fields if field.name != 'blob_hashes']
+
+    def has_add_permission(self, request):
+        # Jobs are queued from the blob actions
+        return False
+
+@admin.register(Derivative)
+class DerivativeAdmin(admin.ModelAdmin):
+    list_display = ('blob', 'kind', 'status', 'content_type', 'size', 'created_at')
+    list_filter = ('status', 'kind')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [field.name for field in Derivative._meta.fields]
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        # Queued by the preview endpoint or generate_previews --backfill
+        return False
+
+    @admin.action(description="Generate the selected previews again")
+    def retry(self, request, queryset):
+        count = queryset.update(status=Derivative.PENDING)
+        self.message_user(request, f"{count} previews queued for generate_previews.", messages.SUCCESS)
@@ -0,0 +1,129 @@
+"""
+Async twins of the hot drive endpoints, routed instead of the DRF views when ASYNC_VIEWS is on (ASGI).
+The request body is already read by Django's ASGI handler without holding a thread,
+file I/O and hashing go to the bounded I/O pool, ORM calls to sync_to_async.
+Responses match the DRF views.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from core.throttles import ChunkUploadThrottle, DownloadThrottle
+from .downloads import build_download_response
+from .executor import run_io
+from .models import PhysicalBlob
+from .pagination import InvalidCursor
+from .serializers import FileReferenceSerializer, UploadSessionSerializer
+from .services import UploadError, write_chunk, missing_chunks, assemble_chunks, commit_upload_session
+from .views import file_listing, downloadable_reference, get_session_or_none
+
+def error_response(message, status_code):
+    return JsonResponse({"error": message}, status=status_code)
+
+async def api_request(request, throttle_classes=None, allow_anonymous=False):
+    """
+    Does what DRF does before a view: JWT authentication and throttling.
+    Returns (DRF request, error response or None).
+    """
+    drf_request = Request(
+        request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    throttles = [throttle() for throttle in (throttle_classes or api_settings.DEFAULT_THROTTLE_CLASSES)]
+
+    def check():
+        try:
+            if not allow_anonymous and not drf_request.user.is_authenticated:
+                raise NotAuthenticated()
+            waits = [throttle.wait() for throttle in throttles if not throttle.allow_request(drf_request, None)]
+            if waits:
+                raise Throttled(max(waits))
+        except APIException as e:
+            response = JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+            if isinstance(e, Throttled) and e.wait is not None:
+                response['Retry-After'] = str(int(e.wait) + 1)
+            return response
+        return None
+
+    return drf_request, await sync_to_async(check)()
+
+@csrf_exempt
+@require_http_methods(['GET'])
+async def get_files(request):
+    request, error = await api_request(request)
+    if error:
+        return error
+
+    try:
+        return JsonResponse(await sync_to_async(file_listing)(request))
+    except InvalidCursor as e:
+        return error_response(str(e), status.HTTP_400_BAD_REQUEST)
+
+@csrf_exempt
+@require_http_methods(['GET', 'HEAD'])
+async def download_file(request, file_id):
+    request, error = await api_request(request, [DownloadThrottle], allow_anonymous=True)
+    if error:
+        return error
+
+    try:
+        file_ref = await sync_to_async(downloadable_reference)(request, file_id)
+    except NotAuthenticated:
+        return error_response("Authentication required", status.HTTP_401_UNAUTHORIZED)
+
+    if file_ref is None:
+        return error_response("File not found or unauthorized", status.HTTP_404_NOT_FOUND)
+
+    return build_download_response(request, file_ref, asynchronous=True)
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+async def upload_chunk(request, session_id, index):
+    request, error = await api_request(request, [ChunkUploadThrottle])
+    if error:
+        return error
+
+    session = await sync_to_async(get_session_or_none)(request, session_id)
+    if session is None:
+        return error_response("Upload session not found", status.HTTP_404_NOT_FOUND)
+
+    try:
+        await run_io(write_chunk, session, index, request.stream)
+    except UploadError as e:
+        return error_response(str(e), status.HTTP_400_BAD_REQUEST)
+
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+@csrf_exempt
+@require_http_methods(['POST'])
+async def commit_session(request, session_id):
+    request, error = await api_request(request)
+    if error:
+        return error
+
+    session = await sync_to_async(get_session_or_none)(request, session_id)
+    if session is None:
+        return error_response("Upload session not found", status.HTTP_404_NOT_FOUND)
+
+    def session_error(message):
+        data = {"error": message, "session": UploadSessionSerializer(session).data}
+        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+
+    if await run_io(missing_chunks, session):
+        return await sync_to_async(session_error)("Upload is incomplete")
+
+    try:
+        # The expensive part, reading and hashing every chunk, stays off the ORM thread
+        stored_name = None
+        if not await PhysicalBlob.objects.filter(sha256_hash=session.sha256_hash).aexists():
+            stored_name = await run_io(assemble_chunks, session)
+
+        file_ref = await sync_to_async(commit_upload_session)(session, stored_name)
+    except UploadError as e:
+        return await sync_to_async(session_error)(str(e))
+
+    data = await sync_to_async(lambda: FileReferenceSerializer(file_ref, context={'request': request}).data)()
+    return JsonResponse(data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,226 @@
+"""
+Content-defined chunk store under the blob layer (settings.CHUNK_STORE).
+Big blobs are cut with a gear rolling hash (FastCDC style): cut points follow the content,
+so an edit only changes the chunks around it and every other chunk is shared with earlier versions.
+Each chunk is stored once under chunks/ab/cd/<sha256>, a chunked blob is its ordered manifest (BlobChunk rows).
+Database side (manifests, ref counts) is in drive.services, this module only deals with files.
+"""
+import bisect
+import hashlib
+import io
+import os
+import tempfile
+from django.conf import settings
+from core import metrics
+from .compression import DecompressingFile, get_codec
+from .storage import blob_storage
+
+CHUNK_ROOT = 'chunks'
+
+# Read buffer when hashing or streaming chunks
+READ_SIZE = 1024 * 1024
+
+MASK_64 = (1 << 64) - 1
+
+# One random 64 bit value per byte value, derived from SHA-256 so clients can build the same table
+GEAR = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], 'big') for value in range(256)]
+
+def chunk_name(sha256_hash):
+    # Sharded like the blobs, see drive.storage.blob_name
+    return f"{CHUNK_ROOT}/{sha256_hash[:2]}/{sha256_hash[2:4]}/{sha256_hash}"
+
+def chunk_path(sha256_hash):
+    return blob_storage.path(chunk_name(sha256_hash))
+
+def chunk_exists(sha256_hash):
+    return os.path.exists(chunk_path(sha256_hash))
+
+def cut_masks(avg_size):
+    """
+    Normalized chunking: a harder mask before the average size and an easier one after it,
+    so chunk sizes bunch up around the average. High bits, they depend on the last 64 bytes.
+    """
+    bits = avg_size.bit_length() - 1
+    hard = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+    easy = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+    return hard, easy
+
+def cut_point(data, min_size, avg_size, max_size):
+    """
+    Length of the chunk starting at the beginning of data.
+    Bytes below min_size are never hashed, which is where most of the speed comes from.
+    """
+    length = len(data)
+    if length <= min_size:
+        return length
+    length = min(length, max_size)
+    normal = min(length, avg_size)
+    hard, easy = cut_masks(avg_size)
+
+    gear = GEAR
+    view = memoryview(data)
+    fingerprint = 0
+    position = min_size
+    for value in view[min_size:normal]:
+        position += 1
+        fingerprint = ((fingerprint << 1) + gear[value]) & MASK_64
+        if not fingerprint & hard:
+            return position
+    for value in view[normal:length]:
+        position += 1
+        fingerprint = ((fingerprint << 1) + gear[value]) & MASK_64
+        if not fingerprint & easy:
+            return position
+    return length
+
+def iter_chunks(f, min_size=None, avg_size=None, max_size=None):
+    """
+    Splits a binary file into content-defined chunks, yields their bytes.
+    """
+    min_size = min_size or settings.CHUNK_MIN_SIZE
+    avg_size = avg_size or settings.CHUNK_AVG_SIZE
+    max_size = max_size or settings.CHUNK_MAX_SIZE
+
+    buffer = b''
+    eof = False
+    while True:
+        # Always keep a full max_size window, so cut points don't depend on read boundaries
+        while not eof and len(buffer) < max_size:
+            data = f.read(max(READ_SIZE, max_size - len(buffer)))
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+
+        length = cut_point(buffer, min_size, avg_size, max_size)
+        yield buffer[:length]
+        buffer = buffer[length:]
+
+def write_chunk_file(sha256_hash, data):
+    """
+    Stores one chunk unless it's already there. Returns the number of bytes written.
+    """
+    if chunk_exists(sha256_hash):
+        return 0
+    blob_storage.save(chunk_name(sha256_hash), io.BytesIO(data))
+    return len(data)
+
+def receive_chunk(sha256_hash, stream, expected):
+    """
+    Streams one uploaded chunk straight into the chunk store, checked against its declared hash.
+    Returns False when the content doesn't match (nothing is kept then).
+    """
+    final_path = chunk_path(sha256_hash)
+    directory = os.path.dirname(final_path)
+    os.makedirs(directory, exist_ok=True)
+
+    digest = hashlib.sha256()
+    written = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while written <= expected:
+                data = stream.read(min(READ_SIZE, expected + 1 - written))
+                if not data:
+                    break
+                digest.update(data)
+                out.write(data)
+                written += len(data)
+        metrics.BLOB_BYTES_WRITTEN.inc(written)
+
+        if written != expected or digest.hexdigest() != sha256_hash:
+            return False
+        os.replace(temp_path, final_path)
+        return True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def hash_manifest(manifest):
+    """
+    SHA-256 of the content a manifest [(hash, size)] puts together, read back from the stored chunks.
+    None when a stored chunk doesn't have its declared size, offsets would be wrong.
+    """
+    digest = hashlib.sha256()
+    for sha256_hash, size in manifest:
+        read = 0
+        with open(chunk_path(sha256_hash), 'rb') as f:
+            while data := f.read(READ_SIZE):
+                digest.update(data)
+                read += len(data)
+        if read != size:
+            return None
+    return digest.hexdigest()
+
+class ChunkedBlobFile(io.RawIOBase):
+    """
+    Read-only, seekable file over the chunks of a blob, so the download code
+    (ranges, FileResponse, async streaming) doesn't care how the blob is stored.
+    manifest is [(offset, size, chunk hash)] in order.
+    """
+    def __init__(self, manifest, size):
+        super().__init__()
+        self.offsets = [offset for offset, _, _ in manifest]
+        self.manifest = manifest
+        self.size = size
+        self.position = 0
+        self.current = None
+        self.current_index = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+
+        index = bisect.bisect_right(self.offsets, self.position) - 1
+        offset, size, sha256_hash = self.manifest[index]
+        if index != self.current_index:
+            if self.current:
+                self.current.close()
+            self.current = open(chunk_path(sha256_hash), 'rb')
+            self.current_index = index
+
+        # One chunk per call, callers loop until they have what they asked for
+        self.current.seek(self.position - offset)
+        data = self.current.read(min(len(buffer), offset + size - self.position))
+        if not data:
+            raise OSError(f"Chunk {sha256_hash} is shorter than its manifest entry")
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if self.current:
+            self.current.close()
+            self.current = None
+        super().close()
+
+def open_blob(blob):
+    """
+    Binary file with the original content of a blob, flat, compressed or chunked.
+    """
+    if blob.chunked:
+        return io.BufferedReader(ChunkedBlobFile(blob.manifest, blob.size), buffer_size=READ_SIZE)
+    codec = get_codec(blob.codec)
+    if codec is not None:
+        return io.BufferedReader(DecompressingFile(open(blob.file.path, 'rb'), codec, blob.size), buffer_size=READ_SIZE)
+    return open(blob.file.path, 'rb')
@@ -0,0 +1,217 @@
+"""
+Transparent per-blob compression (settings.BLOB_COMPRESSION).
+The compress_blobs command rewrites flat blobs compressed when their content type and a sample say it pays off.
+The dedup key stays the SHA-256 of the original bytes, only the file on disk changes.
+Downloads decompress as a stream, or send the stored bytes as they are to clients accepting the encoding.
+"""
+import gzip
+import io
+import os
+import tempfile
+import zlib
+from django.conf import settings
+from core import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Stored as uploaded after being looked at, so the blob isn't sampled again
+IDENTITY = 'identity'
+
+# Bytes compressed to judge a blob of unknown type
+SAMPLE_SIZE = 64 * 1024
+
+# Kept compressed only below this share of the original size
+MAX_RATIO = 0.9
+
+# Below this, the headers eat most of the gain
+MIN_SIZE = 1024
+
+READ_SIZE = 1024 * 1024
+
+# Formats that are compressed already
+INCOMPRESSIBLE_PREFIXES = ('image/', 'video/', 'audio/', 'font/woff')
+INCOMPRESSIBLE_TYPES = {
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+    'application/x-7z-compressed', 'application/vnd.rar', 'application/x-rar-compressed', 'application/zstd',
+    'application/pdf', 'application/epub+zip', 'application/java-archive',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+# Text in all but name, compressed without sampling
+COMPRESSIBLE_PREFIXES = ('text/',)
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/xml', 'application/javascript', 'application/x-ndjson',
+    'application/sql', 'application/x-sh', 'application/x-yaml', 'application/yaml', 'image/svg+xml',
+}
+
+class Codec:
+    """
+    A compression format: the name recorded on the blob is also its HTTP Content-Encoding.
+    reader(raw) wraps a file of compressed bytes, its read(n) never decodes more than n bytes.
+    """
+    def __init__(self, name, extension, compressor, reader):
+        self.name = name
+        self.extension = extension
+        self.compressobj = compressor
+        self.reader = reader
+
+CODECS = {
+    # wbits 31 writes a gzip stream, the one encoding every HTTP client understands
+    'gzip': Codec(
+        'gzip', 'gz',
+        lambda: zlib.compressobj(6, zlib.DEFLATED, 31),
+        lambda raw: gzip.GzipFile(fileobj=raw, mode='rb')
+    ),
+}
+if zstandard is not None:
+    CODECS['zstd'] = Codec(
+        'zstd', 'zst',
+        lambda: zstandard.ZstdCompressor(level=3).compressobj(),
+        lambda raw: zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+    )
+
+def get_codec(name):
+    """
+    Codec a blob was stored with, None when it's stored as uploaded.
+    """
+    if not name or name == IDENTITY:
+        return None
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise RuntimeError(f"Blob stored with {name}, which isn't available (install zstandard?)")
+
+def configured_codec():
+    """
+    Codec new compressions use, None when compression is off.
+    """
+    name = settings.BLOB_COMPRESSION
+    if not name:
+        return None
+    if name not in CODECS:
+        raise RuntimeError(f"BLOB_COMPRESSION={name} isn't available (gzip, or zstd with the zstandard package)")
+    return CODECS[name]
+
+def compressible_type(content_type):
+    """
+    True for text-like types, False for formats that are compressed already, None when the type doesn't tell.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in COMPRESSIBLE_TYPES or content_type.startswith(COMPRESSIBLE_PREFIXES):
+        return True
+    if content_type in INCOMPRESSIBLE_TYPES or content_type.startswith(INCOMPRESSIBLE_PREFIXES):
+        return False
+    return None
+
+def worth_compressing(content_type, path, size):
+    """
+    Decides from the content type, and for unknown types from how well the first SAMPLE_SIZE bytes compress.
+    """
+    if size < MIN_SIZE:
+        return False
+
+    known = compressible_type(content_type)
+    if known is not None:
+        return known
+
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    # Fastest level, it's only an estimate
+    return len(zlib.compress(sample, 1)) < len(sample) * MAX_RATIO
+
+def compress_file(source_path, target_path, codec):
+    """
+    Writes a compressed copy of source_path to target_path (temp file renamed into place).
+    Returns the compressed size.
+    """
+    directory = os.path.dirname(target_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+
+    compressor = codec.compressobj()
+    written = 0
+    try:
+        with open(source_path, 'rb') as source, os.fdopen(fd, 'wb') as out:
+            while data := source.read(READ_SIZE):
+                data = compressor.compress(data)
+                out.write(data)
+                written += len(data)
+            data = compressor.flush()
+            out.write(data)
+            written += len(data)
+        metrics.BLOB_BYTES_WRITTEN.inc(written)
+        os.replace(temp_path, target_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return written
+
+class DecompressingFile(io.RawIOBase):
+    """
+    Read-only file with the original content of a compressed blob.
+    Seeking is lazy: forward decodes and skips, backward starts over,
+    so a seek to the end (FileResponse asks for the length that way) costs nothing.
+    Content is decoded READ_SIZE bytes at a time, however well the blob compressed.
+    """
+    def __init__(self, raw, codec, size):
+        super().__init__()
+        self.raw = raw
+        self.codec = codec
+        self.size = size
+        self.position = 0
+        self.restart()
+
+    def restart(self):
+        self.raw.seek(0)
+        self.decoded = self.codec.reader(self.raw)
+        # Last decoded piece, pending[0] is at offset in the original content
+        self.pending = b''
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        if self.position < self.offset:
+            self.restart()
+
+        # Skip (or decode up to) the requested position
+        while self.offset + len(self.pending) <= self.position:
+            self.offset += len(self.pending)
+            self.pending = self.decoded.read(READ_SIZE)
+            if not self.pending:
+                return 0
+
+        # Copied straight out of the decoded piece, which stays as it is until the next one
+        start = self.position - self.offset
+        count = min(len(buffer), len(self.pending) - start)
+        buffer[:count] = memoryview(self.pending)[start:start + count]
+        self.position += count
+        return count
+
+    def close(self):
+        self.raw.close()
+        super().close()
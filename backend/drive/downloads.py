@@ -0,0 +1,307 @@
+import os
+import re
+import uuid
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from core import metrics
+from .chunkstore import open_blob
+from .compression import get_codec
+from .executor import run_io
+from .storage import blob_storage
+
+# Read buffer when streaming a byte range
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Past this many ranges the request is served whole (RFC 9110 lets us ignore Range)
+MAX_RANGES = 16
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+def make_download_token(file_ref):
+    """
+    Signed, expiring token for a FileReference, lets a plain link or <video> tag download without a JWT header.
+    """
+    return signing.TimestampSigner(salt='drive.download').sign(str(file_ref.id))
+
+def check_download_token(token, file_id):
+    try:
+        value = signing.TimestampSigner(salt='drive.download').unsign(
+            token, max_age=settings.DOWNLOAD_URL_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return value == str(file_id)
+
+def parse_range_header(header, size):
+    """
+    Parses 'bytes=0-99,200-,-500' into [(start, end), ...] with inclusive ends.
+    Returns None when the header should be ignored and [] when nothing in it is satisfiable.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        match = RANGE_RE.match(part)
+        if not match:
+            return None
+        first, last = match.groups()
+
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+def open_stored(blob):
+    # The bytes on disk, still compressed
+    return open(blob.file.path, 'rb')
+
+def iter_range(blob, start, length, opener=open_blob):
+    with opener(blob) as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            metrics.BLOB_BYTES_READ.inc(len(data))
+            yield data
+
+def iter_multipart(blob, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        yield from iter_range(blob, start, end - start + 1)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+async def aiter_range(blob, start, length, opener=open_blob):
+    """
+    iter_range for ASGI, the reads happen in the I/O pool.
+    Django would otherwise buffer a sync iterator entirely before sending it.
+    A chunked blob's manifest must be loaded already, there's no ORM in the pool.
+    """
+    f = await run_io(opener, blob)
+    try:
+        await run_io(f.seek, start)
+        while length > 0:
+            data = await run_io(f.read, min(STREAM_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            metrics.BLOB_BYTES_READ.inc(len(data))
+            yield data
+    finally:
+        await run_io(f.close)
+
+async def aiter_multipart(blob, ranges, size, content_type, boundary):
+    for start, end in ranges:
+        yield (
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        async for data in aiter_range(blob, start, end - start + 1):
+            yield data
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+def multipart_length(ranges, size, content_type, boundary):
+    # Headers are fixed-size strings, so the body length is known without building it
+    length = len(f"--{boundary}--\r\n")
+    for start, end in ranges:
+        length += len(
+            f"--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        )
+        length += end - start + 1 + 2
+    return length
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+def sendfile_response(blob):
+    """
+    Hands the byte shuffling to the front proxy (nginx X-Accel-Redirect or Apache/lighttpd X-Sendfile).
+    """
+    response = HttpResponse()
+    if settings.DOWNLOAD_SENDFILE_MODE == 'x-accel':
+        response['X-Accel-Redirect'] = settings.DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + blob.file.name
+    else:
+        response['X-Sendfile'] = blob.file.path
+    # Let the proxy pick its own type from our header rather than guessing from the hashed name
+    del response['Content-Type']
+    return response
+
+def accepts_encoding(header, encoding):
+    """
+    Whether an Accept-Encoding header lists encoding with a non-zero quality.
+    """
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        if name.strip().lower() != encoding:
+            continue
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def build_download_response(request, file_ref, asynchronous=False):
+    """
+    Streams the content of a FileReference.
+    Strong ETag from the SHA-256 (content under an id never changes), conditional GET,
+    single and multi-part byte ranges, and an optional proxy offload mode.
+    A compressed blob goes out as stored when the client accepts its encoding (and asks for no range),
+    otherwise it's decompressed on the fly.
+    asynchronous=True streams with async iterators, for the ASGI views.
+    """
+    blob = file_ref.blob
+    content_type = blob.content_type or 'application/octet-stream'
+
+    codec = get_codec(blob.codec)
+    encoding = None
+    if codec and not request.headers.get('Range') and accepts_encoding(request.headers.get('Accept-Encoding'), codec.name):
+        encoding = codec.name
+
+    # Each representation has its own strong ETag
+    etag = f'"{blob.sha256_hash}-{encoding}"' if encoding else f'"{blob.sha256_hash}"'
+
+    common_headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Content-Disposition': content_disposition_header(True, os.path.basename(file_ref.filename)),
+    }
+    if codec:
+        common_headers['Vary'] = 'Accept-Encoding'
+
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponse(status=304)
+        for header in ('ETag', 'Cache-Control', 'Vary'):
+            if header in common_headers:
+                response[header] = common_headers[header]
+        return response
+
+    # The proxy only knows plain files, chunked and compressed blobs are always streamed from here
+    if settings.DOWNLOAD_SENDFILE_MODE and not blob.chunked and not codec:
+        response = sendfile_response(blob)
+        response['Content-Type'] = content_type
+    elif encoding:
+        response = stream_stored(blob, content_type, asynchronous)
+        response['Content-Encoding'] = encoding
+    else:
+        response = stream_blob(request, blob, content_type, etag, asynchronous)
+
+    for header, value in common_headers.items():
+        response[header] = value
+    return response
+
+def stream_stored(blob, content_type, asynchronous=False):
+    """
+    The compressed bytes as they are on disk, no decompression on our side.
+    """
+    if asynchronous:
+        response = StreamingHttpResponse(
+            aiter_range(blob, 0, blob.stored_size, opener=open_stored), content_type=content_type
+        )
+    else:
+        response = FileResponse(open_stored(blob), content_type=content_type)
+        metrics.BLOB_BYTES_READ.inc(blob.stored_size)
+    response['Content-Length'] = blob.stored_size
+    return response
+
+def stream_blob(request, blob, content_type, etag, asynchronous=False):
+    size = blob.size
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and request.method == 'GET':
+        # If-Range: only honour the range when the client's copy is still current
+        if_range = request.headers.get('If-Range')
+        if not if_range or if_range.strip() == etag:
+            ranges = parse_range_header(range_header, size)
+
+    if ranges is None and asynchronous:
+        response = StreamingHttpResponse(aiter_range(blob, 0, size), content_type=content_type)
+        response['Content-Length'] = size
+        return response
+
+    if ranges is None:
+        # Whole file, FileResponse uses the server's zero-copy file wrapper when available
+        response = FileResponse(open_blob(blob), content_type=content_type)
+        response['Content-Length'] = size
+        # The server's file wrapper reads it, counted up front
+        metrics.BLOB_BYTES_READ.inc(size)
+        return response
+
+    if not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        iterator = aiter_range if asynchronous else iter_range
+        response = StreamingHttpResponse(
+            iterator(blob, start, end - start + 1), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = end - start + 1
+        return response
+
+    boundary = uuid.uuid4().hex
+    iterator = aiter_multipart if asynchronous else iter_multipart
+    response = StreamingHttpResponse(
+        iterator(blob, ranges, size, content_type, boundary),
+        status=206,
+        content_type=f"multipart/byteranges; boundary={boundary}"
+    )
+    response['Content-Length'] = multipart_length(ranges, size, content_type, boundary)
+    return response
+
+def build_preview_response(request, derivative):
+    """
+    A ready preview. Named by the blob hash, so it never changes either: same caching and ETag rules as the blob.
+    """
+    etag = f'"{derivative.blob_id}-{derivative.kind}"'
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(open(blob_storage.path(derivative.file), 'rb'), content_type=derivative.content_type)
+        response['Content-Length'] = derivative.size
+        metrics.BLOB_BYTES_READ.inc(derivative.size)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,10 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+# Blocking file reads/writes and hashing of the async views run here, never on the event loop.
+# Bounded, so thousands of open connections share a handful of threads. No ORM calls in this pool.
+IO_POOL = ThreadPoolExecutor(max_workers=settings.ASYNC_IO_THREADS, thread_name_prefix='drive-io')
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(IO_POOL, func, *args)
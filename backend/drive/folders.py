@@ -0,0 +1,158 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import F
+from .models import Folder
+
+def split_path(filename):
+    """
+    'a/b/c.png' -> ('a/b', 'c.png'), root files have an empty parent.
+    """
+    parent, _, name = filename.strip('/').rpartition('/')
+    return parent, name
+
+def ancestors(parent_path):
+    """
+    Every folder containing parent_path, itself included: 'a/b' -> ['a', 'a/b'].
+    """
+    if not parent_path:
+        return []
+    parts = parent_path.split('/')
+    return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+def ensure_folder(user_id, path):
+    """
+    Creates the folder row if missing and bumps its parent's folder_count when it's new.
+    The parent has to exist already.
+    """
+    parent, name = split_path(path)
+    _, created = Folder.objects.get_or_create(
+        user_id=user_id,
+        path=path,
+        defaults={'parent_path': parent, 'name': name}
+    )
+    if created and parent:
+        Folder.objects.filter(user_id=user_id, path=parent).update(folder_count=F('folder_count') + 1)
+
+def ensure_folders(user_id, parent_path):
+    """
+    Creates any missing folder along parent_path.
+    """
+    for path in ancestors(parent_path):
+        ensure_folder(user_id, path)
+
+def add_file(user_id, filename, size):
+    parent_path, _ = split_path(filename)
+    if not parent_path:
+        return
+
+    with transaction.atomic():
+        ensure_folders(user_id, parent_path)
+
+        # One UPDATE for the whole chain of ancestors
+        Folder.objects.filter(user_id=user_id, path__in=ancestors(parent_path)).update(
+            total_files=F('total_files') + 1,
+            total_size=F('total_size') + size
+        )
+        Folder.objects.filter(user_id=user_id, path=parent_path).update(file_count=F('file_count') + 1)
+
+def add_files(user_id, files):
+    """
+    Batch version of add_file for (filename, size) pairs: one UPDATE per touched folder.
+    """
+    totals = defaultdict(lambda: [0, 0, 0])  # path -> [direct files, total files, total size]
+    for filename, size in files:
+        parent_path, _ = split_path(filename)
+        if not parent_path:
+            continue
+        totals[parent_path][0] += 1
+        for path in ancestors(parent_path):
+            totals[path][1] += 1
+            totals[path][2] += size
+
+    if not totals:
+        return
+
+    with transaction.atomic():
+        existing = set(
+            Folder.objects.filter(user_id=user_id, path__in=totals).values_list('path', flat=True)
+        )
+
+        # Parents sort before children, so folder_count bumps land on existing rows
+        for path in sorted(set(totals) - existing, key=len):
+            ensure_folder(user_id, path)
+
+        for path, (direct, total_files, total_size) in totals.items():
+            Folder.objects.filter(user_id=user_id, path=path).update(
+                file_count=F('file_count') + direct,
+                total_files=F('total_files') + total_files,
+                total_size=F('total_size') + total_size
+            )
+
+def remove_file(user_id, filename, size):
+    parent_path, _ = split_path(filename)
+    if not parent_path:
+        return
+
+    paths = ancestors(parent_path)
+    with transaction.atomic():
+        Folder.objects.filter(user_id=user_id, path__in=paths).update(
+            total_files=F('total_files') - 1,
+            total_size=F('total_size') - size
+        )
+        Folder.objects.filter(user_id=user_id, path=parent_path).update(file_count=F('file_count') - 1)
+
+        # Folders are implicit, so one without files below it disappears
+        empty = list(
+            Folder.objects.filter(user_id=user_id, path__in=paths, total_files=0)
+            .values_list('path', flat=True)
+        )
+        if empty:
+            Folder.objects.filter(user_id=user_id, path__in=empty).delete()
+
+            # Only the topmost removed folder has a surviving parent
+            top_parent, _ = split_path(min(empty, key=len))
+            if top_parent:
+                Folder.objects.filter(user_id=user_id, path=top_parent).update(folder_count=F('folder_count') - 1)
+
+def remove_files(user_id, files):
+    """
+    Batch version of remove_file for (filename, size) pairs.
+    """
+    totals = defaultdict(lambda: [0, 0, 0])  # path -> [direct files, total files, total size]
+    for filename, size in files:
+        parent_path, _ = split_path(filename)
+        if not parent_path:
+            continue
+        totals[parent_path][0] += 1
+        for path in ancestors(parent_path):
+            totals[path][1] += 1
+            totals[path][2] += size
+
+    if not totals:
+        return
+
+    with transaction.atomic():
+        for path, (direct, total_files, total_size) in totals.items():
+            Folder.objects.filter(user_id=user_id, path=path).update(
+                file_count=F('file_count') - direct,
+                total_files=F('total_files') - total_files,
+                total_size=F('total_size') - total_size
+            )
+
+        empty = set(
+            Folder.objects.filter(user_id=user_id, path__in=totals, total_files=0)
+            .values_list('path', flat=True)
+        )
+        if not empty:
+            return
+
+        Folder.objects.filter(user_id=user_id, path__in=empty).delete()
+
+        # Surviving parents lose one sub folder per removed child
+        lost = defaultdict(int)
+        for path in empty:
+            parent, _ = split_path(path)
+            if parent and parent not in empty:
+                lost[parent] += 1
+        for parent, count in lost.items():
+            Folder.objects.filter(user_id=user_id, path=parent).update(folder_count=F('folder_count') - count)
@@ -0,0 +1,236 @@
+import os
+import shutil
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import PhysicalBlob, UploadSession, Chunk, Derivative
+from .services import discard_session, unlink_chunks
+from .uploadhandlers import STAGING_DIR
+from .storage import blob_storage, BLOB_ROOT
+from .chunkstore import CHUNK_ROOT, chunk_name
+from .previews import PREVIEW_ROOT
+from user import quota
+
+def grace_cutoff(grace_period=None):
+    if grace_period is None:
+        grace_period = settings.BLOB_GC_GRACE_PERIOD
+    return timezone.now() - timedelta(seconds=grace_period)
+
+# Suffix of files reclaim_tombstones moved aside, purged once their rows are gone for good.
+# A crash in between leaves them to sweep_orphan_files.
+TRASH_SUFFIX = '.reclaimed'
+
+def trash_files(names):
+    """
+    Renames files away from their content-addressed names, returns the [(name, trash name)] moved.
+    """
+    moved = []
+    try:
+        for name in names:
+            trash = f"{name}{TRASH_SUFFIX}"
+            try:
+                os.replace(blob_storage.path(name), blob_storage.path(trash))
+            except FileNotFoundError:
+                continue
+            moved.append((name, trash))
+    except BaseException:
+        restore_files(moved)
+        raise
+    return moved
+
+def restore_files(moved):
+    for name, trash in moved:
+        os.replace(blob_storage.path(trash), blob_storage.path(name))
+
+def reclaim_tombstones(grace_period=None, batch_size=500, dry_run=False, hashes=None):
+    """
+    Deletes blobs that have had no references for longer than the grace period, batch by batch.
+    hashes limits it to those blobs.
+    Files are moved aside in the same transaction as the rows, while those are still locked:
+    an upload of the same content waits on the lock, so it only writes its file once the old one is out of the way.
+    A rollback puts the files back, they're only deleted once the rows are gone for good.
+    Returns (blobs, bytes) reclaimed.
+    """
+    cutoff = grace_cutoff(grace_period)
+    reclaimed = freed = 0
+    last_hash = ''
+
+    candidates = PhysicalBlob.objects.all()
+    if hashes is not None:
+        candidates = candidates.filter(sha256_hash__in=hashes)
+
+    while True:
+        trashed = []
+        try:
+            with transaction.atomic():
+                # skip_locked: rows an upload is reviving right now are left for the next run
+                batch = list(
+                    candidates.select_for_update(skip_locked=True)
+                    .filter(ref_count=0, deleted_at__lt=cutoff, sha256_hash__gt=last_hash)
+                    .order_by('sha256_hash')
+                    .values_list('sha256_hash', 'file', 'size')[:batch_size]
+                )
+                if not batch:
+                    break
+                last_hash = batch[-1][0]
+
+                if not dry_run:
+                    batch_hashes = [file_hash for file_hash, _, _ in batch]
+                    # Previews go with their blob (cascade), their files with the blob file
+                    names = [name for _, name, _ in batch if name]
+                    names += Derivative.objects.filter(blob__in=batch_hashes).exclude(file='').values_list('file', flat=True)
+                    # Chunked blobs hand their chunks back, reclaim_chunks takes the ones left unused
+                    unlink_chunks(batch_hashes)
+                    PhysicalBlob.objects.filter(sha256_hash__in=batch_hashes, ref_count=0).delete()
+                    trashed = trash_files(names)
+        except BaseException:
+            restore_files(trashed)
+            raise
+
+        for _, trash in trashed:
+            blob_storage.delete(trash)
+
+        reclaimed += len(batch)
+        freed += sum(size for _, _, size in batch)
+
+    return reclaimed, freed
+
+def reclaim_chunks(grace_period=None, batch_size=500, dry_run=False):
+    """
+    Deletes chunks no manifest has used for longer than the grace period, like reclaim_tombstones.
+    Returns (chunks, bytes) reclaimed.
+    """
+    cutoff = grace_cutoff(grace_period)
+    reclaimed = freed = 0
+    last_hash = ''
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Chunk.objects.select_for_update(skip_locked=True)
+                .filter(ref_count=0, deleted_at__lt=cutoff, sha256_hash__gt=last_hash)
+                .order_by('sha256_hash')
+                .values_list('sha256_hash', 'size')[:batch_size]
+            )
+            if not batch:
+                break
+            last_hash = batch[-1][0]
+
+            if not dry_run:
+                Chunk.objects.filter(sha256_hash__in=[chunk_hash for chunk_hash, _ in batch], ref_count=0).delete()
+
+        if not dry_run:
+            revived = set(
+                Chunk.objects.filter(sha256_hash__in=[chunk_hash for chunk_hash, _ in batch])
+                .values_list('sha256_hash', flat=True)
+            )
+            for chunk_hash, _ in batch:
+                if chunk_hash not in revived:
+                    blob_storage.delete(chunk_name(chunk_hash))
+
+        reclaimed += len(batch)
+        freed += sum(size for _, size in batch)
+
+    return reclaimed, freed
+
+def iter_blob_files(root=BLOB_ROOT):
+    """
+    Storage names of every file under blobs/ (or chunks/, previews/), staging area excluded.
+    """
+    root = blob_storage.path(root)
+    staging = blob_storage.path(STAGING_DIR)
+    for directory, subdirs, files in os.walk(root):
+        if directory == staging:
+            subdirs[:] = []
+            continue
+        for filename in files:
+            yield os.path.relpath(os.path.join(directory, filename), blob_storage.location).replace('\\', '/')
+
+def sweep_orphan_files(grace_period=None, batch_size=1000, dry_run=False):
+    """
+    Removes files under blobs/ that no PhysicalBlob row points to, files under chunks/ without a Chunk row
+    and files under previews/ without a Derivative row.
+    Files younger than the grace period are skipped, they may belong to an upload that hasn't committed yet.
+    Returns the number of files removed.
+    """
+    cutoff = grace_cutoff(grace_period).timestamp()
+    removed = 0
+
+    def known_blob_files(names):
+        return set(PhysicalBlob.objects.filter(file__in=names).values_list('file', flat=True))
+
+    def known_chunk_files(names):
+        # Chunk files are named by their hash
+        hashes = {name.rsplit('/', 1)[-1]: name for name in names}
+        known = Chunk.objects.filter(sha256_hash__in=hashes).values_list('sha256_hash', flat=True)
+        return {hashes[chunk_hash] for chunk_hash in known}
+
+    def known_preview_files(names):
+        return set(Derivative.objects.filter(file__in=names).values_list('file', flat=True))
+
+    def flush(names, known_files):
+        known = known_files(names)
+        orphans = [name for name in names if name not in known]
+        if not dry_run:
+            for name in orphans:
+                blob_storage.delete(name)
+        return len(orphans)
+
+    roots = ((BLOB_ROOT, known_blob_files), (CHUNK_ROOT, known_chunk_files), (PREVIEW_ROOT, known_preview_files))
+    for root, known_files in roots:
+        batch = []
+        for name in iter_blob_files(root):
+            try:
+                if os.path.getmtime(blob_storage.path(name)) > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+
+            batch.append(name)
+            if len(batch) >= batch_size:
+                removed += flush(batch, known_files)
+                batch = []
+
+        if batch:
+            removed += flush(batch, known_files)
+
+    # Leftovers of interrupted single uploads
+    staging = blob_storage.path(STAGING_DIR)
+    if os.path.isdir(staging):
+        for filename in os.listdir(staging):
+            path = os.path.join(staging, filename)
+            if os.path.getmtime(path) <= cutoff:
+                removed += 1
+                if not dry_run:
+                    os.remove(path)
+
+    return removed
+
+def expire_upload_sessions(grace_period=None, dry_run=False):
+    """
+    Drops resumable upload sessions (and their staged chunks) nobody committed in time.
+    """
+    stale = UploadSession.objects.filter(created_at__lt=grace_cutoff(grace_period))
+    count = 0
+    for session in stale.iterator():
+        count += 1
+        if not dry_run:
+            discard_session(session)
+
+    # Chunk folders whose session row is already gone
+    uploads = os.path.join(settings.MEDIA_ROOT, 'uploads')
+    if os.path.isdir(uploads):
+        live = {str(pk) for pk in UploadSession.objects.values_list('id', flat=True)}
+        cutoff = grace_cutoff(grace_period).timestamp()
+        for name in os.listdir(uploads):
+            path = os.path.join(uploads, name)
+            if name not in live and os.path.getmtime(path) <= cutoff and not dry_run:
+                shutil.rmtree(path, ignore_errors=True)
+
+    return count
+
+def expire_reservations(grace_period=None, dry_run=False):
+    if grace_period is None:
+        grace_period = settings.BLOB_GC_GRACE_PERIOD
+    return quota.expire_reservations(grace_period, dry_run)
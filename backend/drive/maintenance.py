@@ -0,0 +1,102 @@
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import PhysicalBlob, FileReference, MaintenanceJob
+from . import gc
+
+def recompute_ref_counts(hashes, dry_run=False):
+    """
+    Sets ref_count (and the tombstone) of the given blobs from their actual references.
+    Blobs are locked like uploads and deletes do, so counts can't move while we compare.
+    Returns [(blob, previous ref_count, previous deleted_at)] for the blobs that drifted.
+    """
+    with transaction.atomic():
+        blobs = list(PhysicalBlob.objects.select_for_update().filter(sha256_hash__in=hashes))
+
+        counts = dict(
+            FileReference.objects.filter(blob_id__in=[blob.sha256_hash for blob in blobs])
+            .values('blob_id').annotate(total=Count('id'))
+            .values_list('blob_id', 'total')
+        )
+
+        now = timezone.now()
+        fixes = []
+        for blob in blobs:
+            actual = counts.get(blob.sha256_hash, 0)
+
+            # Tombstone has to agree with the count too
+            tombstone = blob.deleted_at
+            if actual == 0 and tombstone is None:
+                tombstone = now
+            elif actual > 0:
+                tombstone = None
+
+            if blob.ref_count != actual or blob.deleted_at != tombstone:
+                fixes.append((blob, blob.ref_count, blob.deleted_at))
+                blob.ref_count = actual
+                blob.deleted_at = tombstone
+
+        if fixes and not dry_run:
+            PhysicalBlob.objects.bulk_update([blob for blob, _, _ in fixes], ['ref_count', 'deleted_at'])
+
+    return fixes
+
+def iter_job_batches(job, batch_size):
+    """
+    The job's blob hashes batch by batch, every blob when it has no selection.
+    """
+    if job.blob_hashes is not None:
+        for start in range(0, len(job.blob_hashes), batch_size):
+            yield job.blob_hashes[start:start + batch_size]
+        return
+
+    last_hash = ''
+    while True:
+        batch = list(
+            PhysicalBlob.objects.filter(sha256_hash__gt=last_hash)
+            .order_by('sha256_hash').values_list('sha256_hash', flat=True)[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_hash = batch[-1]
+
+def claim_job():
+    """
+    Oldest pending job, marked running. skip_locked lets several workers share the queue.
+    """
+    with transaction.atomic():
+        job = (
+            MaintenanceJob.objects.select_for_update(skip_locked=True)
+            .filter(status=MaintenanceJob.PENDING).order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        job.status = MaintenanceJob.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+def run_job(job, batch_size=500):
+    """
+    Works through a claimed job, saving progress after every batch so the admin can follow it.
+    """
+    try:
+        for batch in iter_job_batches(job, batch_size):
+            if job.kind == MaintenanceJob.RECOMPUTE_REF_COUNTS:
+                changed = len(recompute_ref_counts(batch))
+            else:
+                # Explicitly requested, so no grace period
+                changed, _ = gc.reclaim_tombstones(grace_period=0, batch_size=batch_size, hashes=batch)
+
+            job.processed += len(batch)
+            job.changed += changed
+            job.save(update_fields=['processed', 'changed'])
+    except Exception as e:
+        job.status = MaintenanceJob.FAILED
+        job.error = repr(e)
+    else:
+        job.status = MaintenanceJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
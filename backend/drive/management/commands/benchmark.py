@@ -0,0 +1,245 @@
+import hashlib
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from collections import Counter
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from drive.models import PhysicalBlob, FileReference
+from drive.services import upload_batch, delete_references
+from user.models import UserProfile
+
+BENCH_PASSWORD = 'bench-password-123'
+
+# Rows per upload_batch call while seeding
+SEED_BATCH_SIZE = 500
+
+def percentile(samples, pct):
+    # Nearest-rank, good enough for latency reporting
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+class Command(BaseCommand):
+    help = (
+        "Seeds synthetic users and files, then measures throughput, p50/p99 latency and queries per request "
+        "for upload, list, delete and profile at each dataset size. Prints JSON for comparing runs. "
+        "Uses the configured database, run it against a local Postgres/SQLite you don't mind writing to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000',
+                            help="Comma separated files per user, one benchmark round per size")
+        parser.add_argument('--users', type=int, default=2, help="Users seeded per round")
+        parser.add_argument('--duplicate-ratio', type=float, default=0.3,
+                            help="Share of seeded files whose content already exists (0-1)")
+        parser.add_argument('--folder-depth', type=int, default=3, help="Deepest folder nesting of seeded files")
+        parser.add_argument('--file-size', type=int, default=1024, help="Bytes per synthetic file")
+        parser.add_argument('--requests', type=int, default=50, help="Measured requests per endpoint and round")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, same seed = same dataset")
+        parser.add_argument('--with-cache', action='store_true',
+                            help="Keep the configured cache (response caching and throttles). "
+                                 "By default a dummy cache measures the uncached path without throttling")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+        parser.add_argument('--keep', action='store_true', help="Leave the seeded users and files in place")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be comma separated integers")
+        if not 0 <= options['duplicate_ratio'] <= 1:
+            raise CommandError("--duplicate-ratio must be between 0 and 1")
+        if options['requests'] < 1:
+            raise CommandError("--requests must be at least 1")
+
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.content_pool = []
+        self.created_hashes = set()
+        self.users = []
+
+        overrides = {'MEDIA_ROOT': tempfile.mkdtemp(prefix='vinnodrive-bench-')}
+        if not options['with_cache']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+        results = {
+            'database': connection.vendor,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'options': {
+                key: options[key] for key in
+                ('users', 'duplicate_ratio', 'folder_depth', 'file_size', 'requests', 'seed', 'with_cache')
+            },
+            'rounds': [],
+        }
+
+        try:
+            with override_settings(**overrides):
+                for size in sizes:
+                    results['rounds'].append(self.run_round(size))
+        finally:
+            if not options['keep']:
+                self.cleanup()
+            shutil.rmtree(overrides['MEDIA_ROOT'], ignore_errors=True)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    # Seeding
+
+    def make_content(self):
+        """
+        (hash, bytes) of the next synthetic file, reusing earlier content at the duplicate ratio.
+        """
+        if self.content_pool and self.random.random() < self.options['duplicate_ratio']:
+            return self.random.choice(self.content_pool)
+
+        data = self.random.randbytes(self.options['file_size'])
+        content = (hashlib.sha256(data).hexdigest(), data)
+        self.content_pool.append(content)
+        return content
+
+    def make_filename(self, index):
+        depth = self.random.randint(0, self.options['folder_depth'])
+        folders = [f"dir{self.random.randint(0, 9)}" for _ in range(depth)]
+        return '/'.join(folders + [f"file{index}.bin"])
+
+    def seed_user(self, size):
+        user = User.objects.create_user(f"bench-{uuid.uuid4().hex[:12]}", password=BENCH_PASSWORD)
+        # Synthetic data must never hit the quota
+        UserProfile.objects.filter(user=user).update(storage_limit=2 ** 62)
+        self.users.append(user)
+
+        for start in range(0, size, SEED_BATCH_SIZE):
+            entries = []
+            for index in range(start, min(size, start + SEED_BATCH_SIZE)):
+                file_hash, data = self.make_content()
+                entries.append({
+                    'filename': self.make_filename(index),
+                    'hash': file_hash,
+                    'file': SimpleUploadedFile('seed.bin', data, content_type='application/octet-stream'),
+                })
+                self.created_hashes.add(file_hash)
+            upload_batch(user, entries)
+
+        return user
+
+    def client_for(self, user):
+        client = APIClient()
+        response = client.post(
+            reverse('get_token'), {'username': user.username, 'password': BENCH_PASSWORD}, format='json'
+        )
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return client
+
+    # Measuring
+
+    def measure(self, endpoint, send, count):
+        """
+        Sends count requests one after the other, timing each and counting its queries.
+        """
+        latencies, queries, statuses = [], [], Counter()
+
+        started = time.perf_counter()
+        for index in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = send(index)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured))
+            statuses[response.status_code] += 1
+        elapsed = time.perf_counter() - started
+
+        return {
+            'endpoint': endpoint,
+            'requests': count,
+            'throughput_rps': round(count / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'mean': round(statistics.fmean(latencies), 3),
+                'max': round(max(latencies), 3),
+            },
+            'queries': {
+                'mean': round(statistics.fmean(queries), 2),
+                'max': max(queries),
+            },
+            'status': {str(code): total for code, total in sorted(statuses.items())},
+        }
+
+    def run_round(self, size):
+        count = self.options['requests']
+
+        seed_started = time.perf_counter()
+        users = [self.seed_user(size) for _ in range(self.options['users'])]
+        seed_seconds = time.perf_counter() - seed_started
+
+        user = users[0]
+        client = self.client_for(user)
+
+        def upload(index):
+            file_hash, data = self.make_content()
+            self.created_hashes.add(file_hash)
+            return client.post(reverse('upload_file'), {
+                'file': SimpleUploadedFile('upload.bin', data, content_type='application/octet-stream'),
+                'filename': f"bench-uploads/{uuid.uuid4().hex}.bin",
+                'hash': file_hash,
+                'size': len(data),
+            }, format='multipart')
+
+        def list_files(index):
+            return client.get(reverse('get_files'))
+
+        def profile(index):
+            return client.get(reverse('profile'))
+
+        # Deleted files are taken from the seeded ones, oldest first
+        victims = list(
+            FileReference.objects.filter(user=user).order_by('upload_timestamp').values_list('id', flat=True)[:count]
+        )
+
+        def delete(index):
+            return client.delete(reverse('delete_file', args=[victims[index]]))
+
+        endpoints = [
+            self.measure('upload_file', upload, count),
+            self.measure('get_files', list_files, count),
+            self.measure('profile', profile, count),
+        ]
+        if victims:
+            endpoints.append(self.measure('delete_file', delete, len(victims)))
+
+        for result in endpoints:
+            self.stderr.write(
+                f"[{size} files/user] {result['endpoint']:<12} {result['throughput_rps']:>9} req/s  "
+                f"p50 {result['latency_ms']['p50']:>8} ms  p99 {result['latency_ms']['p99']:>8} ms  "
+                f"{result['queries']['mean']:>6} queries"
+            )
+
+        return {
+            'files_per_user': size,
+            'users': len(users),
+            'seed_seconds': round(seed_seconds, 3),
+            'blobs': PhysicalBlob.objects.filter(sha256_hash__in=self.created_hashes).count(),
+            'endpoints': endpoints,
+        }
+
+    def cleanup(self):
+        for user in self.users:
+            delete_references(user, FileReference.objects.filter(user=user))
+        PhysicalBlob.objects.filter(sha256_hash__in=self.created_hashes, ref_count=0).delete()
+        User.objects.filter(id__in=[user.id for user in self.users]).delete()
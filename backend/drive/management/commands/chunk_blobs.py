@@ -0,0 +1,64 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from drive.models import PhysicalBlob
+from drive.services import chunk_blob
+
+class Command(BaseCommand):
+    help = (
+        "Moves flat blobs of at least CHUNK_STORE_MIN_BLOB_SIZE into the content-defined chunk store, "
+        "so versions of the same big file share their unchanged chunks. Needs CHUNK_STORE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-size', type=int, default=None,
+                            help="Smallest blob to chunk in bytes (default: settings.CHUNK_STORE_MIN_BLOB_SIZE)")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=0, help="Stop after this many blobs (0: all)")
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help="Keep running as a worker, picking up new blobs every SECONDS")
+
+    def handle(self, *args, **options):
+        if not settings.CHUNK_STORE:
+            raise CommandError("The chunk store is disabled, set VINNO_CHUNK_STORE")
+
+        min_size = options['min_size']
+        if min_size is None:
+            min_size = settings.CHUNK_STORE_MIN_BLOB_SIZE
+
+        while True:
+            self.convert(min_size, options['batch_size'], options['limit'])
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def convert(self, min_size, batch_size, limit):
+        converted = blob_bytes = chunk_bytes = 0
+        last_hash = ''
+
+        while not limit or converted < limit:
+            # Tombstones are left alone, the GC will most likely take them
+            batch = list(
+                PhysicalBlob.objects.filter(
+                    sha256_hash__gt=last_hash, chunked=False, size__gte=min_size, ref_count__gt=0
+                ).order_by('sha256_hash').values_list('sha256_hash', 'size')[:batch_size]
+            )
+            if not batch:
+                break
+            last_hash = batch[-1][0]
+
+            for file_hash, size in batch:
+                written = chunk_blob(file_hash)
+                if written is None:
+                    continue
+                converted += 1
+                blob_bytes += size
+                chunk_bytes += written
+                if limit and converted >= limit:
+                    break
+
+            self.stdout.write(f"Chunked {converted} blobs so far (up to {last_hash[:8]}...)")
+
+        self.stdout.write(
+            f"Chunked {converted} blobs: {blob_bytes} bytes of content, {chunk_bytes} bytes of new chunks stored"
+        )
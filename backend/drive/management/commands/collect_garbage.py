@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from drive import gc
+
+class Command(BaseCommand):
+    help = "Reclaims unreferenced blobs and chunks after their grace period, sweeps orphaned blob files, stale upload sessions and quota reservations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=None,
+                            help="Grace period in seconds (default: settings.BLOB_GC_GRACE_PERIOD)")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--skip-orphans', action='store_true',
+                            help="Don't walk MEDIA_ROOT/blobs/ and chunks/ looking for files without a row")
+        parser.add_argument('--dry-run', action='store_true', help="Report only, delete nothing")
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help="Keep running as a worker, collecting every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            self.collect(options)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def collect(self, options):
+        prefix = "[dry run] " if options['dry_run'] else ""
+
+        blobs, freed = gc.reclaim_tombstones(options['grace'], options['batch_size'], options['dry_run'])
+        self.stdout.write(f"{prefix}Reclaimed {blobs} blobs ({freed} bytes)")
+
+        # After the blobs, they release their chunks
+        chunks, freed = gc.reclaim_chunks(options['grace'], options['batch_size'], options['dry_run'])
+        self.stdout.write(f"{prefix}Reclaimed {chunks} chunks ({freed} bytes)")
+
+        sessions = gc.expire_upload_sessions(options['grace'], options['dry_run'])
+        self.stdout.write(f"{prefix}Expired {sessions} upload sessions")
+
+        reservations = gc.expire_reservations(options['grace'], options['dry_run'])
+        self.stdout.write(f"{prefix}Released {reservations} stale quota reservations")
+
+        if not options['skip_orphans']:
+            orphans = gc.sweep_orphan_files(options['grace'], dry_run=options['dry_run'])
+            self.stdout.write(f"{prefix}Removed {orphans} orphaned files")
@@ -0,0 +1,58 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from drive.compression import configured_codec
+from drive.models import PhysicalBlob
+from drive.services import compress_blob
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites flat blobs compressed with BLOB_COMPRESSION when their content type and a sample say "
+        "it pays off. Every blob is looked at once, the dedup hash doesn't change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=0, help="Stop after looking at this many blobs (0: all)")
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help="Keep running as a worker, picking up new blobs every SECONDS")
+
+    def handle(self, *args, **options):
+        try:
+            codec = configured_codec()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        if codec is None:
+            raise CommandError("Blob compression is off, set VINNO_BLOB_COMPRESSION")
+
+        while True:
+            self.compress(codec, options['batch_size'], options['limit'])
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def compress(self, codec, batch_size, limit):
+        examined = compressed = saved = 0
+        last_hash = ''
+
+        while not limit or examined < limit:
+            # Tombstones are left alone, the GC will most likely take them
+            batch = list(
+                PhysicalBlob.objects.filter(sha256_hash__gt=last_hash, chunked=False, codec='', ref_count__gt=0)
+                .order_by('sha256_hash').values_list('sha256_hash', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            last_hash = batch[-1]
+
+            for file_hash in batch:
+                examined += 1
+                result = compress_blob(file_hash, codec)
+                if result is not None:
+                    compressed += 1
+                    saved += result
+                if limit and examined >= limit:
+                    break
+
+            self.stdout.write(f"Looked at {examined} blobs so far (up to {last_hash[:8]}...)")
+
+        self.stdout.write(f"Compressed {compressed} of {examined} blobs with {codec.name}, {saved} bytes saved")
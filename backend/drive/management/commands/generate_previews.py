@@ -0,0 +1,96 @@
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from drive.models import Derivative, PhysicalBlob
+from drive.previews import preview_kinds, render_previews
+from drive.services import queue_previews, save_previews
+
+class Command(BaseCommand):
+    help = (
+        "Makes the previews (thumbnails, text excerpts) queued by the preview endpoint, "
+        "decoding in a pool of worker processes. --backfill queues every previewable blob first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default PREVIEW_WORKERS)")
+        parser.add_argument('--batch-size', type=int, default=50, help="Previews claimed at a time")
+        parser.add_argument('--backfill', action='store_true', help="Queue previews of every existing blob first")
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help="Keep running as a worker, picking up new previews every SECONDS")
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.backfill(options['batch_size'] * 10)
+
+        # spawn, not fork: children must not share the parent's database connection.
+        # They never touch the database, django.setup() is only there to unpickle the blobs.
+        pool = ProcessPoolExecutor(
+            max_workers=options['workers'] or settings.PREVIEW_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+        with pool:
+            while True:
+                self.generate(pool, options['batch_size'])
+                if not options['loop']:
+                    break
+                time.sleep(options['loop'])
+
+    def backfill(self, batch_size):
+        queued = 0
+        last_hash = ''
+        while True:
+            batch = list(
+                PhysicalBlob.objects.filter(sha256_hash__gt=last_hash, ref_count__gt=0)
+                .order_by('sha256_hash').only('sha256_hash', 'content_type')[:batch_size]
+            )
+            if not batch:
+                break
+            last_hash = batch[-1].sha256_hash
+            for blob in batch:
+                if preview_kinds(blob.content_type):
+                    queue_previews(blob)
+                    queued += 1
+        self.stdout.write(f"Queued previews of {queued} blobs")
+
+    def generate(self, pool, batch_size):
+        made = failed = 0
+        while True:
+            # Rows stay locked while the batch renders, skip_locked lets several generators share the queue
+            with transaction.atomic():
+                pending = list(
+                    Derivative.objects.select_for_update(skip_locked=True)
+                    .filter(status=Derivative.PENDING).order_by('created_at')[:batch_size]
+                )
+                if not pending:
+                    break
+
+                by_blob = defaultdict(list)
+                for derivative in pending:
+                    by_blob[derivative.blob_id].append(derivative)
+                blobs = PhysicalBlob.objects.in_bulk(list(by_blob))
+
+                futures = {}
+                for blob_hash, derivatives in by_blob.items():
+                    blob = blobs[blob_hash]
+                    # Workers have no database, chunked blobs go with their manifest
+                    if blob.chunked:
+                        blob.manifest
+                    kinds = [derivative.kind for derivative in derivatives]
+                    futures[blob_hash] = pool.submit(render_previews, blob, kinds)
+
+                for blob_hash, future in futures.items():
+                    results = future.result()
+                    save_previews(blobs[blob_hash], by_blob[blob_hash], results)
+                    made += len(results)
+                    failed += len(by_blob[blob_hash]) - len(results)
+
+            self.stdout.write(f"Made {made} previews so far, {failed} failed")
+
+        if made or failed:
+            self.stdout.write(f"Made {made} previews, {failed} failed")
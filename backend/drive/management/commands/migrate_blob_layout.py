@@ -0,0 +1,80 @@
+import os
+import shutil
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from drive.models import PhysicalBlob
+from drive.storage import blob_storage, blob_name
+
+class Command(BaseCommand):
+    help = "Moves blobs stored under the old flat blobs/ layout to content-addressed blobs/ab/cd/<sha256> names."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to pause between batches, to go easy on a live server")
+        parser.add_argument('--dry-run', action='store_true', help="Report only, move nothing")
+
+    def handle(self, *args, **options):
+        moved = missing = 0
+        last_hash = ''
+
+        while True:
+            # Chunked and compressed blobs were only ever written with the new layout
+            batch = list(
+                PhysicalBlob.objects.filter(sha256_hash__gt=last_hash, chunked=False, codec__in=['', 'identity'])
+                .order_by('sha256_hash')
+                .values_list('sha256_hash', 'file')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_hash = batch[-1][0]
+
+            for file_hash, old_name in batch:
+                new_name = blob_name(file_hash)
+                if old_name == new_name:
+                    continue
+
+                if options['dry_run']:
+                    moved += 1
+                    continue
+
+                if not self.place(old_name, new_name):
+                    missing += 1
+                    self.stderr.write(f"Missing file for {file_hash}: {old_name}")
+                    continue
+
+                # Conditional so a blob rewritten meanwhile isn't clobbered
+                with transaction.atomic():
+                    updated = PhysicalBlob.objects.filter(sha256_hash=file_hash, file=old_name).update(file=new_name)
+
+                # The old name kept serving downloads until the row switched over
+                if updated:
+                    blob_storage.delete(old_name)
+                moved += 1
+
+            self.stdout.write(f"Moved {moved} blobs so far (up to {last_hash[:8]}...)")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        prefix = "[dry run] " if options['dry_run'] else ""
+        self.stdout.write(f"{prefix}Done: {moved} moved, {missing} missing")
+
+    def place(self, old_name, new_name):
+        """
+        Makes the content available under its new name while the old one still works.
+        A hard link costs no copy, a copy is the fallback across filesystems.
+        """
+        old_path = blob_storage.path(old_name)
+        new_path = blob_storage.path(new_name)
+        if not os.path.exists(old_path):
+            return os.path.exists(new_path)
+
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        temp_path = f"{new_path}.migrating"
+        try:
+            os.link(old_path, temp_path)
+        except OSError:
+            shutil.copy2(old_path, temp_path)
+        os.replace(temp_path, new_path)
+        return True
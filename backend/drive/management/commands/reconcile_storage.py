@@ -0,0 +1,120 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from drive.models import PhysicalBlob, FileReference
+from drive.maintenance import recompute_ref_counts
+from user.models import UserProfile, QuotaReservation
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes UserProfile.storage_used / storage_reserved and PhysicalBlob.ref_count "
+        "from the actual rows and fixes any drift. Chunked and resumable, safe to run nightly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift, change nothing")
+        parser.add_argument('--start-after-user', type=int, default=0,
+                            help="Resume the user pass after this user id")
+        parser.add_argument('--start-after-blob', default='',
+                            help="Resume the blob pass after this hash")
+        parser.add_argument('--skip-users', action='store_true')
+        parser.add_argument('--skip-blobs', action='store_true')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.prefix = "[dry run] " if self.dry_run else ""
+
+        if not options['skip_users']:
+            self.reconcile_users(options['batch_size'], options['start_after_user'])
+        if not options['skip_blobs']:
+            self.reconcile_blobs(options['batch_size'], options['start_after_blob'])
+
+    def reconcile_users(self, batch_size, last_id):
+        checked = drifted = created = 0
+
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+
+            with transaction.atomic():
+                # Profiles are locked before counting: a concurrent upload either finished
+                # (and is in the sums) or waits and applies its increment on top of our value
+                profiles = {
+                    profile.user_id: profile
+                    for profile in UserProfile.objects.select_for_update().filter(user_id__in=user_ids)
+                }
+
+                missing = [UserProfile(user_id=user_id) for user_id in user_ids if user_id not in profiles]
+                if missing:
+                    created += len(missing)
+                    if not self.dry_run:
+                        for profile in UserProfile.objects.bulk_create(missing):
+                            profiles[profile.user_id] = profile
+                    else:
+                        profiles.update({profile.user_id: profile for profile in missing})
+
+                # Only content the user stored counts (deduplicated files are free)
+                used = dict(
+                    FileReference.objects.filter(user_id__in=user_ids, is_primary_uploader=True)
+                    .values('user_id').annotate(total=Sum('blob__size'))
+                    .values_list('user_id', 'total')
+                )
+                reserved = dict(
+                    QuotaReservation.objects.filter(user_id__in=user_ids)
+                    .values('user_id').annotate(total=Sum('size'))
+                    .values_list('user_id', 'total')
+                )
+
+                fixes = []
+                for user_id, profile in profiles.items():
+                    actual_used = used.get(user_id) or 0
+                    actual_reserved = reserved.get(user_id) or 0
+                    if profile.storage_used != actual_used or profile.storage_reserved != actual_reserved:
+                        self.stdout.write(
+                            f"{self.prefix}user {user_id}: storage_used {profile.storage_used} -> {actual_used}, "
+                            f"storage_reserved {profile.storage_reserved} -> {actual_reserved}"
+                        )
+                        profile.storage_used = actual_used
+                        profile.storage_reserved = actual_reserved
+                        fixes.append(profile)
+
+                if fixes and not self.dry_run:
+                    UserProfile.objects.bulk_update(fixes, ['storage_used', 'storage_reserved'])
+
+            checked += len(user_ids)
+            drifted += len(fixes)
+            last_id = user_ids[-1]
+            self.stdout.write(f"Users checked: {checked} (resume with --start-after-user {last_id})")
+
+        self.stdout.write(f"{self.prefix}Users: {checked} checked, {drifted} drifted, {created} missing profiles")
+
+    def reconcile_blobs(self, batch_size, last_hash):
+        checked = drifted = 0
+
+        while True:
+            hashes = list(
+                PhysicalBlob.objects.filter(sha256_hash__gt=last_hash)
+                .order_by('sha256_hash').values_list('sha256_hash', flat=True)[:batch_size]
+            )
+            if not hashes:
+                break
+
+            fixes = recompute_ref_counts(hashes, dry_run=self.dry_run)
+            for blob, ref_count, deleted_at in fixes:
+                self.stdout.write(
+                    f"{self.prefix}blob {blob.sha256_hash[:12]}...: ref_count {ref_count} -> {blob.ref_count}"
+                    + (", tombstoned" if blob.deleted_at and not deleted_at else "")
+                    + (", revived" if deleted_at and not blob.deleted_at else "")
+                )
+
+            checked += len(hashes)
+            drifted += len(fixes)
+            last_hash = hashes[-1]
+            self.stdout.write(f"Blobs checked: {checked} (resume with --start-after-blob {last_hash})")
+
+        self.stdout.write(f"{self.prefix}Blobs: {checked} checked, {drifted} drifted")
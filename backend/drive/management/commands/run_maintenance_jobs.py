@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from drive.maintenance import claim_job, run_job
+
+class Command(BaseCommand):
+    help = "Runs the blob maintenance jobs queued from the admin (ref count recomputes, purges), batch by batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help="Keep running as a worker, checking for new jobs every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            while (job := claim_job()) is not None:
+                self.stdout.write(f"Running job {job.pk}: {job}")
+                run_job(job, options['batch_size'])
+                self.stdout.write(f"Job {job.pk} {job.status}: {job.processed} processed, {job.changed} changed"
+                                  + (f" ({job.error})" if job.error else ""))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,30 @@
+# Generated by Django 6.0 on 2026-10-18 19:03
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0002_filereference_is_primary_uploader_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('sha256_hash', models.CharField(max_length=64)),
+                ('filename', models.CharField(max_length=1024)),
+                ('size', models.BigIntegerField(help_text='Total file size in bytes')),
+                ('content_type', models.CharField(default='application/octet-stream', max_length=100)),
+                ('chunk_size', models.PositiveIntegerField(help_text='Size of every chunk except the last one')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 19:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0003_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filereference',
+            index=models.Index(fields=['user', '-upload_timestamp', '-id'], name='fileref_user_ts_id_idx'),
+        ),
+    ]
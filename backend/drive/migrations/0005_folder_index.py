@@ -0,0 +1,94 @@
+# Generated by Django 6.0 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_folder_index(apps, schema_editor):
+    """
+    Fills parent_path and the folder table for files uploaded before the index existed.
+    """
+    FileReference = apps.get_model('drive', 'FileReference')
+    Folder = apps.get_model('drive', 'Folder')
+
+    folders = {}
+    rows = FileReference.objects.values_list('id', 'user_id', 'filename', 'blob__size').iterator(chunk_size=2000)
+    for ref_id, user_id, filename, size in rows:
+        parent_path = filename.strip('/').rpartition('/')[0]
+        if not parent_path:
+            continue
+
+        FileReference.objects.filter(id=ref_id).update(parent_path=parent_path)
+
+        parts = parent_path.split('/')
+        for depth in range(1, len(parts) + 1):
+            path = '/'.join(parts[:depth])
+            key = (user_id, path)
+            if key not in folders:
+                folders[key] = Folder(
+                    user_id=user_id,
+                    path=path,
+                    parent_path='/'.join(parts[:depth - 1]),
+                    name=parts[depth - 1]
+                )
+                if depth > 1:
+                    folders[(user_id, '/'.join(parts[:depth - 1]))].folder_count += 1
+
+            folder = folders[key]
+            folder.total_files += 1
+            folder.total_size += size
+            if path == parent_path:
+                folder.file_count += 1
+
+    Folder.objects.bulk_create(folders.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0004_filereference_user_ts_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Folder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024)),
+                ('parent_path', models.CharField(default='', max_length=1024)),
+                ('name', models.CharField(max_length=255)),
+                ('file_count', models.PositiveIntegerField(default=0)),
+                ('folder_count', models.PositiveIntegerField(default=0)),
+                ('total_files', models.PositiveIntegerField(default=0)),
+                ('total_size', models.BigIntegerField(default=0, help_text='Bytes of all files below this folder')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='filereference',
+            name='parent_path',
+            field=models.CharField(default='', editable=False, max_length=1024),
+        ),
+        migrations.AddIndex(
+            model_name='filereference',
+            index=models.Index(fields=['user', 'parent_path'], name='fileref_user_parent_idx'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='folders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['user', 'parent_path'], name='folder_user_parent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='folder',
+            constraint=models.UniqueConstraint(fields=('user', 'path'), name='folder_unique_user_path'),
+        ),
+        migrations.RunPython(build_folder_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-18 19:06
+
+import os
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_filenames(apps, schema_editor):
+    """
+    Concurrent uploads could end up with the same path before the constraint existed.
+    Keep the oldest one and give the others a free name(N) variant.
+    """
+    FileReference = apps.get_model('drive', 'FileReference')
+
+    duplicates = (
+        FileReference.objects.values('user_id', 'filename')
+        .annotate(copies=Count('id'))
+        .filter(copies__gt=1)
+    )
+    for row in duplicates.iterator():
+        refs = FileReference.objects.filter(
+            user_id=row['user_id'], filename=row['filename']
+        ).order_by('upload_timestamp', 'id')
+
+        directory, filename = os.path.split(row['filename'])
+        name, ext = os.path.splitext(filename)
+        counter = 1
+        for ref in list(refs)[1:]:
+            while True:
+                candidate = os.path.join(directory, f"{name}({counter}){ext}").replace("\\", "/")
+                counter += 1
+                if not FileReference.objects.filter(user_id=row['user_id'], filename=candidate).exists():
+                    break
+            FileReference.objects.filter(id=ref.id).update(filename=candidate)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0005_folder_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_filenames, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='filereference',
+            constraint=models.UniqueConstraint(fields=('user', 'filename'), name='fileref_unique_user_filename'),
+        ),
+    ]
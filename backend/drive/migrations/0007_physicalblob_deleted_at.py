@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0006_filereference_unique_user_filename'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='physicalblob',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 19:09
+
+import drive.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0007_physicalblob_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='physicalblob',
+            name='file',
+            field=models.FileField(help_text='Actual file stored on local disk', max_length=255, storage=drive.storage.ContentAddressedStorage(), upload_to=drive.storage.blob_upload_to),
+        ),
+    ]
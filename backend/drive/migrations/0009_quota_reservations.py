@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-18 19:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def recount_physical_usage(apps, schema_editor):
+    """
+    storage_used used to be the logical size of every file.
+    Deduplicated files no longer count against the quota, only content the user stored does.
+    """
+    FileReference = apps.get_model('drive', 'FileReference')
+    UserProfile = apps.get_model('user', 'UserProfile')
+
+    usage = dict(
+        FileReference.objects.filter(is_primary_uploader=True)
+        .values('user_id')
+        .annotate(total=Sum('blob__size'))
+        .values_list('user_id', 'total')
+    )
+    profiles = list(UserProfile.objects.all())
+    for profile in profiles:
+        profile.storage_used = usage.get(profile.user_id) or 0
+    UserProfile.objects.bulk_update(profiles, ['storage_used'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0008_content_addressed_blob_storage'),
+        ('user', '0002_quota_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='reservation',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_session', to='user.quotareservation'),
+        ),
+        migrations.RunPython(recount_physical_usage, migrations.RunPython.noop),
+    ]
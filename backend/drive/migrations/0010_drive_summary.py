@@ -0,0 +1,40 @@
+# Generated by Django 6.0 on 2026-10-18 19:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0009_quota_reservations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriveSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_count', models.BigIntegerField(default=0)),
+                ('logical_bytes', models.BigIntegerField(default=0, help_text='Size of every file the user sees')),
+                ('physical_bytes', models.BigIntegerField(default=0, help_text='Bytes of content the user actually stored')),
+                ('duplicate_count', models.BigIntegerField(default=0, help_text="Files served from someone else's content")),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='drive_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ContentTypeUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_type', models.CharField(max_length=100)),
+                ('file_count', models.BigIntegerField(default=0)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='content_type_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'content_type'), name='ctusage_unique_user_type')],
+            },
+        ),
+    ]
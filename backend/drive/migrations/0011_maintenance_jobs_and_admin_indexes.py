@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0010_drive_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaintenanceJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recompute_ref_counts', 'Recompute ref counts'), ('purge_tombstones', 'Purge unreferenced blobs')], max_length=32)),
+                ('blob_hashes', models.JSONField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=16)),
+                ('processed', models.BigIntegerField(default=0, help_text='Blobs handled so far')),
+                ('changed', models.BigIntegerField(default=0, help_text='Blobs fixed or purged')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='filereference',
+            index=models.Index(fields=['-upload_timestamp'], name='fileref_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='physicalblob',
+            index=models.Index(fields=['size'], name='blob_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='physicalblob',
+            index=models.Index(fields=['content_type'], name='blob_content_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='physicalblob',
+            index=models.Index(fields=['ref_count'], name='blob_ref_count_idx'),
+        ),
+        migrations.AddField(
+            model_name='maintenancejob',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0012_chunk_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='physicalblob',
+            name='codec',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='physicalblob',
+            name='stored_size',
+            field=models.BigIntegerField(blank=True, help_text='Bytes on disk when compressed', null=True),
+        ),
+    ]
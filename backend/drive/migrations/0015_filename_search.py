@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_trigram_index(apps, schema_editor):
+    """
+    pg_trgm GIN index over (user, filename), serves ILIKE '%...%' and word similarity searches.
+    btree_gin lets user_id be part of it, so a search only walks the user's own entries.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS fileref_filename_trgm_idx "
+        "ON drive_filereference USING gin (user_id, filename gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS fileref_filename_trgm_idx")
+
+
+def build_trigram_table(apps, schema_editor):
+    """
+    Other databases search through FilenameTrigram, filled here for the files that already exist.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    FileReference = apps.get_model('drive', 'FileReference')
+    FilenameTrigram = apps.get_model('drive', 'FilenameTrigram')
+
+    rows = []
+    for ref_id, user_id, filename in FileReference.objects.values_list('id', 'user_id', 'filename').iterator():
+        filename = filename.lower()
+        for trigram in {filename[i:i + 3] for i in range(len(filename) - 2)}:
+            rows.append(FilenameTrigram(file_id=ref_id, user_id=user_id, trigram=trigram))
+        if len(rows) >= 10000:
+            FilenameTrigram.objects.bulk_create(rows)
+            rows = []
+    FilenameTrigram.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drive', '0014_previews'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilenameTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='drive.filereference')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'trigram', 'file'], name='trigram_user_trigram_idx')],
+            },
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+        migrations.RunPython(build_trigram_table, migrations.RunPython.noop),
+    ]
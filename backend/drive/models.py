@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils.functional import cached_property
 import uuid
+from .storage import blob_storage, blob_upload_to
 
 class PhysicalBlob(models.Model):
     """
@@ -15,7 +17,13 @@ class PhysicalBlob(models.Model):
         help_text="SHA-256 hash of the file content"
     )
     
-    file = models.FileField(upload_to='blobs/', help_text="Actual file stored on local disk")
+    # Stored content-addressed under blobs/ab/cd/<sha256>, see drive.storage
+    file = models.FileField(
+        upload_to=blob_upload_to,
+        storage=blob_storage,
+        max_length=255,
+        help_text="Actual file stored on local disk"
+    )
     
     size = models.BigIntegerField(help_text="File size in bytes")
     content_type = models.CharField(max_length=100, default="application/octet-stream")
@@ -25,9 +33,112 @@ class PhysicalBlob(models.Model):
     # Logic: Only delete the physical file when this hits 0.
     ref_count = models.PositiveIntegerField(default=0)
 
+    # Tombstone: set when ref_count drops to 0, the GC reclaims the blob once the grace period is over.
+    # Cleared again if the same content is uploaded in the meantime.
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    # Stored as content-defined chunks (BlobChunk rows) instead of one file, see drive.chunkstore
+    chunked = models.BooleanField(default=False)
+
+    # Compression of the stored file (drive.compression): '' not looked at yet, 'identity' kept as uploaded,
+    # otherwise the codec, which is also the HTTP Content-Encoding of the stored bytes
+    codec = models.CharField(max_length=16, blank=True, default='')
+    stored_size = models.BigIntegerField(null=True, blank=True, help_text="Bytes on disk when compressed")
+
+    class Meta:
+        indexes = [
+            # Admin filters (size bucket, content type family, shared/single/unreferenced)
+            models.Index(fields=['size'], name='blob_size_idx'),
+            models.Index(fields=['content_type'], name='blob_content_type_idx'),
+            models.Index(fields=['ref_count'], name='blob_ref_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256_hash[:8]}... ({self.size} bytes)"
+
+    @property
+    def is_live(self):
+        """
+        False for a tombstone, whoever references it next brings the content back and is charged for it.
+        """
+        return self.ref_count > 0 and self.deleted_at is None
+
+    @cached_property
+    def manifest(self):
+        """
+        [(offset, size, chunk hash)] of a chunked blob, in order.
+        """
+        return list(self.chunks.order_by('index').values_list('offset', 'chunk__size', 'chunk_id'))
+
+class Chunk(models.Model):
+    """
+    One content-defined piece of one or more chunked blobs, stored once under chunks/ab/cd/<sha256>.
+    Same ref_count / tombstone rules as PhysicalBlob, counted per manifest entry.
+    """
+    sha256_hash = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     def __str__(self):
         return f"{self.sha256_hash[:8]}... ({self.size} bytes)"
 
+class BlobChunk(models.Model):
+    """
+    Manifest entry: the chunk at position index of a chunked blob.
+    """
+    blob = models.ForeignKey(PhysicalBlob, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+
+    # Where the chunk starts in the blob, lets a range request go straight to the right chunk
+    offset = models.BigIntegerField()
+
+    # Chunks only go away through the GC, once no manifest uses them
+    chunk = models.ForeignKey(Chunk, on_delete=models.PROTECT, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'index'], name='blobchunk_unique_blob_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_id[:8]}... #{self.index}"
+
+class Derivative(models.Model):
+    """
+    A preview of a blob (thumbnail of one size, or text excerpt), see drive.previews.
+    Rows are queued as pending by the preview endpoint and filled by the generate_previews command.
+    """
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, "Pending"), (READY, "Ready"), (FAILED, "Failed")]
+
+    blob = models.ForeignKey(PhysicalBlob, on_delete=models.CASCADE, related_name='derivatives')
+
+    # Longest side in pixels for thumbnails ('256', '1024'), or 'text'
+    kind = models.CharField(max_length=16)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+
+    # Storage name under previews/, set once ready
+    file = models.CharField(max_length=255, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'kind'], name='derivative_unique_blob_kind'),
+        ]
+        indexes = [
+            # The generator's queue
+            models.Index(fields=['status', 'created_at'], name='derivative_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_id[:8]}... {self.kind} ({self.status})"
+
 class FileReference(models.Model):
     """
     Represents a file in a specific User's dashboard.
@@ -40,6 +151,9 @@ class FileReference(models.Model):
     blob = models.ForeignKey(PhysicalBlob, on_delete=models.PROTECT, related_name='references')
     
     filename = models.CharField(max_length=1024)
+
+    # Folder part of filename ("a/b" for "a/b/c.png", "" at the root), kept in sync by drive.signals
+    parent_path = models.CharField(max_length=1024, default='', editable=False)
     upload_timestamp = models.DateTimeField(auto_now_add=True)
     
     is_primary_uploader = models.BooleanField(default=False)
@@ -49,6 +163,187 @@ class FileReference(models.Model):
         ordering = ['-upload_timestamp']
         verbose_name = "User File"
         verbose_name_plural = "User Files"
+        constraints = [
+            # A path can only be used once per drive, also backs filename lookups
+            models.UniqueConstraint(fields=['user', 'filename'], name='fileref_unique_user_filename'),
+        ]
+        indexes = [
+            # Backs the keyset-paginated listing: WHERE user = ? ORDER BY upload_timestamp DESC, id DESC
+            models.Index(fields=['user', '-upload_timestamp', '-id'], name='fileref_user_ts_id_idx'),
+            # Direct children of one folder
+            models.Index(fields=['user', 'parent_path'], name='fileref_user_parent_idx'),
+            # Admin change list across all users, newest first
+            models.Index(fields=['-upload_timestamp'], name='fileref_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.filename}"
+
+class FilenameTrigram(models.Model):
+    """
+    Filename search index for databases without pg_trgm (SQLite in development), see drive.search.
+    One row per distinct trigram of a lowercased filename, kept in sync by drive.signals.
+    """
+    file = models.ForeignKey(FileReference, on_delete=models.CASCADE, related_name='trigrams')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'trigram', 'file'], name='trigram_user_trigram_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.trigram} - {self.file_id}"
+
+class Folder(models.Model):
+    """
+    Materialized folder tree. Folders only exist as filename prefixes,
+    this table keeps per-folder counters so listing a folder never scans the whole drive.
+    Maintained by drive.signals, never edited directly.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
+
+    # Full path without trailing slash ("a/b"), parent_path is "" for top level folders
+    path = models.CharField(max_length=1024)
+    parent_path = models.CharField(max_length=1024, default='')
+    name = models.CharField(max_length=255)
+
+    # Direct children
+    file_count = models.PositiveIntegerField(default=0)
+    folder_count = models.PositiveIntegerField(default=0)
+
+    # Everything below this folder
+    total_files = models.PositiveIntegerField(default=0)
+    total_size = models.BigIntegerField(default=0, help_text="Bytes of all files below this folder")
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'path'], name='folder_unique_user_path'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'parent_path'], name='folder_user_parent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.path}/"
+
+class DriveSummary(models.Model):
+    """
+    Per-user totals kept up to date on every upload and delete (drive.summary),
+    so the dashboard never has to aggregate over the user's files.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='drive_summary')
+
+    file_count = models.BigIntegerField(default=0)
+    logical_bytes = models.BigIntegerField(default=0, help_text="Size of every file the user sees")
+    physical_bytes = models.BigIntegerField(default=0, help_text="Bytes of content the user actually stored")
+    duplicate_count = models.BigIntegerField(default=0, help_text="Files served from someone else's content")
+
+    def __str__(self):
+        return f"{self.user.username} - {self.file_count} files"
+
+class ContentTypeUsage(models.Model):
+    """
+    Per-user breakdown of the summary by content_type.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='content_type_usage')
+    content_type = models.CharField(max_length=100)
+    file_count = models.BigIntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_type'], name='ctusage_unique_user_type'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.content_type}"
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress.
+    Chunks are staged on disk and only become a PhysicalBlob on commit.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+
+    # Expected content, checked again when the chunks are put together
+    sha256_hash = models.CharField(max_length=64)
+    filename = models.CharField(max_length=1024)
+    size = models.BigIntegerField(help_text="Total file size in bytes")
+    content_type = models.CharField(max_length=100, default="application/octet-stream")
+
+    chunk_size = models.PositiveIntegerField(help_text="Size of every chunk except the last one")
+
+    # Chunked sessions (settings.CHUNK_STORE): [[sha256, size], ...] as cut by the client.
+    # Chunks go straight to the chunk store and the ones already stored are never sent.
+    chunk_manifest = models.JSONField(null=True, blank=True)
+
+    # Quota held for this upload until it's committed or discarded
+    reservation = models.OneToOneField(
+        'user.QuotaReservation',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='upload_session'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def total_chunks(self):
+        if self.chunk_manifest is not None:
+            return len(self.chunk_manifest)
+        # An empty file is still one (empty) chunk
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        if self.chunk_manifest is not None:
+            return self.chunk_manifest[index][1]
+        if index == self.total_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def __str__(self):
+        return f"{self.user.username} - {self.filename} ({self.sha256_hash[:8]}...)"
+
+class MaintenanceJob(models.Model):
+    """
+    Bulk blob maintenance queued from the admin and run in batches by the
+    run_maintenance_jobs command, never inside the admin request.
+    """
+    RECOMPUTE_REF_COUNTS = 'recompute_ref_counts'
+    PURGE_TOMBSTONES = 'purge_tombstones'
+    KIND_CHOICES = [
+        (RECOMPUTE_REF_COUNTS, "Recompute ref counts"),
+        (PURGE_TOMBSTONES, "Purge unreferenced blobs"),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+
+    # Selected blobs, null means every blob
+    blob_hashes = models.JSONField(null=True, blank=True)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    processed = models.BigIntegerField(default=0, help_text="Blobs handled so far")
+    changed = models.BigIntegerField(default=0, help_text="Blobs fixed or purged")
+    error = models.TextField(blank=True)
+
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
 
     def __str__(self):
-        return f"{self.user.username} - {self.filename}"
\ No newline at end of file
+        scope = "all blobs" if self.blob_hashes is None else f"{len(self.blob_hashes)} blobs"
+        return f"{self.get_kind_display()} ({scope}) - {self.status}"
@@ -0,0 +1,88 @@
+import base64
+import uuid
+from datetime import datetime
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+class InvalidCursor(Exception):
+    pass
+
+def encode_cursor(file_ref):
+    """
+    Opaque cursor pointing just past the given row.
+    """
+    raw = f"{file_ref.upload_timestamp.isoformat()}|{file_ref.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, ref_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), uuid.UUID(ref_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Invalid cursor")
+
+def get_page_size(request):
+    try:
+        size = int(request.query_params.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+def paginate_keyset(queryset, request):
+    """
+    Keyset pagination on (upload_timestamp, id), newest first.
+    Seeks straight to the cursor through the index, so every page costs the same no matter how deep.
+    Returns (rows, next cursor or None).
+    """
+    page_size = get_page_size(request)
+    queryset = queryset.order_by('-upload_timestamp', '-id')
+
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        timestamp, ref_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(upload_timestamp__lt=timestamp) |
+            Q(upload_timestamp=timestamp, id__lt=ref_id)
+        )
+
+    # Fetch one extra row to know if there is a next page
+    rows = list(queryset[:page_size + 1])
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1])
+
+    return rows, None
+
+# Ranked results are paged by position, a search has no business going deeper than this
+MAX_RANKED_RESULTS = 1000
+
+def paginate_ranked(queryset, request):
+    """
+    Offset pagination for result orders without a usable key (search ranking).
+    The cursor is opaque like the keyset one, results stop after MAX_RANKED_RESULTS.
+    Returns (rows, next cursor or None).
+    """
+    page_size = get_page_size(request)
+
+    offset = 0
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        try:
+            offset = int(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (ValueError, UnicodeDecodeError):
+            raise InvalidCursor("Invalid cursor")
+        if not 0 <= offset < MAX_RANKED_RESULTS:
+            raise InvalidCursor("Invalid cursor")
+
+    page_size = min(page_size, MAX_RANKED_RESULTS - offset)
+    rows = list(queryset[offset:offset + page_size + 1])
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_offset = offset + page_size
+        if next_offset < MAX_RANKED_RESULTS:
+            return rows, base64.urlsafe_b64encode(str(next_offset).encode()).decode()
+
+    return rows, None
@@ -0,0 +1,110 @@
+"""
+Previews (thumbnails, text excerpts) derived from a blob, generated by the generate_previews command in a
+process pool and served by the preview endpoint. Keyed by the blob hash, so every copy of the same content
+shares one set, and stored content-addressed under previews/ab/cd/<sha256>-<kind>.<ext>.
+Image thumbnails need Pillow, without it only text previews are made.
+"""
+import io
+import os
+import tempfile
+from django.conf import settings
+from .chunkstore import open_blob
+from .storage import blob_storage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+PREVIEW_ROOT = 'previews'
+
+TEXT_KIND = 'text'
+
+# Bytes of a text file kept in its preview, cut back to the last full line
+TEXT_PREVIEW_SIZE = 4 * 1024
+
+# Image types Pillow decodes cheaply enough to thumbnail
+IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff'}
+
+TEXT_TYPES = {'application/json', 'application/xml', 'application/javascript', 'application/x-ndjson'}
+
+THUMBNAIL_FORMAT = ('WEBP', 'webp', 'image/webp')
+
+def preview_name(sha256_hash, kind, extension):
+    return f"{PREVIEW_ROOT}/{sha256_hash[:2]}/{sha256_hash[2:4]}/{sha256_hash}-{kind}.{extension}"
+
+def thumbnail_kinds():
+    return [str(size) for size in settings.PREVIEW_SIZES]
+
+def preview_kinds(content_type):
+    """
+    Previews that can be made for a content type, [] when none.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in IMAGE_TYPES and Image is not None:
+        return thumbnail_kinds()
+    if content_type.startswith('text/') or content_type in TEXT_TYPES:
+        return [TEXT_KIND]
+    return []
+
+def write_preview(name, data):
+    # Temp file and rename, a reader never sees half a preview
+    path = blob_storage.path(name)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def render_thumbnails(blob, kinds):
+    with open_blob(blob) as f:
+        image = Image.open(f)
+        largest = max(int(kind) for kind in kinds)
+        # JPEG decodes straight at a fraction of its size, by far the most expensive step otherwise
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+        image_format, extension, content_type = THUMBNAIL_FORMAT
+        results = {}
+        # Largest first, each smaller one is scaled down from the previous
+        for kind in sorted(kinds, key=int, reverse=True):
+            image.thumbnail((int(kind), int(kind)))
+            out = io.BytesIO()
+            image.save(out, image_format, quality=80)
+            data = out.getvalue()
+            name = preview_name(blob.sha256_hash, kind, extension)
+            write_preview(name, data)
+            results[kind] = (name, content_type, len(data))
+        return results
+
+def render_text(blob):
+    with open_blob(blob) as f:
+        data = f.read(TEXT_PREVIEW_SIZE)
+    if len(data) == TEXT_PREVIEW_SIZE and b'\n' in data:
+        data = data[:data.rindex(b'\n') + 1]
+    # Always valid UTF-8, whatever the file was
+    data = data.decode('utf-8', errors='replace').encode()
+
+    name = preview_name(blob.sha256_hash, TEXT_KIND, 'txt')
+    write_preview(name, data)
+    return {TEXT_KIND: (name, 'text/plain; charset=utf-8', len(data))}
+
+def render_previews(blob, kinds):
+    """
+    Runs in the process pool, files only, no ORM: a chunked blob must come with its manifest loaded.
+    Returns {kind: (storage name, content type, size)}, kinds that couldn't be made are left out.
+    """
+    try:
+        if kinds == [TEXT_KIND]:
+            return render_text(blob)
+        return render_thumbnails(blob, kinds)
+    except Exception:
+        # Corrupt or unsupported file, the caller marks its previews as failed
+        return {}
@@ -0,0 +1,113 @@
+"""
+Filename search (search_files view): substring and fuzzy matches within one user's drive, best first.
+On PostgreSQL a pg_trgm GIN index over (user, filename) answers both, see migration 0015.
+Other databases (SQLite in development) use the FilenameTrigram table instead, kept in sync by drive.signals.
+"""
+from django.db import connection
+from django.db.models import BooleanField, Case, Count, F, FloatField, IntegerField, Value, When, Func
+from django.db.models.functions import Length
+from .models import FileReference, FilenameTrigram
+
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 255
+
+# Share of the query's trigrams a fuzzy match needs, pg_trgm's word_similarity_threshold default
+FUZZY_THRESHOLD = 0.6
+
+def uses_trigram_table():
+    return connection.vendor != 'postgresql'
+
+def trigrams(text):
+    """
+    Distinct trigrams of the lowercased text, every substring match shares all of the query's.
+    """
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def index_files(refs):
+    """
+    Adds the trigram rows of new FileReferences (no-op on PostgreSQL).
+    """
+    if not uses_trigram_table():
+        return
+    FilenameTrigram.objects.bulk_create(
+        [
+            FilenameTrigram(file_id=ref.id, user_id=ref.user_id, trigram=trigram)
+            for ref in refs for trigram in trigrams(ref.filename)
+        ],
+        batch_size=1000
+    )
+
+def reindex_file(ref):
+    """
+    Rebuilds the trigram rows of a renamed FileReference (no-op on PostgreSQL).
+    """
+    if not uses_trigram_table():
+        return
+    FilenameTrigram.objects.filter(file_id=ref.id).delete()
+    index_files([ref])
+
+def unindex_files(ref_ids):
+    """
+    Drops the trigram rows of FileReferences about to be deleted without the ORM cascade
+    (delete_references' raw delete), no-op on PostgreSQL.
+    """
+    if not uses_trigram_table():
+        return
+    FilenameTrigram.objects.filter(file_id__in=ref_ids)._raw_delete(FilenameTrigram.objects.db)
+
+def postgres_matches(files, query):
+    # filename ILIKE '%query%' OR query <% filename, both served by the gin_trgm_ops index
+    contains = Func(
+        F('filename'), Value(f"%{escape_like(query)}%"),
+        template="%(expressions)s", arg_joiner=' ILIKE ', output_field=BooleanField()
+    )
+    similar = Func(
+        Value(query), F('filename'),
+        template="%(expressions)s", arg_joiner=' <%% ', output_field=BooleanField()
+    )
+    similarity = Func(Value(query), F('filename'), function='word_similarity', output_field=FloatField())
+    return (
+        files.filter(contains | similar)
+        .annotate(
+            exact=Case(When(contains, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            score=similarity,
+        )
+    )
+
+def trigram_table_matches(files, user, query):
+    grams = trigrams(query)
+    if not grams:
+        # Too short for a trigram, scanning the user's names is the only way
+        return files.filter(filename__icontains=query).annotate(exact=Value(1), score=Value(1.0))
+
+    # One grouped pass over the index rows of the query's trigrams, the user's other files are never read
+    needed = max(1, int(len(grams) * FUZZY_THRESHOLD))
+    return (
+        files.filter(trigrams__user=user, trigrams__trigram__in=grams)
+        .annotate(hits=Count('trigrams'))
+        .filter(hits__gte=needed)
+        .annotate(
+            exact=Case(When(filename__icontains=query, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            score=F('hits') * 1.0 / len(grams),
+        )
+    )
+
+def search_files(user, query, folder=''):
+    """
+    The user's FileReferences whose filename contains query, or comes close to it, ranked:
+    substring matches first, then by similarity, shorter names first, newest first.
+    folder limits it to one folder and everything below it.
+    """
+    files = FileReference.objects.filter(user=user)
+    if folder:
+        files = files.filter(filename__startswith=folder.strip('/') + '/')
+
+    if uses_trigram_table():
+        files = trigram_table_matches(files, user, query)
+    else:
+        files = postgres_matches(files, query)
+    return files.order_by('-exact', '-score', Length('filename'), '-upload_timestamp', '-id')
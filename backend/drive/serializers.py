@@ -1,5 +1,10 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import PhysicalBlob, FileReference
+from .models import PhysicalBlob, FileReference, UploadSession, Folder
+from django.urls import reverse
+from .services import missing_chunks
+from .downloads import make_download_token
+from .previews import preview_kinds, thumbnail_kinds
 
 class FileReferenceSerializer(serializers.ModelSerializer):
     """
@@ -13,6 +18,7 @@ class FileReferenceSerializer(serializers.ModelSerializer):
     
     # Custom calculated fields
     download_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
     is_duplicate = serializers.SerializerMethodField()
 
     class Meta:
@@ -24,6 +30,7 @@ class FileReferenceSerializer(serializers.ModelSerializer):
             'hash',
             'is_primary_uploader', 
             'download_url', 
+            'preview_url',
             'content_type', 
             'upload_timestamp', 
             'is_duplicate'
@@ -39,16 +46,47 @@ class FileReferenceSerializer(serializers.ModelSerializer):
 
     def get_download_url(self, obj):
         """
-        Generates the full absolute URL for the file.
-        e.g., http://localhost:8000/media/blobs/myfile.png
+        Generates the full absolute URL of the download endpoint, signed so it works as a plain link.
+        e.g., http://localhost:8000/api/drive/download/<id>/?token=...
         """
-        if obj.blob.file:
+        if obj.blob.file or obj.blob.chunked:
+            url = f"{reverse('download_file', args=[obj.id])}?token={make_download_token(obj)}"
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.blob.file.url)
-            return obj.blob.file.url
+                return request.build_absolute_uri(url)
+            return url
         return None
 
+    def get_preview_url(self, obj):
+        """
+        Signed link to the smallest thumbnail, None when the file has none.
+        Text excerpts aren't linked here, they're asked for by kind ('text').
+        """
+        if preview_kinds(obj.blob.content_type) != thumbnail_kinds() or not thumbnail_kinds():
+            return None
+        kind = min(thumbnail_kinds(), key=int)
+        url = f"{reverse('preview_file', args=[obj.id, kind])}?token={make_download_token(obj)}"
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(url)
+        return url
+
+class FolderSerializer(serializers.ModelSerializer):
+    """
+    A folder entry with its precomputed counters.
+    """
+    class Meta:
+        model = Folder
+        fields = [
+            'path',
+            'name',
+            'file_count',
+            'folder_count',
+            'total_files',
+            'total_size'
+        ]
+        read_only_fields = fields
+
 class FileUploadSerializer(serializers.Serializer):
     """
     Validates the initial metadata sent by React.
@@ -57,4 +95,100 @@ class FileUploadSerializer(serializers.Serializer):
     filename = serializers.CharField(max_length=255)
     hash = serializers.CharField(max_length=64, min_length=64)
     size = serializers.IntegerField(min_value=0)
-    content_type = serializers.CharField(max_length=100, required=False, default="application/octet-stream")
\ No newline at end of file
+    content_type = serializers.CharField(max_length=100, required=False, default="application/octet-stream")
+
+class ChunkSerializer(serializers.Serializer):
+    # Lowercase hex only, the hash becomes a path in the chunk store
+    hash = serializers.RegexField(r'^[0-9a-f]{64}$')
+    size = serializers.IntegerField(min_value=1)
+
+class UploadSessionCreateSerializer(FileUploadSerializer):
+    """
+    Upload session metadata, optionally with the client's content-defined chunks (chunk store only).
+    """
+    chunks = ChunkSerializer(many=True, required=False, allow_empty=False)
+
+    def validate(self, data):
+        chunks = data.get('chunks')
+        if chunks is None:
+            return data
+
+        if not settings.CHUNK_STORE:
+            raise serializers.ValidationError({"chunks": "Chunked uploads are disabled"})
+        if sum(chunk['size'] for chunk in chunks) != data['size']:
+            raise serializers.ValidationError({"chunks": "Chunk sizes must add up to the file size"})
+        # Every chunk but the last is at least CHUNK_MIN_SIZE, which also bounds the manifest
+        if len(chunks) > data['size'] // settings.CHUNK_MIN_SIZE + 1:
+            raise serializers.ValidationError({"chunks": "Chunks are smaller than CHUNK_MIN_SIZE"})
+        if any(chunk['size'] > settings.CHUNK_MAX_SIZE for chunk in chunks):
+            raise serializers.ValidationError({"chunks": "Chunks are larger than CHUNK_MAX_SIZE"})
+        return data
+
+class UploadPreflightSerializer(serializers.Serializer):
+    """
+    Batch of file metadata sent before any bytes, so known content can be linked without uploading it.
+    """
+    files = FileUploadSerializer(many=True, allow_empty=False)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Progress of a resumable upload, tells the client which chunks to (re)send.
+    """
+    hash = serializers.CharField(source='sha256_hash', read_only=True)
+    total_chunks = serializers.IntegerField(read_only=True)
+    missing_chunks = serializers.SerializerMethodField()
+    chunked = serializers.SerializerMethodField()
+    chunking = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id',
+            'filename',
+            'hash',
+            'size',
+            'content_type',
+            'chunk_size',
+            'total_chunks',
+            'missing_chunks',
+            'chunked',
+            'chunking',
+            'created_at'
+        ]
+        read_only_fields = fields
+
+    def get_missing_chunks(self, obj):
+        return missing_chunks(obj)
+
+    def get_chunked(self, obj):
+        return obj.chunk_manifest is not None
+
+    def get_chunking(self, obj):
+        """
+        Sizes the content-defined chunker must use for chunks to be shared with what's stored.
+        """
+        if not settings.CHUNK_STORE:
+            return None
+        return {
+            'min_size': settings.CHUNK_MIN_SIZE,
+            'avg_size': settings.CHUNK_AVG_SIZE,
+            'max_size': settings.CHUNK_MAX_SIZE,
+        }
+
+class BulkDeleteSerializer(serializers.Serializer):
+    """
+    Selects files to delete, either by id or everything below a folder.
+    """
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False)
+    folder = serializers.CharField(max_length=1024, required=False)
+
+    def validate(self, data):
+        if ('ids' in data) == ('folder' in data):
+            raise serializers.ValidationError("Send either ids or folder")
+        return data
+
+class ArchiveSerializer(BulkDeleteSerializer):
+    """
+    Files to put in a ZIP download, selected like bulk deletes.
+    """
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False, max_length=10000)
@@ -1,3 +1,657 @@
-def has_sufficient_quota(user, new_file_size):
-    profile = user.profile 
-    return (profile.storage_used + new_file_size) <= profile.storage_limit
\ No newline at end of file
+import os
+import re
+import shutil
+import hashlib
+import uuid
+from collections import Counter, defaultdict
+from django.conf import settings
+from .storage import blob_storage, blob_name
+from .uploadhandlers import STAGING_DIR
+from django.utils import timezone
+from django.db import transaction, IntegrityError
+from django.db.models import F, Case, When, Value, Count
+from user.models import UserProfile
+from user import quota
+from core import metrics
+from . import chunkstore, compression, folders, previews, search, summary
+from .models import PhysicalBlob, FileReference, UploadSession, Chunk, BlobChunk, Derivative
+
+# Read/write buffer for streaming file data
+COPY_BUFFER_SIZE = 1024 * 1024
+
+class UploadError(Exception):
+    """
+    Raised when an upload can't be accepted, the message is safe to show to the client.
+    """
+
+def charge_storage(usage):
+    """
+    Applies {user_id: bytes} to storage_used, one UPDATE per user.
+    """
+    for user_id, size in usage.items():
+        if size:
+            UserProfile.objects.filter(user_id=user_id).update(storage_used=F('storage_used') + size)
+
+def get_unique_filename(user, full_path):
+    """
+    Ensures the path is unique for the current user.
+    If duplicate add a (counter), picking the lowest free one.
+    Costs at most two queries however many copies already exist.
+    """
+    if not FileReference.objects.filter(user=user, filename=full_path).exists():
+        return full_path
+
+    # Split path and file name
+    directory, filename = os.path.split(full_path)
+    
+    # Split extension and name
+    name, ext = os.path.splitext(filename)
+    prefix = f"{directory}/" if directory else ""
+
+    # Fetch every existing name(N)ext sibling in one go
+    pattern = re.compile(re.escape(f"{prefix}{name}(") + r"(\d+)" + re.escape(f"){ext}") + "$")
+    siblings = FileReference.objects.filter(
+        user=user,
+        filename__startswith=f"{prefix}{name}(",
+        filename__endswith=f"){ext}"
+    ).values_list('filename', flat=True)
+
+    taken = set()
+    for sibling in siblings:
+        match = pattern.match(sibling)
+        if match:
+            taken.add(int(match.group(1)))
+
+    counter = 1
+    while counter in taken:
+        counter += 1
+
+    # Recombine: folder/subfolder/image(1).png
+    return f"{prefix}{name}({counter}){ext}"
+
+def create_file_reference(user, blob, filename, is_primary_uploader, attempts=5):
+    """
+    Creates the user's reference under a free name.
+    The (user, filename) constraint catches concurrent uploads picking the same name,
+    in which case a fresh name is allocated and the insert retried.
+    """
+    for attempt in range(attempts):
+        try:
+            # Savepoint so a conflict doesn't break the caller's transaction
+            with transaction.atomic():
+                file_ref = FileReference.objects.create(
+                    user=user,
+                    blob=blob,
+                    filename=get_unique_filename(user, filename),
+                    is_primary_uploader=is_primary_uploader
+                )
+            # The primary uploader brought new content, everyone else was deduplicated
+            metrics.record_dedup(hits=int(not is_primary_uploader), misses=int(is_primary_uploader))
+            return file_ref
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+def adjust_ref_counts(deltas, model=PhysicalBlob):
+    """
+    Applies {hash: delta} to PhysicalBlob.ref_count (or Chunk.ref_count) in a single UPDATE ... CASE statement.
+    """
+    deltas = {file_hash: delta for file_hash, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    model.objects.filter(sha256_hash__in=deltas).update(
+        ref_count=F('ref_count') + Case(
+            *[When(sha256_hash=file_hash, then=Value(delta)) for file_hash, delta in deltas.items()],
+            default=Value(0)
+        )
+    )
+
+    # Unreferenced blobs become tombstones, referenced ones come back to life
+    blobs = model.objects.filter(sha256_hash__in=deltas)
+    blobs.filter(ref_count__lte=0, deleted_at__isnull=True).update(deleted_at=timezone.now())
+    blobs.filter(ref_count__gt=0, deleted_at__isnull=False).update(deleted_at=None)
+
+def link_chunks(blob, manifest):
+    """
+    Records the manifest [(hash, size)] of a new chunked blob and takes a reference on each entry.
+    The chunk files must already be in the chunk store.
+    """
+    sizes = dict(manifest)
+
+    # Locked so the GC (skip_locked) leaves chunks alone while they're being reused
+    known = set(
+        Chunk.objects.select_for_update().filter(sha256_hash__in=sizes).values_list('sha256_hash', flat=True)
+    )
+    Chunk.objects.bulk_create(
+        [Chunk(sha256_hash=chunk_hash, size=size) for chunk_hash, size in sizes.items() if chunk_hash not in known],
+        ignore_conflicts=True
+    )
+    metrics.record_chunk_dedup(hits=len(known), misses=len(sizes) - len(known))
+
+    entries = []
+    offset = 0
+    for index, (chunk_hash, size) in enumerate(manifest):
+        entries.append(BlobChunk(blob=blob, index=index, offset=offset, chunk_id=chunk_hash))
+        offset += size
+    BlobChunk.objects.bulk_create(entries, batch_size=1000)
+
+    adjust_ref_counts(Counter(chunk_hash for chunk_hash, _ in manifest), model=Chunk)
+
+def unlink_chunks(blob_hashes):
+    """
+    Drops the chunk references of blobs about to be deleted, chunks nobody uses anymore become tombstones.
+    """
+    counts = (
+        BlobChunk.objects.filter(blob_id__in=blob_hashes)
+        .values('chunk_id').annotate(total=Count('id'))
+        .values_list('chunk_id', 'total')
+    )
+    adjust_ref_counts({chunk_hash: -total for chunk_hash, total in counts}, model=Chunk)
+
+def hold_chunks(chunk_hashes):
+    """
+    Restarts the grace period of unreferenced chunks a client was told it doesn't need to send,
+    so the GC doesn't take them before the upload commits.
+    """
+    Chunk.objects.filter(sha256_hash__in=chunk_hashes, ref_count=0).update(deleted_at=timezone.now())
+
+def chunk_blob(file_hash):
+    """
+    Moves a flat blob into the chunk store (chunk_blobs command), compressed blobs are chunked decompressed.
+    Returns the bytes of new chunks written, None when the blob was gone, changed or already chunked.
+    """
+    source = PhysicalBlob.objects.filter(sha256_hash=file_hash, chunked=False).first()
+    if source is None or not source.file:
+        return None
+    name = source.file.name
+
+    # Cut and store outside of any transaction, that's the slow part
+    manifest = []
+    written = 0
+    with chunkstore.open_blob(source) as f:
+        for data in chunkstore.iter_chunks(f):
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            written += chunkstore.write_chunk_file(chunk_hash, data)
+            manifest.append((chunk_hash, len(data)))
+
+    with transaction.atomic():
+        blob = PhysicalBlob.objects.select_for_update().filter(sha256_hash=file_hash, chunked=False, file=name).first()
+        if blob is None:
+            return None
+        link_chunks(blob, manifest)
+        blob.file = ''
+        blob.chunked = True
+        blob.codec = ''
+        blob.stored_size = None
+        blob.save(update_fields=['file', 'chunked', 'codec', 'stored_size'])
+
+    # A GC run reclaiming one of these chunks just before we linked it may have unlinked its file
+    if not all(chunkstore.chunk_exists(chunk_hash) for chunk_hash, _ in manifest):
+        with chunkstore.open_blob(source) as f:
+            for data in chunkstore.iter_chunks(f):
+                chunkstore.write_chunk_file(hashlib.sha256(data).hexdigest(), data)
+
+    blob_storage.delete(name)
+    return written
+
+def compress_blob(file_hash, codec):
+    """
+    Rewrites a flat blob compressed with codec (compress_blobs command), when its type and content say it pays off.
+    Blobs that don't are marked identity so they aren't looked at again.
+    Returns the bytes saved, None when the blob was skipped, gone or changed meanwhile.
+    """
+    blob = PhysicalBlob.objects.filter(sha256_hash=file_hash, chunked=False, codec='').first()
+    if blob is None or not blob.file:
+        return None
+    name = blob.file.name
+    path = blob_storage.path(name)
+
+    def mark_identity():
+        PhysicalBlob.objects.filter(sha256_hash=file_hash, file=name, codec='').update(codec=compression.IDENTITY)
+
+    if not compression.worth_compressing(blob.content_type, path, blob.size):
+        mark_identity()
+        return None
+
+    # Its own name, a reader holding the old row keeps finding the uncompressed file until the switch
+    new_name = f"{blob_name(file_hash)}.{codec.extension}"
+    stored_size = compression.compress_file(path, blob_storage.path(new_name), codec)
+    if stored_size > blob.size * compression.MAX_RATIO:
+        blob_storage.delete(new_name)
+        mark_identity()
+        return None
+
+    with transaction.atomic():
+        updated = PhysicalBlob.objects.filter(sha256_hash=file_hash, file=name, codec='').update(
+            file=new_name, codec=codec.name, stored_size=stored_size
+        )
+
+    if not updated:
+        blob_storage.delete(new_name)
+        return None
+
+    # Readers holding the old row may still open the uncompressed file, gc.sweep_orphan_files removes it
+    # once nothing points to it for a grace period (counted from now, not from the upload)
+    os.utime(path)
+    return blob.size - stored_size
+
+def queue_previews(blob):
+    """
+    Pending Derivative rows for every preview the blob's type allows, for the generate_previews command.
+    Thumbnails of all sizes are queued together, they come out of one decode.
+    """
+    Derivative.objects.bulk_create(
+        [Derivative(blob=blob, kind=kind) for kind in previews.preview_kinds(blob.content_type)],
+        ignore_conflicts=True
+    )
+
+def save_previews(blob, derivatives, results):
+    """
+    Records what render_previews made for one blob, the derivatives it was asked for and didn't make failed.
+    """
+    if not results:
+        # The file moved (chunk_blobs, compress_blobs) while it was being read, try again next run
+        current = PhysicalBlob.objects.filter(sha256_hash=blob.sha256_hash).values_list('file', 'chunked', 'codec').first()
+        if current is not None and current != (blob.file.name, blob.chunked, blob.codec):
+            return
+
+    for derivative in derivatives:
+        if derivative.kind in results:
+            derivative.file, derivative.content_type, derivative.size = results[derivative.kind]
+            derivative.status = Derivative.READY
+        else:
+            derivative.status = Derivative.FAILED
+    Derivative.objects.bulk_update(derivatives, ['status', 'file', 'content_type', 'size'])
+
+def allocate_filenames(user, filenames):
+    """
+    Unique names for a whole batch: one query finds which requested paths are taken,
+    only those (and repeats inside the batch) go through get_unique_filename.
+    """
+    taken = set(
+        FileReference.objects.filter(user=user, filename__in=set(filenames))
+        .values_list('filename', flat=True)
+    )
+
+    allocated = []
+    for filename in filenames:
+        name = filename
+        if name in taken:
+            name = get_unique_filename(user, filename)
+
+            # Earlier entries of this batch aren't in the database yet
+            directory, base = os.path.split(filename)
+            stem, ext = os.path.splitext(base)
+            prefix = f"{directory}/" if directory else ""
+            counter = 1
+            while name in taken:
+                name = f"{prefix}{stem}({counter}){ext}"
+                counter += 1
+
+        taken.add(name)
+        allocated.append(name)
+
+    return allocated
+
+def link_existing_blobs(user, entries):
+    """
+    Dedup handshake: attaches every entry whose content the user already has in their drive
+    without receiving its bytes again.
+    A hash alone doesn't prove the client has the content, so anyone else's content has to be uploaded
+    (the upload itself still dedups, it just can't be used to probe or copy other users' files).
+    Returns (created references, hashes the client still has to upload).
+    """
+    hashes = {entry['hash'] for entry in entries}
+
+    with transaction.atomic():
+        # One query for the whole batch, locked so a concurrent delete can't drop a blob under us
+        owned = FileReference.objects.filter(user=user, blob_id__in=hashes).values('blob_id')
+        blobs = {
+            blob.sha256_hash: blob
+            for blob in PhysicalBlob.objects.select_for_update().filter(sha256_hash__in=owned)
+        }
+
+        created = []
+        missing = []
+        for entry in entries:
+            blob = blobs.get(entry['hash'])
+
+            # Size must agree too, otherwise let the real upload sort it out
+            if blob is None or blob.size != entry['size']:
+                if entry['hash'] not in missing:
+                    missing.append(entry['hash'])
+                continue
+
+            created.append(create_file_reference(user, blob, entry['filename'], False))
+
+        # One ref_count bump for the whole batch
+        counts = Counter(ref.blob_id for ref in created)
+        adjust_ref_counts(counts)
+        for file_hash, count in counts.items():
+            blobs[file_hash].ref_count += count
+
+    return created, missing
+
+
+def upload_batch(user, entries):
+    """
+    Stores many uploaded files in one transaction.
+    entries are dicts with filename, hash and file (already hash-verified).
+    Blobs are resolved with one IN query, references are bulk inserted,
+    and ref_count / storage_used / folder counters are updated once per batch.
+    Returns the created references, in entry order.
+    """
+    hashes = {entry['hash'] for entry in entries}
+
+    with transaction.atomic():
+        blobs = {
+            blob.sha256_hash: blob
+            for blob in PhysicalBlob.objects.select_for_update().filter(sha256_hash__in=hashes)
+        }
+
+        # New content, first file of each hash provides the bytes
+        new_blobs = {}
+        for entry in entries:
+            if entry['hash'] not in blobs and entry['hash'] not in new_blobs:
+                uploaded_file = entry['file']
+                new_blobs[entry['hash']] = PhysicalBlob(
+                    sha256_hash=entry['hash'],
+                    file=uploaded_file,
+                    size=uploaded_file.size,
+                    content_type=uploaded_file.content_type
+                )
+
+        if new_blobs:
+            # A concurrent upload may insert the same hash first, keep whichever row won
+            PhysicalBlob.objects.bulk_create(new_blobs.values(), ignore_conflicts=True)
+            stored = PhysicalBlob.objects.select_for_update().filter(sha256_hash__in=new_blobs)
+            for blob in stored:
+                # Another upload inserted this hash first, same bytes at the same name so nothing to clean up
+                if blob.created_at != new_blobs[blob.sha256_hash].created_at:
+                    new_blobs.pop(blob.sha256_hash)
+                blobs[blob.sha256_hash] = blob
+
+        # New content, and tombstones this batch brings back, are charged to the first file of each hash
+        unowned = {file_hash for file_hash, blob in blobs.items() if not blob.is_live}
+
+        names = allocate_filenames(user, [entry['filename'] for entry in entries])
+
+        refs = []
+        primary_given = set()
+        for entry, name in zip(entries, names):
+            file_hash = entry['hash']
+            is_primary = file_hash in unowned and file_hash not in primary_given
+            primary_given.add(file_hash)
+
+            refs.append(FileReference(
+                user=user,
+                blob=blobs[file_hash],
+                filename=name,
+                parent_path=folders.split_path(name)[0],
+                is_primary_uploader=is_primary
+            ))
+
+        try:
+            # bulk_create skips the post_save signals, their work is done below in one go
+            with transaction.atomic():
+                FileReference.objects.bulk_create(refs)
+            signals_ran = False
+            primaries = sum(1 for ref in refs if ref.is_primary_uploader)
+            metrics.record_dedup(hits=len(refs) - primaries, misses=primaries)
+        except IntegrityError:
+            # Lost a filename race to a concurrent upload, fall back to the retrying path
+            refs = [
+                create_file_reference(user, ref.blob, ref.filename, ref.is_primary_uploader)
+                for ref in refs
+            ]
+            signals_ran = True
+
+        counts = Counter(entry['hash'] for entry in entries)
+        adjust_ref_counts(counts)
+        for file_hash, count in counts.items():
+            blobs[file_hash].ref_count += count
+
+        if not signals_ran:
+            # Only newly stored content counts against the quota
+            charge_storage({user.id: sum(ref.blob.size for ref in refs if ref.is_primary_uploader)})
+            folders.add_files(user.id, [(ref.filename, ref.blob.size) for ref in refs])
+            search.index_files(refs)
+            summary.record_files(
+                user.id,
+                [(ref.blob.size, ref.blob.content_type, ref.is_primary_uploader) for ref in refs]
+            )
+
+    return refs
+
+
+def delete_references(user, refs):
+    """
+    Deletes a queryset of the user's FileReferences in bulk.
+    ref_count, storage_used, folder counters, summary and primary uploader promotions
+    are each applied with a handful of set-based queries, whatever the number of files.
+    Returns how many files were deleted.
+    """
+    with transaction.atomic():
+        # Lock the references first and read them under the lock, a concurrent delete of the same files
+        # then waits for us and finds nothing left instead of decrementing the counters a second time
+        ids = list(refs.filter(user=user).values_list('id', flat=True))
+        rows = list(
+            FileReference.objects.select_for_update(of=('self',)).filter(id__in=ids, user=user).values_list(
+                'id', 'blob_id', 'blob__size', 'blob__content_type', 'filename', 'is_primary_uploader',
+                named=True
+            )
+        )
+        if not rows:
+            return 0
+
+        deltas = Counter(row.blob_id for row in rows)
+
+        # Lock the touched blobs so no upload links to one we're about to drop
+        list(PhysicalBlob.objects.select_for_update().filter(sha256_hash__in=deltas).values_list('pk'))
+
+        # The per-row post_delete signals (and the search index cascade) are replaced by the batched updates below
+        ref_ids = [row.id for row in rows]
+        search.unindex_files(ref_ids)
+        if not FileReference.objects.filter(id__in=ref_ids)._raw_delete(refs.db):
+            return 0
+
+        adjust_ref_counts({blob_id: -count for blob_id, count in deltas.items()})
+
+        charge_storage({user.id: -sum(row.blob__size for row in rows if row.is_primary_uploader)})
+        folders.remove_files(user.id, [(row.filename, row.blob__size) for row in rows])
+        summary.record_files(
+            user.id,
+            [(row.blob__size, row.blob__content_type, row.is_primary_uploader) for row in rows],
+            sign=-1
+        )
+
+        # A blob down to one reference: that last owner becomes the primary uploader, and pays for it
+        promoted = FileReference.objects.filter(
+            blob__in=PhysicalBlob.objects.filter(sha256_hash__in=deltas, ref_count=1),
+            is_primary_uploader=False
+        )
+        usage = Counter()
+        promotions = defaultdict(lambda: (0, 0))
+        for owner_id, size in promoted.values_list('user_id', 'blob__size'):
+            usage[owner_id] += size
+            count, total = promotions[owner_id]
+            promotions[owner_id] = (count + 1, total + size)
+        promoted.update(is_primary_uploader=True)
+        charge_storage(usage)
+        summary.record_promotions(promotions)
+
+        # Blobs nobody points at anymore are now tombstones, drive.gc removes them later
+
+    return len(rows)
+
+def session_dir(session):
+    """
+    Staging folder that holds the chunks of one upload session.
+    """
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', str(session.id))
+
+def chunk_path(session, index):
+    return os.path.join(session_dir(session), f"{index:06d}.chunk")
+
+def missing_chunks(session):
+    """
+    Chunk indexes not received yet, read from disk so parallel chunk writes never contend on a row.
+    For chunked sessions that's every chunk the chunk store doesn't have, whoever sent it.
+    """
+    if session.chunk_manifest is not None:
+        return [
+            index for index, (chunk_hash, _) in enumerate(session.chunk_manifest)
+            if not chunkstore.chunk_exists(chunk_hash)
+        ]
+
+    try:
+        received = set(os.listdir(session_dir(session)))
+    except FileNotFoundError:
+        received = set()
+
+    return [
+        index for index in range(session.total_chunks)
+        if f"{index:06d}.chunk" not in received
+    ]
+
+def write_chunk(session, index, stream):
+    """
+    Streams one chunk to the staging folder.
+    Written under a temp name and renamed, so a half-sent chunk never counts as received.
+    """
+    if not 0 <= index < session.total_chunks:
+        raise UploadError("Chunk index out of range")
+
+    expected = session.chunk_length(index)
+
+    if session.chunk_manifest is not None:
+        chunk_hash = session.chunk_manifest[index][0]
+        if not chunkstore.receive_chunk(chunk_hash, stream, expected):
+            raise UploadError(f"Chunk {index} must be exactly {expected} bytes with hash {chunk_hash}")
+        return
+
+    directory = session_dir(session)
+    os.makedirs(directory, exist_ok=True)
+
+    final_path = chunk_path(session, index)
+    temp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+
+    written = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while written <= expected:
+                data = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+                if not data:
+                    break
+                out.write(data)
+                written += len(data)
+        metrics.BLOB_BYTES_WRITTEN.inc(written)
+
+        if written != expected:
+            raise UploadError(f"Chunk {index} must be exactly {expected} bytes")
+
+        os.replace(temp_path, final_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def assemble_chunks(session):
+    """
+    Concatenates the staged chunks into the blob store, hashing in the same pass.
+    The result is written next to the blobs and renamed to its content-addressed name once verified.
+    Returns the storage name of the new blob file.
+    A chunked session's chunks already are the content, they're only hashed and '' is returned.
+    """
+    if session.chunk_manifest is not None:
+        if chunkstore.hash_manifest(session.chunk_manifest) != session.sha256_hash:
+            raise UploadError("Uploaded content does not match the declared hash")
+        return ''
+
+    staging = blob_storage.path(STAGING_DIR)
+    os.makedirs(staging, exist_ok=True)
+    temp_path = os.path.join(staging, f"{session.id}.assembling")
+
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as out:
+            for index in range(session.total_chunks):
+                with open(chunk_path(session, index), 'rb') as chunk:
+                    while data := chunk.read(COPY_BUFFER_SIZE):
+                        digest.update(data)
+                        out.write(data)
+        metrics.BLOB_BYTES_WRITTEN.inc(session.size)
+
+        if digest.hexdigest() != session.sha256_hash:
+            raise UploadError("Uploaded content does not match the declared hash")
+
+        name = blob_name(session.sha256_hash)
+        path = blob_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return name
+
+def discard_session(session):
+    shutil.rmtree(session_dir(session), ignore_errors=True)
+    reservation = session.reservation
+    session.delete()
+    quota.release(reservation)
+
+def commit_upload_session(session, stored_name=None):
+    """
+    Turns a fully received session into a FileReference.
+    Runs the same dedup and ref_count logic as a regular upload.
+    stored_name is set when the caller already ran assemble_chunks (drive.async_views does it in the I/O pool),
+    it stays None when the content was already stored.
+    """
+    if stored_name is None:
+        if missing_chunks(session):
+            raise UploadError("Upload is incomplete")
+
+        # Only pay for the assembly when nobody stored this content in the meantime
+        # (a concurrent commit of the same content writes identical bytes to the same name)
+        if not PhysicalBlob.objects.filter(sha256_hash=session.sha256_hash).exists():
+            stored_name = assemble_chunks(session)
+
+    try:
+        with transaction.atomic():
+            # Locked so the GC can't reclaim a tombstone we're about to revive
+            blob, created = PhysicalBlob.objects.select_for_update().get_or_create(
+                sha256_hash=session.sha256_hash,
+                defaults={
+                    'file': stored_name,
+                    'size': session.size,
+                    'content_type': session.content_type,
+                    'chunked': session.chunk_manifest is not None
+                }
+            )
+
+            # The stored copy vanished between the check and the lock, client can simply retry
+            if created and stored_name is None:
+                raise UploadError("Stored content changed during commit, please retry")
+
+            if created and blob.chunked:
+                link_chunks(blob, [tuple(entry) for entry in session.chunk_manifest])
+
+            # Reviving a tombstone is charged like storing the content
+            is_primary = not blob.is_live
+
+            blob.ref_count = F('ref_count') + 1
+            blob.deleted_at = None
+            blob.save()
+
+            blob.refresh_from_db()
+
+            file_ref = create_file_reference(session.user, blob, session.filename, is_primary)
+    except Exception:
+        # Only drop the file if no committed blob relies on it
+        if stored_name and not PhysicalBlob.objects.filter(sha256_hash=session.sha256_hash).exists():
+            blob_storage.delete(stored_name)
+        raise
+
+    discard_session(session)
+    return file_ref
@@ -1,16 +1,29 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_save, post_init
 from django.dispatch import receiver
 from django.db.models import F
 from .models import FileReference
+from . import folders, search, summary
 from user.models import UserProfile
 
+@receiver(post_init, sender=FileReference)
+def remember_filename(sender, instance, **kwargs):
+    """
+    Keep the loaded filename around so a rename can be detected on save.
+    """
+    instance._original_filename = instance.filename
+
+@receiver(pre_save, sender=FileReference)
+def set_parent_path(sender, instance, **kwargs):
+    instance.parent_path, _ = folders.split_path(instance.filename)
+
 @receiver(post_save, sender=FileReference)
 def increase_storage_on_upload(sender, instance, created, **kwargs):
     """
     When a user adds a file, instantly add its size to their usage counter.
+    Only content the user actually brought counts, deduplicated files are free (see README).
     """
-    if created:
-        # logical size = the size of the blob they are referencing
+    if created and instance.is_primary_uploader:
+        # physical size = the size of the blob they stored
         file_size = instance.blob.size
         
         # Atomic update (Safe for concurrent uploads)
@@ -18,6 +31,28 @@ def increase_storage_on_upload(sender, instance, created, **kwargs):
             storage_used=F('storage_used') + file_size
         )
 
+@receiver(post_save, sender=FileReference)
+def update_folder_tree(sender, instance, created, **kwargs):
+    """
+    Keeps the materialized folder counters in step with uploads and renames.
+    """
+    if created:
+        folders.add_file(instance.user_id, instance.filename, instance.blob.size)
+        search.index_files([instance])
+    elif instance.filename != instance._original_filename:
+        folders.remove_file(instance.user_id, instance._original_filename, instance.blob.size)
+        folders.add_file(instance.user_id, instance.filename, instance.blob.size)
+        search.reindex_file(instance)
+        summary.invalidate(instance.user_id)
+
+    instance._original_filename = instance.filename
+
+@receiver(post_save, sender=FileReference)
+def add_to_summary(sender, instance, created, **kwargs):
+    if created:
+        blob = instance.blob
+        summary.record_files(instance.user_id, [(blob.size, blob.content_type, instance.is_primary_uploader)])
+
 @receiver(post_delete, sender=FileReference)
 def decrease_storage_on_delete(sender, instance, **kwargs):
     """
@@ -26,6 +61,14 @@ def decrease_storage_on_delete(sender, instance, **kwargs):
     file_size = instance.blob.size
     
     # Atomic update
-    UserProfile.objects.filter(user=instance.user).update(
-        storage_used=F('storage_used') - file_size
-    )
\ No newline at end of file
+    if instance.is_primary_uploader:
+        UserProfile.objects.filter(user=instance.user).update(
+            storage_used=F('storage_used') - file_size
+        )
+
+    folders.remove_file(instance.user_id, instance._original_filename, file_size)
+
+@receiver(post_delete, sender=FileReference)
+def remove_from_summary(sender, instance, **kwargs):
+    blob = instance.blob
+    summary.record_files(instance.user_id, [(blob.size, blob.content_type, instance.is_primary_uploader)], sign=-1)
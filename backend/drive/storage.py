@@ -0,0 +1,56 @@
+import os
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from core import metrics
+
+BLOB_ROOT = 'blobs'
+
+def blob_name(sha256_hash):
+    """
+    Content-addressed location: blobs/ab/cd/abcd...
+    Two levels of 256 shards keep every directory small, even with millions of blobs.
+    """
+    return f"{BLOB_ROOT}/{sha256_hash[:2]}/{sha256_hash[2:4]}/{sha256_hash}"
+
+def blob_upload_to(instance, filename):
+    # The user's filename never reaches the disk, only the content hash does
+    return blob_name(instance.sha256_hash)
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Blob store keyed by SHA-256.
+    A name fully determines the content, so there's no exists() probe or random suffix:
+    writing the same name twice just writes the same bytes.
+    Every write goes to a temp file in the target directory and is renamed into place,
+    readers never see a partial blob.
+    """
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Uploads staged on this filesystem move in with a single rename
+        if hasattr(content, 'temporary_file_path'):
+            os.replace(content.temporary_file_path(), full_path)
+        else:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    for chunk in content.chunks():
+                        out.write(chunk)
+                        metrics.BLOB_BYTES_WRITTEN.inc(len(chunk))
+                os.replace(temp_path, full_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+        return name
+
+blob_storage = ContentAddressedStorage()
@@ -0,0 +1,120 @@
+from collections import defaultdict
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum, Count, Q
+from core.cache import bump_user_version, user_cache_key
+from .models import DriveSummary, ContentTypeUsage, FileReference
+
+# Rendered stats are cached until the next write for the user
+STATS_CACHE_TIMEOUT = 60 * 60
+
+def stats_cache_key(user_id):
+    return user_cache_key(user_id, "drive:stats")
+
+def invalidate(user_id):
+    """
+    Every cached response of the user (stats, listings, profile) is stale after a write.
+    """
+    bump_user_version(user_id)
+
+def record_files(user_id, files, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) files from the user's summary.
+    files are (size, content_type, is_primary_uploader) tuples.
+    Users without a summary yet are skipped, theirs gets built from scratch on first read.
+    """
+    if not files:
+        return
+
+    count = len(files)
+    logical = sum(size for size, _, _ in files)
+    physical = sum(size for size, _, primary in files if primary)
+    duplicates = sum(1 for _, _, primary in files if not primary)
+
+    updated = DriveSummary.objects.filter(user_id=user_id).update(
+        file_count=F('file_count') + sign * count,
+        logical_bytes=F('logical_bytes') + sign * logical,
+        physical_bytes=F('physical_bytes') + sign * physical,
+        duplicate_count=F('duplicate_count') + sign * duplicates
+    )
+
+    if updated:
+        by_type = defaultdict(lambda: [0, 0])
+        for size, content_type, _ in files:
+            by_type[content_type][0] += 1
+            by_type[content_type][1] += size
+
+        for content_type, (type_count, type_bytes) in by_type.items():
+            if sign > 0:
+                ContentTypeUsage.objects.get_or_create(user_id=user_id, content_type=content_type)
+            ContentTypeUsage.objects.filter(user_id=user_id, content_type=content_type).update(
+                file_count=F('file_count') + sign * type_count,
+                total_bytes=F('total_bytes') + sign * type_bytes
+            )
+
+    invalidate(user_id)
+
+def record_promotions(promotions):
+    """
+    {user_id: (files, bytes)} that just became primary uploader: those bytes are now physically theirs.
+    """
+    for user_id, (count, size) in promotions.items():
+        DriveSummary.objects.filter(user_id=user_id).update(
+            physical_bytes=F('physical_bytes') + size,
+            duplicate_count=F('duplicate_count') - count
+        )
+        invalidate(user_id)
+
+def rebuild(user):
+    """
+    Builds the summary from the user's files, two grouped queries.
+    """
+    with transaction.atomic():
+        files = FileReference.objects.filter(user=user)
+        totals = files.aggregate(
+            file_count=Count('id'),
+            logical_bytes=Sum('blob__size'),
+            physical_bytes=Sum('blob__size', filter=Q(is_primary_uploader=True)),
+            duplicate_count=Count('id', filter=Q(is_primary_uploader=False))
+        )
+        summary, _ = DriveSummary.objects.update_or_create(
+            user=user,
+            defaults={field: value or 0 for field, value in totals.items()}
+        )
+
+        ContentTypeUsage.objects.filter(user=user).delete()
+        ContentTypeUsage.objects.bulk_create([
+            ContentTypeUsage(user=user, content_type=row['blob__content_type'],
+                             file_count=row['count'], total_bytes=row['size'] or 0)
+            for row in files.values('blob__content_type').annotate(count=Count('id'), size=Sum('blob__size'))
+        ])
+
+    return summary
+
+def get_stats(user):
+    """
+    Dashboard numbers for the user, served from cache when nothing changed since the last read.
+    """
+    key = stats_cache_key(user.id)
+    stats = cache.get(key)
+    if stats is not None:
+        return stats
+
+    summary = DriveSummary.objects.filter(user=user).first() or rebuild(user)
+    profile = user.profile
+
+    stats = {
+        'file_count': summary.file_count,
+        'logical_bytes': summary.logical_bytes,
+        'physical_bytes': summary.physical_bytes,
+        'saved_bytes': summary.logical_bytes - summary.physical_bytes,
+        'duplicate_count': summary.duplicate_count,
+        'storage_used': profile.storage_used,
+        'storage_limit': profile.storage_limit,
+        'by_type': [
+            {'content_type': row.content_type, 'file_count': row.file_count, 'total_bytes': row.total_bytes}
+            for row in ContentTypeUsage.objects.filter(user=user, file_count__gt=0).order_by('-total_bytes')
+        ],
+    }
+    cache.set(key, stats, STATS_CACHE_TIMEOUT)
+    return stats
@@ -1,3 +1,1811 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core import metrics
+from core.cache import LockingFileBasedCache
+from core.throttles import AtomicUserRateThrottle
+from user import quota
+from user.models import UserProfile, QuotaReservation
+from user.quota import QuotaExceeded
+from . import async_views, chunkstore, compression, gc, previews, search, summary
+from .chunkstore import open_blob
+from .models import (
+    PhysicalBlob, FileReference, Chunk, Derivative, FilenameTrigram, Folder, MaintenanceJob, UploadSession
+)
+from .services import compress_blob, delete_references, get_unique_filename, upload_batch
+from .storage import blob_storage, blob_name
+from .uploadhandlers import STAGING_DIR
 
-# Create your tests here.
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+# No shared cache unless a test asks for one: throttle counters never fill up, listings are never stale
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class DriveTestCase(TestCase):
+    """
+    Blobs are written to a fresh MEDIA_ROOT per test, user is logged in on self.client.
+    """
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='vinno-tests-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+
+        self.user = User.objects.create_user('alice', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def login(self, username):
+        user = User.objects.create_user(username, password='secret')
+        client = APIClient()
+        client.force_authenticate(user)
+        return user, client
+
+    def upload(self, filename, content, client=None, content_type='text/plain'):
+        return (client or self.client).post(reverse('upload_file'), {
+            'file': SimpleUploadedFile(filename.rsplit('/', 1)[-1], content, content_type=content_type),
+            'filename': filename,
+            'hash': sha256(content),
+            'size': len(content),
+        }, format='multipart')
+
+    def store(self, filename, content, user=None, content_type='text/plain'):
+        """
+        Adds a file through the service layer, for tests that aren't about uploading.
+        """
+        uploaded = SimpleUploadedFile(filename.rsplit('/', 1)[-1], content, content_type=content_type)
+        entry = {'filename': filename, 'hash': sha256(content), 'file': uploaded}
+        return upload_batch(user or self.user, [entry])[0]
+
+    def storage_used(self, user=None):
+        return UserProfile.objects.get(user=user or self.user).storage_used
+
+class FilenameSearchTests(DriveTestCase):
+    def test_bulk_delete_indexed_files(self):
+        first = self.upload('docs/report.txt', b'first report')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        second = self.store('docs/summary.txt', b'second report')
+
+        response = self.client.post(
+            reverse('bulk_delete'), {'ids': [first.data['id'], str(second.id)]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertFalse(FileReference.objects.filter(user=self.user).exists())
+        self.assertFalse(FilenameTrigram.objects.exists())
+        self.assertEqual(self.storage_used(), 0)
+        self.assertEqual(set(PhysicalBlob.objects.values_list('ref_count', flat=True)), {0})
+
+    def search(self, q, **params):
+        return self.client.get(reverse('search_files'), {'q': q, **params})
+
+    def names(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['filename'] for item in response.data['results']]
+
+    def test_substring_matches_rank_first(self):
+        self.store('photos/holiday-2023.jpg', b'1')
+        self.store('holiday.txt', b'2')
+        self.store('holliday-notes.txt', b'3')
+        self.store('budget.xlsx', b'4')
+
+        # Substring matches, shorter names first, then the close match
+        self.assertEqual(
+            self.names(self.search('holiday')), ['holiday.txt', 'photos/holiday-2023.jpg', 'holliday-notes.txt']
+        )
+        self.assertEqual(self.names(self.search('HOLIDAY', folder='photos/')), ['photos/holiday-2023.jpg'])
+        self.assertEqual(self.names(self.search('ge')), ['budget.xlsx'])
+
+    def test_search_is_scoped_to_the_user(self):
+        bob, _ = self.login('bob')
+        self.store('report.txt', b'bob', user=bob)
+
+        self.assertEqual(self.names(self.search('report')), [])
+
+    def test_renamed_files_are_reindexed(self):
+        file_ref = self.store('draft.txt', b'draft')
+
+        file_ref.filename = 'final.txt'
+        file_ref.save()
+
+        self.assertEqual(self.names(self.search('draft')), [])
+        self.assertEqual(self.names(self.search('final')), ['final.txt'])
+
+    def test_pages(self):
+        for index in range(5):
+            self.store(f'report{index}.txt', str(index).encode())
+
+        first = self.search('report', page_size=3)
+        second = self.search('report', page_size=3, cursor=first.data['next'])
+
+        self.assertEqual(len(first.data['results']), 3)
+        self.assertIsNone(second.data['next'])
+        self.assertEqual(
+            sorted(self.names(first) + self.names(second)), [f'report{index}.txt' for index in range(5)]
+        )
+
+    def test_bad_queries(self):
+        for params in ({'q': 'a'}, {'q': 'x' * 256}, {'q': 'report', 'cursor': 'nope'}):
+            response = self.client.get(reverse('search_files'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class GarbageCollectorTests(DriveTestCase):
+    def delete(self, file_ref):
+        response = self.client.delete(reverse('delete_file', args=[file_ref.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_reclaims_tombstones_after_grace_period(self):
+        file_ref = self.store('a.txt', b'gone soon')
+        path = file_ref.blob.file.path
+        self.delete(file_ref)
+
+        self.assertEqual(gc.reclaim_tombstones(grace_period=3600), (0, 0))
+        self.assertTrue(os.path.exists(path))
+
+        self.assertEqual(gc.reclaim_tombstones(grace_period=0), (1, len(b'gone soon')))
+        self.assertFalse(PhysicalBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + gc.TRASH_SUFFIX))
+
+    def test_keeps_referenced_blobs(self):
+        kept = self.store('a.txt', b'shared')
+        _, other = self.login('bob')
+        self.upload('b.txt', b'shared', client=other)
+        self.delete(kept)
+
+        self.assertEqual(gc.reclaim_tombstones(grace_period=0), (0, 0))
+        self.assertTrue(os.path.exists(PhysicalBlob.objects.get().file.path))
+
+    def test_upload_after_reclaim_stores_the_file_again(self):
+        file_ref = self.store('a.txt', b'comes back')
+        self.delete(file_ref)
+        gc.reclaim_tombstones(grace_period=0)
+
+        response = self.upload('a.txt', b'comes back')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        blob = PhysicalBlob.objects.get()
+        self.assertEqual(blob.ref_count, 1)
+        with blob.file.open('rb') as f:
+            self.assertEqual(f.read(), b'comes back')
+
+    def test_upload_during_grace_period_revives_the_blob(self):
+        file_ref = self.store('a.txt', b'revived')
+        path = file_ref.blob.file.path
+        self.delete(file_ref)
+        self.assertIsNotNone(PhysicalBlob.objects.get().deleted_at)
+
+        self.assertEqual(self.storage_used(), 0)
+
+        response = self.upload('b.txt', b'revived')
+
+        blob = PhysicalBlob.objects.get()
+        self.assertIsNone(blob.deleted_at)
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(gc.reclaim_tombstones(grace_period=0), (0, 0))
+        self.assertTrue(os.path.exists(path))
+        # Whoever brings the content back owns it
+        self.assertTrue(response.data['is_primary_uploader'])
+        self.assertEqual(self.storage_used(), len(b'revived'))
+
+    def test_batch_revival_is_charged_once(self):
+        self.delete(self.store('a.txt', b'revived'))
+
+        refs = upload_batch(self.user, [
+            {'filename': name, 'hash': sha256(b'revived'), 'file': SimpleUploadedFile(name, b'revived')}
+            for name in ('b.txt', 'c.txt')
+        ])
+
+        self.assertEqual([ref.is_primary_uploader for ref in refs], [True, False])
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 2)
+        self.assertEqual(self.storage_used(), len(b'revived'))
+
+    def test_reviving_someone_elses_tombstone_is_charged(self):
+        self.delete(self.store('a.txt', b'revived'))
+        bob, bob_client = self.login('bob')
+
+        response = self.upload('a.txt', b'revived', client=bob_client)
+
+        self.assertTrue(response.data['is_primary_uploader'])
+        self.assertEqual(self.storage_used(bob), len(b'revived'))
+        self.assertEqual(self.storage_used(), 0)
+
+    def test_sweeps_orphaned_files(self):
+        kept = self.store('a.txt', b'kept').blob.file.path
+        orphan = blob_storage.save('blobs/ff/ff/' + 'f' * 64, ContentFile(b'orphan'))
+        staged = blob_storage.save(f'{STAGING_DIR}/left-over', ContentFile(b'partial'))
+
+        self.assertEqual(gc.sweep_orphan_files(grace_period=3600), 0)
+        self.assertEqual(gc.sweep_orphan_files(grace_period=0, dry_run=True), 2)
+        self.assertTrue(blob_storage.exists(orphan))
+
+        self.assertEqual(gc.sweep_orphan_files(grace_period=0), 2)
+        self.assertFalse(blob_storage.exists(orphan))
+        self.assertFalse(blob_storage.exists(staged))
+        self.assertTrue(os.path.exists(kept))
+
+    def test_expires_stale_upload_sessions(self):
+        response = self.client.post(reverse('create_upload_session'), {
+            'filename': 'big.bin', 'hash': sha256(b'never finished'), 'size': 14,
+        }, format='json')
+        session = UploadSession.objects.get(id=response.data['id'])
+        self.client.put(
+            reverse('upload_chunk', args=[session.id, 0]), b'never', content_type='application/octet-stream'
+        )
+
+        self.assertEqual(gc.expire_upload_sessions(grace_period=3600), 0)
+        self.assertEqual(gc.expire_upload_sessions(grace_period=0), 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(blob_storage.location, 'uploads', str(session.id))))
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_reserved, 0)
+
+    def test_command_dry_run_keeps_everything(self):
+        file_ref = self.store('a.txt', b'tombstone')
+        self.delete(file_ref)
+        out = StringIO()
+
+        call_command('collect_garbage', grace=0, dry_run=True, stdout=out)
+        self.assertIn("[dry run] Reclaimed 1 blobs (9 bytes)", out.getvalue())
+        self.assertTrue(PhysicalBlob.objects.exists())
+
+        call_command('collect_garbage', grace=0, stdout=StringIO())
+        self.assertFalse(PhysicalBlob.objects.exists())
+
+
+class CompressionTests(DriveTestCase):
+    def run_command(self):
+        out = StringIO()
+        call_command('compress_blobs', stdout=out)
+        return out.getvalue()
+
+    def test_reads_a_highly_compressible_blob_in_bounded_pieces(self):
+        content = bytes(8 * compression.READ_SIZE) + b'tail'
+        blob = self.store('zeros.txt', content).blob
+        self.assertGreater(compress_blob(blob.sha256_hash, compression.CODECS['gzip']), 0)
+        blob.refresh_from_db()
+        self.assertEqual(blob.codec, 'gzip')
+
+        with open_blob(blob) as f:
+            f.seek(len(content) - 6)
+            self.assertEqual(f.read(6), b'\0\0tail')
+            self.assertLessEqual(len(f.raw.pending), compression.READ_SIZE)
+
+            # Backward seek starts over
+            f.seek(10)
+            self.assertEqual(f.read(4), bytes(4))
+            self.assertEqual(f.tell(), 14)
+
+    @override_settings(BLOB_COMPRESSION='gzip')
+    def test_command_compresses_what_pays_off(self):
+        text = self.store('notes.txt', b'compress me ' * 500).blob
+        flat_name = text.file.name
+        noise = self.store('noise.bin', random.Random(22).randbytes(4096), content_type='application/x-unknown')
+        photo = self.store('photo.png', b'png' * 1000, content_type='image/png').blob
+
+        self.assertIn("Compressed 1 of 3 blobs with gzip", self.run_command())
+        text.refresh_from_db()
+        self.assertEqual(text.codec, 'gzip')
+        self.assertTrue(text.file.name.endswith('.gz'))
+        self.assertLess(text.stored_size, text.size)
+        self.assertEqual(PhysicalBlob.objects.get(pk=noise.blob_id).codec, compression.IDENTITY)
+        self.assertEqual(PhysicalBlob.objects.get(pk=photo.pk).codec, compression.IDENTITY)
+
+        # Every blob is looked at once
+        self.assertIn("Compressed 0 of 0 blobs", self.run_command())
+
+        # The uncompressed file stays for readers of the old row until the orphan sweep's grace period is over
+        self.assertTrue(blob_storage.exists(flat_name))
+        self.assertEqual(gc.sweep_orphan_files(grace_period=3600), 0)
+        self.assertEqual(gc.sweep_orphan_files(grace_period=0), 1)
+        self.assertFalse(blob_storage.exists(flat_name))
+        self.assertTrue(blob_storage.exists(text.file.name))
+
+    @override_settings(BLOB_COMPRESSION='')
+    def test_command_needs_a_codec(self):
+        with self.assertRaises(CommandError):
+            self.run_command()
+
+    def test_downloads_of_compressed_blobs(self):
+        content = b'compressed download ' * 200
+        file_ref = self.store('big.txt', content)
+        compress_blob(file_ref.blob_id, compression.CODECS['gzip'])
+        url = reverse('download_file', args=[file_ref.id])
+
+        stored = self.client.get(url, headers={'accept-encoding': 'br, gzip'})
+        self.assertEqual(stored['Content-Encoding'], 'gzip')
+        self.assertEqual(stored['ETag'], f'"{sha256(content)}-gzip"')
+        self.assertEqual(gzip.decompress(b''.join(stored.streaming_content)), content)
+
+        plain = self.client.get(url, headers={'accept-encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        self.assertEqual(b''.join(plain.streaming_content), content)
+
+        ranged = self.client.get(url, headers={'accept-encoding': 'gzip', 'range': 'bytes=2000-2019'})
+        self.assertEqual(ranged.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertNotIn('Content-Encoding', ranged)
+        self.assertEqual(b''.join(ranged.streaming_content), content[2000:2020])
+
+class SharedCacheTests(DriveTestCase):
+    def file_cache(self, max_entries):
+        directory = tempfile.mkdtemp(prefix='vinno-cache-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        return LockingFileBasedCache(directory, {'OPTIONS': {'MAX_ENTRIES': max_entries}})
+
+    def test_file_cache_counters(self):
+        file_cache = self.file_cache(100)
+
+        self.assertTrue(file_cache.add('hits', 0, 60))
+        self.assertFalse(file_cache.add('hits', 5, 60))
+        self.assertEqual([file_cache.incr('hits') for _ in range(3)], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            file_cache.incr('missing')
+
+    def test_file_cache_culls_every_interval_writes(self):
+        file_cache = self.file_cache(5)
+
+        with mock.patch('core.cache.CULL_INTERVAL', 10), \
+                mock.patch.object(file_cache, '_list_cache_files', wraps=file_cache._list_cache_files) as listed:
+            for index in range(9):
+                file_cache.set(f'key{index}', index)
+            self.assertEqual(listed.call_count, 0)
+
+            # The 10th write finds 9 entries over a limit of 5 and culls a third of them
+            file_cache.set('key9', 9)
+            self.assertEqual(listed.call_count, 1)
+        self.assertEqual(len(file_cache._list_cache_files()), 7)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_throttle_counts_per_window(self):
+        cache.clear()
+        throttle = AtomicUserRateThrottle()
+        throttle.rate, (throttle.num_requests, throttle.duration) = '2/second', (2, 1)
+        request = SimpleNamespace(user=self.user)
+        before = metrics.THROTTLED.snapshot().get((('scope', 'user'),), 0)
+
+        with mock.patch.object(AtomicUserRateThrottle, 'timer', return_value=100.25):
+            self.assertEqual([throttle.allow_request(request, None) for _ in range(3)], [True, True, False])
+            self.assertEqual(throttle.wait(), 0.75)
+        with mock.patch.object(AtomicUserRateThrottle, 'timer', return_value=101.0):
+            self.assertTrue(throttle.allow_request(request, None))
+
+        self.assertEqual(metrics.THROTTLED.snapshot()[(('scope', 'user'),)], before + 1)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_user_rate_limit(self):
+        cache.clear()
+
+        with mock.patch.object(AtomicUserRateThrottle, 'timer', return_value=100.0):
+            codes = [self.client.get(reverse('get_files')).status_code for _ in range(5)]
+
+        self.assertEqual(codes, [200] * 4 + [status.HTTP_429_TOO_MANY_REQUESTS])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_listing_cached_until_the_next_write(self):
+        cache.clear()
+        self.store('a.txt', b'a')
+        self.assertEqual(len(self.client.get(reverse('get_files')).data['results']), 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(reverse('get_files')).data['results']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store('b.txt', b'b')
+        self.assertEqual(len(self.client.get(reverse('get_files')).data['results']), 2)
+
+class StorageQuotaTests(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob, self.bob_client = self.login('bob')
+        self.store('shared.bin', b'x' * 4000, user=self.bob)
+
+    def limit(self, storage_limit, user=None):
+        UserProfile.objects.filter(user=user or self.user).update(storage_limit=storage_limit)
+
+    def profile(self, user=None):
+        return UserProfile.objects.get(user=user or self.user)
+
+    def test_upload_charges_stored_bytes_and_releases_the_reservation(self):
+        response = self.upload('a.txt', b'a' * 100)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.profile().storage_used, 100)
+        self.assertEqual(self.profile().storage_reserved, 0)
+        self.assertFalse(QuotaReservation.objects.exists())
+
+    def test_new_content_over_quota_is_refused(self):
+        self.limit(1000)
+
+        response = self.upload('big.bin', b'y' * 4000)
+
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(FileReference.objects.filter(user=self.user).exists())
+        self.assertFalse(PhysicalBlob.objects.filter(sha256_hash=sha256(b'y' * 4000)).exists())
+        self.assertEqual(self.profile().storage_reserved, 0)
+
+    def test_stored_content_is_free_over_quota(self):
+        self.limit(1000)
+
+        response = self.upload('copy.bin', b'x' * 4000)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.profile().storage_used, 0)
+        self.assertEqual(self.profile().storage_reserved, 0)
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 2)
+
+    def test_reviving_a_tombstone_over_quota_is_refused(self):
+        self.store('gone.bin', b'g' * 4000)
+        self.client.delete(reverse('delete_file', args=[FileReference.objects.get(user=self.user).id]))
+        self.limit(1000)
+
+        response = self.upload('gone.bin', b'g' * 4000)
+        session = self.client.post(reverse('create_upload_session'), {
+            'filename': 'gone.bin', 'hash': sha256(b'g' * 4000), 'size': 4000,
+        }, format='json')
+        batch = self.client.post(reverse('upload_batch'), {
+            'file': [SimpleUploadedFile('gone.bin', b'g' * 4000)],
+            'filename': ['gone.bin'], 'hash': [sha256(b'g' * 4000)], 'size': [4000],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(session.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(batch.data['results'][0]['error'], "Storage quota exceeded")
+        self.assertFalse(FileReference.objects.filter(user=self.user).exists())
+        self.assertIsNotNone(PhysicalBlob.objects.get(sha256_hash=sha256(b'g' * 4000)).deleted_at)
+        self.assertEqual(self.profile().storage_used, 0)
+        self.assertEqual(self.profile().storage_reserved, 0)
+
+    def test_batch_over_quota_keeps_stored_content(self):
+        self.limit(1000)
+        contents = [b'x' * 4000, b'z' * 4000]
+
+        response = self.client.post(reverse('upload_batch'), {
+            'file': [SimpleUploadedFile(f'{index}.bin', content) for index, content in enumerate(contents)],
+            'filename': ['copy.bin', 'new.bin'],
+            'hash': [sha256(content) for content in contents],
+            'size': [len(content) for content in contents],
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        copy, new = response.data['results']
+        self.assertEqual(copy['file']['filename'], 'copy.bin')
+        self.assertEqual(new['error'], "Storage quota exceeded")
+        self.assertEqual(self.profile().storage_used, 0)
+        self.assertEqual(self.profile().storage_reserved, 0)
+
+    def test_reservations_count_against_the_limit(self):
+        self.limit(1000)
+
+        first = quota.reserve(self.user, 600)
+        with self.assertRaises(QuotaExceeded):
+            quota.reserve(self.user, 600)
+
+        quota.release(first)
+        quota.release(first)
+        self.assertEqual(self.profile().storage_reserved, 0)
+        self.assertIsNotNone(quota.reserve(self.user, 600))
+        self.assertIsNone(quota.reserve(self.user, 0))
+
+    def test_stale_reservations_expire(self):
+        quota.reserve(self.user, 100)
+        response = self.client.post(reverse('create_upload_session'), {
+            'filename': 'big.bin', 'hash': sha256(b'b' * 50), 'size': 50,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.profile().storage_reserved, 150)
+
+        self.assertEqual(quota.expire_reservations(3600), 0)
+        self.assertEqual(quota.expire_reservations(0, dry_run=True), 1)
+        self.assertEqual(quota.expire_reservations(0), 1)
+
+        # The session keeps its own until it's committed or expires
+        self.assertEqual(self.profile().storage_reserved, 50)
+        self.assertEqual(str(QuotaReservation.objects.get().upload_session.id), response.data['id'])
+
+    def test_session_over_quota_is_refused(self):
+        self.limit(1000)
+
+        response = self.client.post(reverse('create_upload_session'), {
+            'filename': 'big.bin', 'hash': sha256(b'y' * 4000), 'size': 4000,
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(UploadSession.objects.exists())
+
+class MetricsTests(DriveTestCase):
+    @override_settings(METRICS_TOKEN=None, DEBUG=False)
+    def test_closed_without_token_outside_debug(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=True)
+    def test_open_in_debug_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN='scrape', DEBUG=True)
+    def test_token_required_when_set(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('# TYPE vinno_http_request_duration_seconds histogram', response.content.decode())
+
+    def test_snapshots_of_exited_workers_are_folded_into_the_retired_totals(self):
+        directory = tempfile.mkdtemp(prefix='vinno-metrics-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        exited = subprocess.Popen([sys.executable, '-c', '']).pid
+        os.waitpid(exited, 0)
+        name = metrics.THROTTLED.name
+        for pid in (exited, os.getppid()):
+            metrics.write_snapshot(os.path.join(directory, f"{pid}.json"), {name: {(('scope', 'test'),): 2}})
+
+        with self.settings(METRICS_DIR=directory):
+            # Same totals once the exited worker's file is gone
+            for _ in range(2):
+                totals = {}
+                for data in metrics.load_snapshots():
+                    metrics.Counter.merge(totals, data.get(name, {}))
+                self.assertEqual(totals, {(('scope', 'test'),): 4})
+
+        self.assertEqual(sorted(os.listdir(directory)), [f"{os.getppid()}.json", 'retired.json', 'retired.lock'])
+
+    def test_requests_are_timed_and_their_queries_counted(self):
+        endpoint = (('endpoint', 'get_files'),)
+        duration = (('endpoint', 'get_files'), ('method', 'GET'), ('status', 200))
+        count_before = sum(metrics.REQUEST_DURATION.snapshot().get(duration, [0])[:-1])
+        queries_before = metrics.DB_QUERIES.snapshot().get(endpoint, 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('get_files'))
+
+        self.assertEqual(sum(metrics.REQUEST_DURATION.snapshot()[duration][:-1]), count_before + 1)
+        self.assertEqual(metrics.DB_QUERIES.snapshot()[endpoint], queries_before + len(queries))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_SAMPLE_RATE=1)
+    def test_slow_requests_log_their_sql(self):
+        before = metrics.SLOW_REQUESTS.snapshot().get((('endpoint', 'get_files'),), 0)
+
+        with self.assertLogs('vinno.slow', 'WARNING') as logs:
+            self.client.get(reverse('get_files'))
+
+        self.assertEqual(metrics.SLOW_REQUESTS.snapshot()[(('endpoint', 'get_files'),)], before + 1)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['path'], reverse('get_files'))
+        self.assertEqual(len(line['sql']), line['queries'])
+
+    def test_dedup_lookups(self):
+        before = metrics.DEDUP_LOOKUPS.snapshot()
+
+        self.upload('a.txt', b'same')
+        self.upload('b.txt', b'same')
+
+        after = metrics.DEDUP_LOOKUPS.snapshot()
+        for result in ('hit', 'miss'):
+            key = (('result', result),)
+            self.assertEqual(after[key], before.get(key, 0) + 1)
+
+    def test_exposition_format(self):
+        histogram = metrics.Histogram('test_seconds', "Test", buckets=(0.1, 1))
+        metrics.registry.remove(histogram)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, path='a"b')
+
+        lines = list(histogram.render(histogram.snapshot()))
+
+        self.assertEqual(lines, [
+            'test_seconds_bucket{path="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{path="a\\"b",le="1"} 2',
+            'test_seconds_bucket{path="a\\"b",le="+Inf"} 3',
+            'test_seconds_sum{path="a\\"b"} 5.55',
+            'test_seconds_count{path="a\\"b"} 3',
+        ])
+
+class UploadPreflightTests(DriveTestCase):
+    def preflight(self, files, client=None):
+        return (client or self.client).post(reverse('upload_preflight'), {'files': files}, format='json')
+
+    def test_links_own_content_and_reports_the_rest(self):
+        self.store('mine.txt', b'my content')
+
+        response = self.preflight([
+            {'filename': 'copy.txt', 'hash': sha256(b'my content'), 'size': 10},
+            {'filename': 'new.txt', 'hash': sha256(b'new content'), 'size': 11},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['missing'], [sha256(b'new content')])
+        [linked] = response.data['linked']
+        self.assertEqual(linked['filename'], 'copy.txt')
+        self.assertFalse(linked['is_primary_uploader'])
+        self.assertTrue(linked['is_duplicate'])
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 2)
+        # Deduplicated files don't count against the quota
+        self.assertEqual(self.storage_used(), len(b'my content'))
+
+    def test_other_users_content_has_to_be_uploaded(self):
+        _, bob_client = self.login('bob')
+        self.upload('shared.txt', b'shared content', client=bob_client)
+
+        response = self.preflight([{'filename': 'mine.txt', 'hash': sha256(b'shared content'), 'size': 14}])
+
+        # Knowing the hash doesn't prove having the bytes
+        self.assertEqual(response.data, {'linked': [], 'missing': [sha256(b'shared content')]})
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 1)
+
+        # The upload still dedups, for free
+        self.assertEqual(self.upload('mine.txt', b'shared content').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 2)
+        self.assertEqual(self.storage_used(), 0)
+
+    def test_size_must_match(self):
+        self.store('a.txt', b'twelve bytes')
+
+        response = self.preflight([{'filename': 'b.txt', 'hash': sha256(b'twelve bytes'), 'size': 13}])
+
+        self.assertEqual(response.data, {'linked': [], 'missing': [sha256(b'twelve bytes')]})
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 1)
+
+    def test_tombstones_have_to_be_uploaded(self):
+        file_ref = self.store('a.txt', b'deleted content')
+        self.client.delete(reverse('delete_file', args=[file_ref.id]))
+        self.assertIsNotNone(PhysicalBlob.objects.get().deleted_at)
+
+        response = self.preflight([{'filename': 'a.txt', 'hash': sha256(b'deleted content'), 'size': 15}])
+
+        # Reviving is charged like new content, so it goes through the quota-checked upload
+        self.assertEqual(response.data, {'linked': [], 'missing': [sha256(b'deleted content')]})
+        blob = PhysicalBlob.objects.get()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertIsNotNone(blob.deleted_at)
+        self.assertEqual(self.storage_used(), 0)
+
+    def test_rejects_an_empty_or_malformed_batch(self):
+        self.assertEqual(self.preflight([]).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.preflight([{'filename': 'a.txt', 'hash': 'abc', 'size': 1}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_authentication(self):
+        response = APIClient().post(reverse('upload_preflight'), {'files': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+@override_settings(UPLOAD_CHUNK_SIZE=4)
+class UploadSessionTests(DriveTestCase):
+    content = b'0123456789'
+
+    def open_session(self, content=None, client=None, **extra):
+        content = self.content if content is None else content
+        return (client or self.client).post(reverse('create_upload_session'), {
+            'filename': 'big.bin',
+            'hash': sha256(content),
+            'size': len(content),
+            **extra,
+        }, format='json')
+
+    def put_chunk(self, session_id, index, data):
+        return self.client.put(
+            reverse('upload_chunk', args=[session_id, index]), data, content_type='application/octet-stream'
+        )
+
+    def commit(self, session_id):
+        return self.client.post(reverse('commit_session', args=[session_id]))
+
+    def test_chunks_in_any_order_then_commit(self):
+        response = self.open_session()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session_id = response.data['id']
+        self.assertEqual(response.data['total_chunks'], 3)
+        self.assertEqual(response.data['missing_chunks'], [0, 1, 2])
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_reserved, 10)
+
+        for index in (2, 0):
+            self.assertEqual(
+                self.put_chunk(session_id, index, self.content[index * 4:index * 4 + 4]).status_code,
+                status.HTTP_204_NO_CONTENT
+            )
+        response = self.client.get(reverse('upload_session', args=[session_id]))
+        self.assertEqual(response.data['missing_chunks'], [1])
+
+        self.put_chunk(session_id, 1, b'4567')
+        response = self.commit(session_id)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['filename'], 'big.bin')
+        blob = PhysicalBlob.objects.get()
+        with blob.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(blob.ref_count, 1)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.storage_used, profile.storage_reserved), (10, 0))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_commit_refuses_incomplete_or_wrong_content(self):
+        session_id = self.open_session(content=b'abcdefgh').data['id']
+        self.put_chunk(session_id, 0, b'abcd')
+
+        response = self.commit(session_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['session']['missing_chunks'], [1])
+
+        self.put_chunk(session_id, 1, b'XXXX')
+        response = self.commit(session_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], "Uploaded content does not match the declared hash")
+        self.assertFalse(PhysicalBlob.objects.exists())
+
+    def test_chunk_length_and_index_are_checked(self):
+        session_id = self.open_session().data['id']
+
+        self.assertEqual(self.put_chunk(session_id, 0, b'012').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(session_id, 2, b'8').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(session_id, 3, b'').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('upload_session', args=[session_id]))
+        self.assertEqual(response.data['missing_chunks'], [0, 1, 2])
+
+    def test_stored_content_reserves_nothing(self):
+        self.store('first.bin', self.content)
+
+        response = self.open_session()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_reserved, 0)
+
+    def test_over_quota(self):
+        UserProfile.objects.filter(user=self.user).update(storage_limit=5)
+        self.assertEqual(self.open_session().status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_commit_reviving_a_tombstone_is_charged(self):
+        file_ref = self.store('first.bin', self.content)
+        self.client.delete(reverse('delete_file', args=[file_ref.id]))
+        session_id = self.open_session().data['id']
+        for index in range(3):
+            self.put_chunk(session_id, index, self.content[index * 4:index * 4 + 4])
+
+        response = self.commit(session_id)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['is_primary_uploader'])
+        self.assertIsNone(PhysicalBlob.objects.get().deleted_at)
+        self.assertEqual(self.storage_used(), len(self.content))
+
+    def test_abort_releases_the_reservation(self):
+        session_id = self.open_session().data['id']
+        self.put_chunk(session_id, 0, b'0123')
+
+        response = self.client.delete(reverse('upload_session', args=[session_id]))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).storage_reserved, 0)
+
+    def test_sessions_are_private(self):
+        session_id = self.open_session().data['id']
+        _, bob_client = self.login('bob')
+
+        response = bob_client.get(reverse('upload_session', args=[session_id]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class UploadVerificationTests(DriveTestCase):
+    def staged_files(self):
+        staging = blob_storage.path(STAGING_DIR)
+        return os.listdir(staging) if os.path.isdir(staging) else []
+
+    def test_declared_hash_must_match_the_content(self):
+        response = self.client.post(reverse('upload_file'), {
+            'file': SimpleUploadedFile('a.txt', b'real content'),
+            'filename': 'a.txt',
+            'hash': sha256(b'claimed content'),
+            'size': 12,
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], "Uploaded content does not match the declared hash")
+        self.assertFalse(PhysicalBlob.objects.exists())
+        self.assertEqual(self.staged_files(), [])
+        self.assertEqual(self.storage_used(), 0)
+
+    def test_blob_is_keyed_by_the_verified_hash(self):
+        response = self.upload('a.txt', b'real content')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['hash'], sha256(b'real content'))
+        self.assertEqual(PhysicalBlob.objects.get().sha256_hash, sha256(b'real content'))
+        self.assertEqual(self.staged_files(), [])
+
+    def test_batch_rejects_only_the_mismatching_file(self):
+        response = self.client.post(reverse('upload_batch'), {
+            'file': [SimpleUploadedFile('good.txt', b'good'), SimpleUploadedFile('bad.txt', b'bad')],
+            'filename': ['good.txt', 'bad.txt'],
+            'hash': [sha256(b'good'), sha256(b'forged')],
+            'size': [4, 3],
+        }, format='multipart')
+
+        good, bad = response.data['results']
+        self.assertEqual(good['file']['hash'], sha256(b'good'))
+        self.assertEqual(bad['error'], "Uploaded content does not match the declared hash")
+        self.assertEqual(list(PhysicalBlob.objects.values_list('sha256_hash', flat=True)), [sha256(b'good')])
+
+class FileListingTests(DriveTestCase):
+    def list_files(self, **params):
+        return self.client.get(reverse('get_files'), params)
+
+    def test_pages_walk_every_file_once_newest_first(self):
+        refs = [self.store(f'f{index}.txt', f'content {index}'.encode()) for index in range(7)]
+        # Same timestamp for some rows, the id breaks the tie
+        FileReference.objects.filter(id__in=[ref.id for ref in refs[2:5]]).update(upload_timestamp=refs[2].upload_timestamp)
+
+        seen = []
+        params = {'page_size': 3}
+        while True:
+            response = self.list_files(**params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                break
+            params['cursor'] = response.data['next']
+
+        expected = FileReference.objects.order_by('-upload_timestamp', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, [str(ref_id) for ref_id in expected])
+
+    def test_filters(self):
+        self.store('docs/a.txt', b'a')
+        self.store('docs/deep/b.png', b'b', content_type='image/png')
+        self.store('other/report.txt', b'c')
+
+        def names(**params):
+            return sorted(item['filename'] for item in self.list_files(**params).data['results'])
+
+        self.assertEqual(names(folder='docs'), ['docs/a.txt', 'docs/deep/b.png'])
+        self.assertEqual(names(content_type='image/'), ['docs/deep/b.png'])
+        self.assertEqual(names(content_type='text/plain'), ['docs/a.txt', 'other/report.txt'])
+        self.assertEqual(names(name='REPORT'), ['other/report.txt'])
+
+    def test_only_the_users_files(self):
+        bob, _ = self.login('bob')
+        self.store('bob.txt', b'bob', user=bob)
+        self.store('alice.txt', b'alice')
+
+        results = self.list_files().data['results']
+
+        self.assertEqual([item['filename'] for item in results], ['alice.txt'])
+
+    def test_one_query_per_page(self):
+        for index in range(5):
+            self.store(f'f{index}.txt', f'content {index}'.encode())
+
+        with self.assertNumQueries(1):
+            response = self.list_files()
+
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.list_files(cursor='not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class FolderIndexTests(DriveTestCase):
+    def folders(self):
+        return {
+            folder.path: (folder.file_count, folder.folder_count, folder.total_files, folder.total_size)
+            for folder in Folder.objects.filter(user=self.user)
+        }
+
+    def test_counters_follow_uploads_and_deletes(self):
+        self.upload('a/one.txt', b'1')
+        self.store('a/b/two.txt', b'22')
+        first = self.store('a/b/c/three.txt', b'333')
+
+        self.assertEqual(self.folders(), {
+            'a': (1, 1, 3, 6),
+            'a/b': (1, 1, 2, 5),
+            'a/b/c': (1, 0, 1, 3),
+        })
+
+        self.client.delete(reverse('delete_file', args=[first.id]))
+        self.assertEqual(self.folders(), {'a': (1, 1, 2, 3), 'a/b': (1, 0, 1, 2)})
+
+        self.client.post(reverse('bulk_delete'), {'folder': 'a/b'}, format='json')
+        self.assertEqual(self.folders(), {'a': (1, 0, 1, 1)})
+
+    def test_rename_moves_the_file_between_folders(self):
+        file_ref = self.store('a/note.txt', b'note')
+
+        file_ref.filename = 'b/note.txt'
+        file_ref.save()
+
+        self.assertEqual(self.folders(), {'b': (1, 0, 1, 4)})
+        self.assertEqual(FileReference.objects.get().parent_path, 'b')
+
+    def test_list_folder(self):
+        self.store('root.txt', b'root')
+        self.store('a/one.txt', b'1')
+        self.store('a/b/two.txt', b'22')
+        self.store('a/c/three.txt', b'333')
+
+        response = self.client.get(reverse('list_folder'), {'path': 'a/'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['path'], 'a')
+        self.assertEqual([folder['path'] for folder in response.data['folders']], ['a/b', 'a/c'])
+        self.assertEqual([item['filename'] for item in response.data['files']], ['a/one.txt'])
+
+        root = self.client.get(reverse('list_folder')).data
+        self.assertEqual([folder['name'] for folder in root['folders']], ['a'])
+        self.assertEqual(root['folders'][0]['total_files'], 3)
+        self.assertEqual([item['filename'] for item in root['files']], ['root.txt'])
+
+    def test_unknown_folder(self):
+        bob, _ = self.login('bob')
+        self.store('private/x.txt', b'x', user=bob)
+
+        response = self.client.get(reverse('list_folder'), {'path': 'private'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class UniqueFilenameTests(DriveTestCase):
+    def test_lowest_free_counter(self):
+        for name in ['docs/report.txt', 'docs/report(1).txt', 'docs/report(3).txt', 'docs/report(x).txt']:
+            self.store(name, name.encode())
+
+        with self.assertNumQueries(2):
+            self.assertEqual(get_unique_filename(self.user, 'docs/report.txt'), 'docs/report(2).txt')
+
+    def test_free_name_is_kept(self):
+        self.store('report.txt', b'report')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_unique_filename(self.user, 'notes.txt'), 'notes.txt')
+        self.assertEqual(get_unique_filename(self.user, 'report.txt'), 'report(1).txt')
+
+    def test_names_are_per_user(self):
+        bob, _ = self.login('bob')
+        self.store('report.txt', b'bob', user=bob)
+
+        self.assertEqual(get_unique_filename(self.user, 'report.txt'), 'report.txt')
+
+    def test_upload_renames_a_duplicate_name(self):
+        self.upload('report.txt', b'first')
+        response = self.upload('report.txt', b'second')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            sorted(FileReference.objects.values_list('filename', flat=True)),
+            ['report(1).txt', 'report.txt']
+        )
+
+class BatchUploadTests(DriveTestCase):
+    def batch(self, files, **overrides):
+        data = {
+            'file': [SimpleUploadedFile(name, content) for name, content in files],
+            'filename': [name for name, _ in files],
+            'hash': [sha256(content) for _, content in files],
+            'size': [len(content) for _, content in files],
+        }
+        data.update(overrides)
+        return self.client.post(reverse('upload_batch'), data, format='multipart')
+
+    def test_batch_accounting(self):
+        self.store('old.txt', b'old')
+
+        response = self.batch([
+            ('docs/a.txt', b'aaaa'),
+            ('docs/b.txt', b'aaaa'),
+            ('docs/c.txt', b'old'),
+            ('old.txt', b'new content'),
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [result['file']['filename'] for result in response.data['results']]
+        self.assertEqual(names, ['docs/a.txt', 'docs/b.txt', 'docs/c.txt', 'old(1).txt'])
+        self.assertEqual(PhysicalBlob.objects.get(sha256_hash=sha256(b'aaaa')).ref_count, 2)
+        self.assertEqual(PhysicalBlob.objects.get(sha256_hash=sha256(b'old')).ref_count, 2)
+        # Only the first copy of new content is charged
+        self.assertEqual(self.storage_used(), 3 + 4 + 11)
+        self.assertEqual(
+            FileReference.objects.filter(is_primary_uploader=True).count(), 3
+        )
+        folder = Folder.objects.get(user=self.user, path='docs')
+        self.assertEqual((folder.file_count, folder.total_size), (3, 11))
+
+    def test_bad_entries_dont_fail_the_batch(self):
+        response = self.batch(
+            [('good.txt', b'good'), ('forged.txt', b'forged'), ('bad.txt', b'bad')],
+            hash=[sha256(b'good'), sha256(b'other'), 'nothex']
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        good, forged, bad = response.data['results']
+        self.assertEqual(good['file']['filename'], 'good.txt')
+        self.assertEqual(forged['error'], "Uploaded content does not match the declared hash")
+        self.assertIn('hash', bad['errors'])
+        self.assertEqual(list(FileReference.objects.values_list('filename', flat=True)), ['good.txt'])
+        self.assertEqual(self.storage_used(), 4)
+
+    def test_fields_must_line_up(self):
+        response = self.batch([('a.txt', b'a'), ('b.txt', b'b')], filename=['a.txt'])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(FileReference.objects.exists())
+
+    def test_no_files(self):
+        response = self.client.post(reverse('upload_batch'), {}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class BulkDeleteTests(DriveTestCase):
+    def test_accounting_and_promotion(self):
+        bob, _ = self.login('bob')
+        shared = self.store('docs/shared.txt', b'shared')
+        self.store('copy.txt', b'shared', user=bob)
+        own = self.store('docs/own.txt', b'own')
+        twice = self.store('docs/twice.txt', b'twice')
+        self.store('twice.txt', b'twice')
+
+        response = self.client.post(reverse('bulk_delete'), {'ids': [shared.id, own.id, twice.id]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deleted'], 3)
+        self.assertEqual(PhysicalBlob.objects.get(sha256_hash=sha256(b'shared')).ref_count, 1)
+        self.assertEqual(PhysicalBlob.objects.get(sha256_hash=sha256(b'twice')).ref_count, 1)
+        self.assertIsNotNone(PhysicalBlob.objects.get(sha256_hash=sha256(b'own')).deleted_at)
+
+        # Bob's copy and alice's remaining twice.txt now own their bytes
+        self.assertTrue(FileReference.objects.get(user=bob).is_primary_uploader)
+        self.assertTrue(FileReference.objects.get(user=self.user).is_primary_uploader)
+        self.assertEqual(self.storage_used(), 5)
+        self.assertEqual(self.storage_used(bob), 6)
+
+    def test_files_deleted_concurrently_are_only_counted_once(self):
+        file_ref = self.store('a.txt', b'content')
+        refs = FileReference.objects.filter(id=file_ref.id)
+
+        # The other request wins the race right after we read the rows
+        unindex_files = search.unindex_files
+        def concurrent_delete(ids):
+            unindex_files(ids)
+            FileReference.objects.filter(id__in=ids)._raw_delete('default')
+
+        with mock.patch('drive.search.unindex_files', side_effect=concurrent_delete):
+            self.assertEqual(delete_references(self.user, refs), 0)
+        self.assertEqual(delete_references(self.user, refs), 0)
+
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 1)
+        self.assertEqual(self.storage_used(), len(b'content'))
+
+    def test_folder_delete_is_scoped_to_the_user(self):
+        bob, _ = self.login('bob')
+        self.store('docs/a.txt', b'a')
+        self.store('docs/sub/b.txt', b'b')
+        self.store('docsx/c.txt', b'c')
+        self.store('docs/d.txt', b'd', user=bob)
+
+        response = self.client.post(reverse('bulk_delete'), {'folder': '/docs/'}, format='json')
+
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(
+            sorted(FileReference.objects.values_list('filename', flat=True)), ['docs/d.txt', 'docsx/c.txt']
+        )
+        self.assertEqual(self.storage_used(), 1)
+
+    def test_other_users_ids_are_ignored(self):
+        bob, _ = self.login('bob')
+        theirs = self.store('theirs.txt', b'theirs', user=bob)
+
+        response = self.client.post(reverse('bulk_delete'), {'ids': [theirs.id]}, format='json')
+
+        self.assertEqual(response.data['deleted'], 0)
+        self.assertTrue(FileReference.objects.filter(id=theirs.id).exists())
+
+    def test_queries_dont_grow_with_the_selection(self):
+        def delete_folder(folder, count):
+            for index in range(count):
+                self.store(f'{folder}/{index}.txt', f'{folder}{index}'.encode())
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('bulk_delete'), {'folder': folder}, format='json')
+            return len(queries)
+
+        self.assertEqual(delete_folder('small', 2), delete_folder('large', 20))
+
+    def test_ids_or_folder(self):
+        url = reverse('bulk_delete')
+        self.assertEqual(self.client.post(url, {}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {'ids': [], 'folder': 'docs'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class DeleteFileTests(DriveTestCase):
+    def test_last_copy_is_promoted(self):
+        bob, _ = self.login('bob')
+        original = self.store('a.txt', b'content')
+        self.store('b.txt', b'content', user=bob)
+
+        response = self.client.delete(reverse('delete_file', args=[original.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(FileReference.objects.get(user=bob).is_primary_uploader)
+        self.assertEqual(self.storage_used(), 0)
+        self.assertEqual(self.storage_used(bob), 7)
+        self.assertIsNone(PhysicalBlob.objects.get().deleted_at)
+
+    def test_not_found_for_other_users(self):
+        bob, _ = self.login('bob')
+        theirs = self.store('theirs.txt', b'theirs', user=bob)
+
+        response = self.client.delete(reverse('delete_file', args=[theirs.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(PhysicalBlob.objects.get().ref_count, 1)
+
+class BlobLayoutTests(DriveTestCase):
+    def test_uploads_land_at_their_content_address(self):
+        content = b'addressed'
+        file_hash = sha256(content)
+
+        self.upload('first.txt', content)
+
+        blob = PhysicalBlob.objects.get()
+        self.assertEqual(blob.file.name, f'blobs/{file_hash[:2]}/{file_hash[2:4]}/{file_hash}')
+        with blob.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_same_name_is_overwritten_in_place(self):
+        name = blob_storage.save(blob_name('ab' * 32), ContentFile(b'one'))
+        self.assertEqual(blob_storage.save(name, ContentFile(b'one')), name)
+
+        directory = os.path.dirname(blob_storage.path(name))
+        self.assertEqual(os.listdir(directory), ['ab' * 32])
+
+    def test_migrates_flat_blobs(self):
+        content = b'old layout'
+        blob = self.store('a.txt', content).blob
+        old_name = 'blobs/a.txt'
+        os.replace(blob.file.path, blob_storage.path(old_name))
+        PhysicalBlob.objects.filter(pk=blob.pk).update(file=old_name)
+
+        call_command('migrate_blob_layout', dry_run=True, stdout=StringIO())
+        self.assertEqual(PhysicalBlob.objects.get().file.name, old_name)
+
+        out = StringIO()
+        call_command('migrate_blob_layout', stdout=out)
+
+        self.assertIn("Done: 1 moved, 0 missing", out.getvalue())
+        blob.refresh_from_db()
+        self.assertEqual(blob.file.name, blob_name(blob.sha256_hash))
+        self.assertFalse(blob_storage.exists(old_name))
+        with blob.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+class DownloadTests(DriveTestCase):
+    content = b'0123456789abcdefghij'
+
+    def setUp(self):
+        super().setUp()
+        self.file_ref = self.store('docs/report.txt', self.content)
+        self.url = reverse('download_file', args=[self.file_ref.id])
+
+    def download(self, client=None, url=None, **headers):
+        return (client or self.client).get(url or self.url, headers=headers)
+
+    def test_whole_file(self):
+        response = self.download()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{sha256(self.content)}"')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('report.txt', response['Content-Disposition'])
+
+    def test_if_none_match(self):
+        response = self.download(if_none_match=f'"{sha256(self.content)}"')
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_single_range(self):
+        response = self.download(range='bytes=5-9')
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 5-9/20')
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+
+        suffix = self.download(range='bytes=-3')
+        self.assertEqual(b''.join(suffix.streaming_content), b'hij')
+
+    def test_multiple_ranges(self):
+        response = self.download(range='bytes=0-1,18-')
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-1/20\r\n\r\n01\r\n', body)
+        self.assertIn(b'Content-Range: bytes 18-19/20\r\n\r\nij\r\n', body)
+
+    def test_unsatisfiable_range(self):
+        response = self.download(range='bytes=50-')
+
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */20')
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.download(range='bytes=0-1', if_range='"stale"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_signed_link(self):
+        link = self.client.get(reverse('get_files')).data['results'][0]['download_url']
+
+        response = self.download(client=APIClient(), url=link)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_auth_errors(self):
+        anonymous = APIClient()
+        self.assertEqual(self.download(client=anonymous).status_code, status.HTTP_401_UNAUTHORIZED)
+        forged = self.download(client=anonymous, url=f'{self.url}?token=forged')
+        self.assertEqual(forged.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        _, other = self.login('bob')
+        self.assertEqual(self.download(client=other).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(DOWNLOAD_SENDFILE_MODE='x-accel', DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_proxy_offload(self):
+        response = self.download()
+
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.file_ref.blob.file.name}')
+        self.assertEqual(response.content, b'')
+
+class ReconcileStorageTests(DriveTestCase):
+    def reconcile(self, **options):
+        out = StringIO()
+        call_command('reconcile_storage', stdout=out, **options)
+        return out.getvalue()
+
+    def test_fixes_drift(self):
+        bob, _ = self.login('bob')
+        self.store('a.txt', b'aaaa')
+        self.store('b.txt', b'aaaa', user=bob)
+        orphan = self.store('c.txt', b'cc').blob
+        FileReference.objects.filter(blob=orphan).delete()
+        UserProfile.objects.filter(user=self.user).update(storage_used=999)
+        PhysicalBlob.objects.filter(pk=orphan.pk).update(ref_count=1, deleted_at=None)
+        PhysicalBlob.objects.filter(sha256_hash=sha256(b'aaaa')).update(ref_count=7)
+
+        report = self.reconcile(dry_run=True)
+
+        self.assertIn(f"[dry run] user {self.user.id}: storage_used 999 -> 4", report)
+        self.assertIn("[dry run] Users: 2 checked, 1 drifted", report)
+        self.assertIn("[dry run] Blobs: 2 checked, 2 drifted", report)
+        self.assertEqual(self.storage_used(), 999)
+
+        report = self.reconcile()
+
+        self.assertIn(f"blob {orphan.sha256_hash[:12]}...: ref_count 1 -> 0, tombstoned", report)
+        self.assertEqual(self.storage_used(), 4)
+        self.assertEqual(self.storage_used(bob), 0)
+        self.assertEqual(PhysicalBlob.objects.get(sha256_hash=sha256(b'aaaa')).ref_count, 2)
+        self.assertIsNotNone(PhysicalBlob.objects.get(pk=orphan.pk).deleted_at)
+        self.assertIn("Users: 2 checked, 0 drifted", self.reconcile())
+
+    def test_resumes_after_a_user(self):
+        bob, _ = self.login('bob')
+        UserProfile.objects.update(storage_used=5)
+
+        report = self.reconcile(start_after_user=self.user.id, skip_blobs=True)
+
+        self.assertIn("Users: 1 checked, 1 drifted", report)
+        self.assertNotIn("Blobs", report)
+        self.assertEqual(self.storage_used(), 5)
+        self.assertEqual(self.storage_used(bob), 0)
+
+class DriveStatsTests(DriveTestCase):
+    def stats(self):
+        # Like a real request, a fresh user without a cached profile
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        response = self.client.get(reverse('drive_stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_totals_follow_uploads_and_deletes(self):
+        bob, bob_client = self.login('bob')
+        shared = self.store('shared.txt', b'shared', user=bob)
+        self.store('notes.txt', b'notes')
+
+        # The first read builds the summary from the files
+        self.assertEqual(self.stats()['file_count'], 1)
+
+        self.store('copy.txt', b'shared')
+        self.store('image.png', b'png!', content_type='image/png')
+        extra = self.store('extra.txt', b'notes')
+
+        stats = self.stats()
+        self.assertEqual(stats['file_count'], 4)
+        self.assertEqual(stats['logical_bytes'], 5 + 6 + 4 + 5)
+        self.assertEqual(stats['physical_bytes'], 5 + 4)
+        self.assertEqual(stats['saved_bytes'], 11)
+        self.assertEqual(stats['duplicate_count'], 2)
+        self.assertEqual(stats['storage_used'], 9)
+        self.assertEqual(stats['by_type'], [
+            {'content_type': 'text/plain', 'file_count': 3, 'total_bytes': 16},
+            {'content_type': 'image/png', 'file_count': 1, 'total_bytes': 4},
+        ])
+
+        self.client.post(reverse('bulk_delete'), {'ids': [extra.id]}, format='json')
+        bob_client.delete(reverse('delete_file', args=[shared.id]))
+
+        stats = self.stats()
+        self.assertEqual((stats['file_count'], stats['logical_bytes'], stats['physical_bytes']), (3, 15, 15))
+        self.assertEqual(stats['duplicate_count'], 0)
+
+        # Matches a summary built from scratch
+        incremental = {key: value for key, value in stats.items() if key != 'by_type'}
+        summary.rebuild(self.user)
+        rebuilt = self.stats()
+        self.assertEqual(incremental, {key: value for key, value in rebuilt.items() if key != 'by_type'})
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_until_the_next_write(self):
+        cache.clear()
+        self.store('a.txt', b'a')
+        self.stats()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(summary.get_stats(self.user)['file_count'], 1)
+
+        # The cache generation moves on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.store('b.txt', b'b')
+        self.assertEqual(self.stats()['file_count'], 2)
+
+class AsyncViewTests(DriveTestCase):
+    content = b'async content'
+
+    def setUp(self):
+        super().setUp()
+        self.file_ref = self.store('docs/a.txt', self.content)
+        self.factory = AsyncRequestFactory()
+        self.auth = {'authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_listing(self):
+        response = await async_views.get_files(self.factory.get('/api/files/', {'folder': 'docs'}, headers=self.auth))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['filename'] for item in json.loads(response.content)['results']], ['docs/a.txt'])
+
+    async def test_requires_authentication(self):
+        response = await async_views.get_files(self.factory.get('/api/files/'))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_download(self):
+        whole = await async_views.download_file(self.factory.get('/', headers=self.auth), self.file_ref.id)
+        self.assertEqual(await self.read(whole), self.content)
+        self.assertEqual(whole['Content-Length'], str(len(self.content)))
+
+        ranged = self.factory.get('/', headers={**self.auth, 'range': 'bytes=6-'})
+        partial = await async_views.download_file(ranged, self.file_ref.id)
+        self.assertEqual(partial.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(await self.read(partial), b'content')
+
+        missing = await async_views.download_file(self.factory.get('/', headers=self.auth), uuid.uuid4())
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_chunked_upload(self):
+        content = b'sent over asgi'
+        response = await sync_to_async(self.client.post)(reverse('create_upload_session'), {
+            'filename': 'big.bin', 'hash': sha256(content), 'size': len(content),
+        }, format='json')
+        session_id = response.data['id']
+
+        early = await async_views.commit_session(self.factory.post('/', headers=self.auth), session_id)
+        self.assertEqual(early.status_code, status.HTTP_400_BAD_REQUEST)
+
+        chunk = await async_views.upload_chunk(
+            self.factory.put('/', content, content_type='application/octet-stream', headers=self.auth), session_id, 0
+        )
+        self.assertEqual(chunk.status_code, status.HTTP_204_NO_CONTENT)
+
+        committed = await async_views.commit_session(self.factory.post('/', headers=self.auth), session_id)
+
+        self.assertEqual(committed.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(committed.content)['filename'], 'big.bin')
+        blob = await PhysicalBlob.objects.aget(sha256_hash=sha256(content))
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(await sync_to_async(self.storage_used)(), len(self.content) + len(content))
+
+class BenchmarkCommandTests(DriveTestCase):
+    def run_benchmark(self, **options):
+        out = StringIO()
+        call_command('benchmark', stdout=out, stderr=StringIO(), **options)
+        return json.loads(out.getvalue())
+
+    def test_reports_every_endpoint_and_cleans_up(self):
+        results = self.run_benchmark(sizes='5,10', users=1, requests=3, file_size=64, duplicate_ratio=0.5)
+
+        self.assertEqual([round_['files_per_user'] for round_ in results['rounds']], [5, 10])
+        for round_ in results['rounds']:
+            endpoints = {result['endpoint']: result for result in round_['endpoints']}
+            self.assertEqual(set(endpoints), {'upload_file', 'get_files', 'profile', 'delete_file'})
+            self.assertEqual(endpoints['upload_file']['status'], {'201': 3})
+            self.assertEqual(endpoints['delete_file']['status'], {'204': 3})
+            self.assertGreater(endpoints['get_files']['queries']['mean'], 0)
+            self.assertLessEqual(
+                endpoints['get_files']['latency_ms']['p50'], endpoints['get_files']['latency_ms']['p99']
+            )
+
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+        self.assertFalse(FileReference.objects.exists())
+
+    def test_same_seed_same_dataset(self):
+        first = self.run_benchmark(sizes='20', users=1, requests=1, file_size=16, duplicate_ratio=0.5, seed=7)
+        second = self.run_benchmark(sizes='20', users=1, requests=1, file_size=16, duplicate_ratio=0.5, seed=7)
+
+        self.assertEqual(first['rounds'][0]['blobs'], second['rounds'][0]['blobs'])
+        self.assertLess(first['rounds'][0]['blobs'], 21)
+
+    def test_writes_results_to_a_file(self):
+        output = os.path.join(tempfile.mkdtemp(prefix='vinno-bench-'), 'results.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output), ignore_errors=True)
+
+        call_command('benchmark', sizes='2', users=1, requests=1, output=output, stdout=StringIO(), stderr=StringIO())
+
+        with open(output) as f:
+            self.assertEqual(json.load(f)['options']['requests'], 1)
+
+    def test_rejects_bad_options(self):
+        for options in ({'sizes': 'ten'}, {'duplicate_ratio': 2}, {'requests': 0}):
+            with self.assertRaises(CommandError):
+                call_command('benchmark', stdout=StringIO(), stderr=StringIO(), **options)
+
+class AdminTests(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = Client()
+        self.admin.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+
+    def changelist(self, model, **params):
+        response = self.admin.get(reverse(f'admin:drive_{model}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_blob_filters(self):
+        self.store('a.txt', b'text')
+        self.store('b.png', b'image', content_type='image/png')
+        gone = self.store('c.txt', b'gone')
+        self.client.delete(reverse('delete_file', args=[gone.id]))
+
+        tombstoned = self.changelist('physicalblob', refs='tombstoned')
+        images = self.changelist('physicalblob', type='image')
+
+        self.assertEqual([blob.sha256_hash for blob in tombstoned], [sha256(b'gone')])
+        self.assertEqual([blob.sha256_hash for blob in images], [sha256(b'image')])
+        self.assertEqual(len(self.changelist('physicalblob', size_bucket='small')), 3)
+        self.assertEqual(self.changelist('physicalblob', size_bucket='large'), [])
+
+    def test_reference_list_queries_dont_grow_with_the_page(self):
+        def queries(count):
+            for index in range(count):
+                self.store(f'{count}/{index}.txt', f'{count}-{index}'.encode())
+            with CaptureQueriesContext(connection) as captured:
+                self.changelist('filereference')
+            return len(captured)
+
+        self.assertEqual(queries(2), queries(10))
+
+    def test_filtered_counts_are_capped(self):
+        for index in range(5):
+            self.store(f'{index}.txt', str(index).encode())
+
+        with mock.patch('core.paginator.COUNT_LIMIT', 3):
+            response = self.admin.get(
+                reverse('admin:drive_filereference_changelist'), {'is_primary_uploader__exact': '1'}
+            )
+
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_actions_queue_background_jobs(self):
+        kept = self.store('a.txt', b'kept').blob
+        gone = self.store('b.txt', b'gone')
+        PhysicalBlob.objects.filter(pk=kept.pk).update(ref_count=9)
+        self.client.delete(reverse('delete_file', args=[gone.id]))
+
+        for action in ('recompute_ref_counts', 'purge_tombstones'):
+            self.admin.post(reverse('admin:drive_physicalblob_changelist'), {
+                'action': action, '_selected_action': [kept.pk, gone.blob_id],
+            })
+
+        # Nothing happens in the admin request itself
+        self.assertEqual(PhysicalBlob.objects.get(pk=kept.pk).ref_count, 9)
+        self.assertEqual(MaintenanceJob.objects.filter(status=MaintenanceJob.PENDING).count(), 2)
+
+        call_command('run_maintenance_jobs', stdout=StringIO())
+
+        self.assertEqual(PhysicalBlob.objects.get(pk=kept.pk).ref_count, 1)
+        self.assertFalse(PhysicalBlob.objects.filter(pk=gone.blob_id).exists())
+        self.assertEqual(
+            list(MaintenanceJob.objects.order_by('created_at').values_list('status', 'processed', 'changed')),
+            [(MaintenanceJob.DONE, 2, 1), (MaintenanceJob.DONE, 2, 1)]
+        )
+
+    def test_deleting_references_keeps_the_accounting(self):
+        first = self.store('a.txt', b'aaaa')
+        second = self.store('b.txt', b'bb')
+
+        self.admin.post(reverse('admin:drive_filereference_changelist'), {
+            'action': 'delete_selected', '_selected_action': [first.id, second.id], 'post': 'yes',
+        })
+
+        self.assertFalse(FileReference.objects.exists())
+        self.assertEqual(self.storage_used(), 0)
+        self.assertEqual(set(PhysicalBlob.objects.values_list('ref_count', flat=True)), {0})
+
+    def test_ownership_is_read_only(self):
+        bob, _ = self.login('bob')
+        file_ref = self.store('a.txt', b'aaaa')
+        other = self.store('b.txt', b'bb', user=bob)
+
+        response = self.admin.post(reverse('admin:drive_filereference_change', args=[file_ref.id]), {
+            'filename': 'renamed.txt', 'user': bob.id, 'blob': other.blob_id, 'is_primary_uploader': '',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        file_ref.refresh_from_db()
+        self.assertEqual(file_ref.filename, 'renamed.txt')
+        self.assertEqual((file_ref.user, file_ref.blob_id), (self.user, sha256(b'aaaa')))
+        self.assertTrue(file_ref.is_primary_uploader)
+        self.assertEqual(self.storage_used(), 4)
+        self.assertEqual(PhysicalBlob.objects.get(pk=other.blob_id).ref_count, 1)
+        self.assertEqual(self.admin.get(reverse('admin:drive_filereference_add')).status_code, 403)
+
+@override_settings(CHUNK_STORE=True, CHUNK_MIN_SIZE=64, CHUNK_AVG_SIZE=256, CHUNK_MAX_SIZE=1024)
+class ChunkStoreTests(DriveTestCase):
+    original = random.Random(21).randbytes(16 * 1024)
+    edited = original[:8000] + b'one edit' + original[8000:]
+
+    def chunks(self, content):
+        return list(chunkstore.iter_chunks(BytesIO(content)))
+
+    def chunk_all(self):
+        call_command('chunk_blobs', min_size=0, stdout=StringIO())
+
+    def test_chunks_are_content_defined(self):
+        original, edited = self.chunks(self.original), self.chunks(self.edited)
+
+        self.assertEqual(b''.join(original), self.original)
+        self.assertTrue(all(64 <= len(chunk) <= 1024 for chunk in original[:-1]))
+        # An insertion only changes the chunks around it
+        self.assertLessEqual(len(set(edited) - set(original)), 2)
+        self.assertEqual(self.chunks(self.original), original)
+
+    def test_versions_share_their_chunks(self):
+        first = self.store('v1.bin', self.original)
+        self.store('v2.bin', self.edited)
+        flat_path = first.blob.file.path
+
+        self.chunk_all()
+
+        blob = PhysicalBlob.objects.get(pk=first.blob_id)
+        self.assertTrue(blob.chunked)
+        self.assertFalse(os.path.exists(flat_path))
+        distinct = set(self.chunks(self.original)) | set(self.chunks(self.edited))
+        self.assertEqual(Chunk.objects.count(), len(distinct))
+        # Both versions cost one copy plus the chunks around the edit
+        self.assertLess(sum(Chunk.objects.values_list('size', flat=True)), len(self.original) + 2 * 1024)
+
+        response = self.client.get(reverse('download_file', args=[first.id]), headers={'range': 'bytes=1000-2999'})
+        self.assertEqual(b''.join(response.streaming_content), self.original[1000:3000])
+        with open_blob(blob) as f:
+            self.assertEqual(f.read(), self.original)
+
+    def test_upload_sends_only_missing_chunks(self):
+        self.store('v1.bin', self.original)
+        self.chunk_all()
+        chunks = self.chunks(self.edited)
+
+        response = self.client.post(reverse('create_upload_session'), {
+            'filename': 'v2.bin',
+            'hash': sha256(self.edited),
+            'size': len(self.edited),
+            'chunks': [{'hash': sha256(chunk), 'size': len(chunk)} for chunk in chunks],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        missing = response.data['missing_chunks']
+        self.assertTrue(0 < len(missing) <= 2)
+
+        wrong = self.client.put(
+            reverse('upload_chunk', args=[response.data['id'], missing[0]]), b'x' * len(chunks[missing[0]]),
+            content_type='application/octet-stream'
+        )
+        self.assertEqual(wrong.status_code, status.HTTP_400_BAD_REQUEST)
+
+        for index in missing:
+            self.client.put(
+                reverse('upload_chunk', args=[response.data['id'], index]), chunks[index],
+                content_type='application/octet-stream'
+            )
+        committed = self.client.post(reverse('commit_session', args=[response.data['id']]))
+
+        self.assertEqual(committed.status_code, status.HTTP_201_CREATED)
+        blob = PhysicalBlob.objects.get(sha256_hash=sha256(self.edited))
+        self.assertTrue(blob.chunked)
+        with open_blob(blob) as f:
+            self.assertEqual(f.read(), self.edited)
+
+    def test_chunks_are_reclaimed_with_their_last_blob(self):
+        first = self.store('v1.bin', self.original)
+        second = self.store('v2.bin', self.edited)
+        self.chunk_all()
+        shared = Chunk.objects.filter(ref_count=2).count()
+
+        self.client.delete(reverse('delete_file', args=[second.id]))
+        gc.reclaim_tombstones(grace_period=0)
+        gc.reclaim_chunks(grace_period=0)
+
+        self.assertEqual(Chunk.objects.filter(ref_count=1).count(), Chunk.objects.count())
+        self.assertGreaterEqual(Chunk.objects.count(), shared)
+        with open_blob(PhysicalBlob.objects.get(pk=first.blob_id)) as f:
+            self.assertEqual(f.read(), self.original)
+
+    @override_settings(CHUNK_STORE=False)
+    def test_command_needs_the_chunk_store(self):
+        with self.assertRaises(CommandError):
+            self.chunk_all()
+
+class PreviewTests(DriveTestCase):
+    def preview(self, file_ref, kind='text', client=None, **headers):
+        return (client or self.client).get(reverse('preview_file', args=[file_ref.id, kind]), headers=headers)
+
+    def generate(self, **options):
+        # The same work in threads: spawned workers wouldn't see the test settings
+        with mock.patch(
+            'drive.management.commands.generate_previews.ProcessPoolExecutor',
+            lambda **kwargs: ThreadPoolExecutor(max_workers=1)
+        ):
+            out = StringIO()
+            call_command('generate_previews', stdout=out, **options)
+        return out.getvalue()
+
+    def test_text_preview_is_made_in_the_background(self):
+        lines = b''.join(f'line {index}\n'.encode() for index in range(1000))
+        file_ref = self.store('log.txt', lines)
+
+        pending = self.preview(file_ref)
+        self.assertEqual(pending.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(pending['Retry-After'], '2')
+        self.assertEqual(self.preview(file_ref).status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Derivative.objects.get().status, Derivative.PENDING)
+
+        self.assertIn("Made 1 previews, 0 failed", self.generate())
+
+        ready = self.preview(file_ref)
+        self.assertEqual(ready.status_code, status.HTTP_200_OK)
+        excerpt = b''.join(ready.streaming_content)
+        self.assertLessEqual(len(excerpt), previews.TEXT_PREVIEW_SIZE)
+        self.assertTrue(lines.startswith(excerpt))
+        self.assertTrue(excerpt.endswith(b'\n'))
+
+        cached = self.preview(file_ref, if_none_match=ready['ETag'])
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_copies_share_one_preview(self):
+        bob, bob_client = self.login('bob')
+        mine = self.store('a.txt', b'shared text')
+        theirs = self.store('b.txt', b'shared text', user=bob)
+
+        self.preview(mine)
+        self.preview(theirs, client=bob_client)
+        self.generate()
+
+        self.assertEqual(Derivative.objects.count(), 1)
+        self.assertEqual(self.preview(theirs, client=bob_client).status_code, status.HTTP_200_OK)
+
+    def test_backfill_queues_existing_blobs(self):
+        self.store('a.txt', b'text')
+        self.store('b.bin', b'binary', content_type='application/octet-stream')
+
+        self.assertIn("Queued previews of 1 blobs", self.generate(backfill=True))
+        self.assertEqual(Derivative.objects.get().status, Derivative.READY)
+
+    def test_failed_previews(self):
+        file_ref = self.store('a.txt', b'text')
+        self.preview(file_ref)
+        Derivative.objects.update(status=Derivative.FAILED)
+
+        self.assertEqual(self.preview(file_ref).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_errors(self):
+        binary = self.store('a.bin', b'binary', content_type='application/octet-stream')
+        text = self.store('a.txt', b'text')
+
+        self.assertEqual(self.preview(binary).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.preview(text, kind='256').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.preview(text, client=APIClient()).status_code, status.HTTP_401_UNAUTHORIZED)
+        _, other = self.login('bob')
+        self.assertEqual(self.preview(text, client=other).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Derivative.objects.exists())
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ArchiveTests(DriveTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def archive(self, selection):
+        response = self.client.post(reverse('create_archive'), selection, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # The link works without credentials, like a signed download link
+        download = APIClient().get(response.data['download_url'])
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        return download, zipfile.ZipFile(BytesIO(b''.join(download.streaming_content)))
+
+    def test_folder_archive(self):
+        bob, _ = self.login('bob')
+        self.store('docs/notes.txt', b'notes ' * 100)
+        self.store('docs/img/photo.png', b'png', content_type='image/png')
+        self.store('docs/empty/.vinno_keep', b'')
+        self.store('other/skip.txt', b'skip')
+        self.store('docs/theirs.txt', b'theirs', user=bob)
+
+        download, archive = self.archive({'folder': '/docs/'})
+
+        self.assertIn('docs.zip', download['Content-Disposition'])
+        self.assertEqual(archive.namelist(), ['docs/empty/', 'docs/img/photo.png', 'docs/notes.txt'])
+        self.assertEqual(archive.read('docs/notes.txt'), b'notes ' * 100)
+        self.assertEqual(archive.getinfo('docs/img/photo.png').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo('docs/notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertIsNone(archive.testzip())
+
+    def test_selected_files(self):
+        first = self.store('a.txt', b'a')
+        self.store('b.txt', b'b')
+        third = self.store('deep/c.txt', b'c')
+
+        download, archive = self.archive({'ids': [str(first.id), str(third.id)]})
+
+        self.assertIn('files.zip', download['Content-Disposition'])
+        self.assertEqual(archive.namelist(), ['a.txt', 'deep/c.txt'])
+
+    def test_errors(self):
+        bob, _ = self.login('bob')
+        theirs = self.store('theirs.txt', b'theirs', user=bob)
+
+        response = self.client.post(reverse('create_archive'), {'ids': [str(theirs.id)]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(reverse('create_archive'), {'ids': [str(theirs.id)], 'folder': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        unknown = self.client.get(reverse('download_archive', args=[uuid.uuid4()]))
+        self.assertEqual(unknown.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,46 @@
+import os
+import hashlib
+import tempfile
+from core import metrics
+from .storage import blob_storage
+from django.core.files.uploadedfile import UploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+# Uploads are staged next to the blobs so moving them in is a rename, not a copy
+STAGING_DIR = 'blobs/.incoming'
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """
+    Temporary upload that lives inside the blob store instead of FILE_UPLOAD_TEMP_DIR.
+    """
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        directory = blob_storage.path(STAGING_DIR)
+        os.makedirs(directory, exist_ok=True)
+
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + ext, dir=directory)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+        # Filled in by the handler once the last chunk is written
+        self.sha256_hash = None
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Computes the SHA-256 of each uploaded file while it's being written,
+    so the server never has to trust the client's hash or re-read the file.
+    """
+    def new_file(self, *args, **kwargs):
+        super(TemporaryFileUploadHandler, self).new_file(*args, **kwargs)
+        self.file = StagedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        metrics.BLOB_BYTES_WRITTEN.inc(len(raw_data))
+
+    def file_complete(self, file_size):
+        self.file.sha256_hash = self.digest.hexdigest()
+        return super().file_complete(file_size)
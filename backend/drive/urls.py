@@ -1,11 +1,52 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Hot paths get the asyncio versions under ASGI (see core.settings.ASYNC_VIEWS)
+if settings.ASYNC_VIEWS:
+    from . import async_views as hot_views
+else:
+    hot_views = views
+
 urlpatterns = [
     # Endpoint to list all files for the logged-in user
-    path('files/', views.get_files, name='get_files'),
+    path('files/', hot_views.get_files, name='get_files'),
+
+    # Direct children (sub folders and files) of one folder
+    path('folders/', views.list_folder, name='list_folder'),
     
+    # Ranked filename search (?q=, optional ?folder=)
+    path('search/', views.search_files, name='search_files'),
+
+    # Totals for the dashboard, independent of the number of files
+    path('stats/', views.drive_stats, name='drive_stats'),
+
     # Endpoint to upload a new file (with deduplication logic)
     path('upload/', views.upload_file, name='upload_file'),
+
+    # Many files in one multipart request, one transaction
+    path('upload/batch/', views.upload_batch_files, name='upload_batch'),
+
+    # Hash-first handshake: links already stored content, replies with hashes still to send
+    path('upload/preflight/', views.upload_preflight, name='upload_preflight'),
+
+    # Resumable chunked uploads
+    path('upload/sessions/', views.create_upload_session, name='create_upload_session'),
+    path('upload/sessions/<uuid:session_id>/', views.upload_session, name='upload_session'),
+    path('upload/sessions/<uuid:session_id>/chunks/<int:index>/', hot_views.upload_chunk, name='upload_chunk'),
+    path('upload/sessions/<uuid:session_id>/commit/', hot_views.commit_session, name='commit_session'),
+
+    # Authenticated, range-capable download (JWT header or signed ?token=)
+    path('download/<uuid:file_id>/', hot_views.download_file, name='download_file'),
+
+    # Thumbnails and text excerpts, generated in the background (same auth as downloads)
+    path('preview/<uuid:file_id>/<str:kind>/', views.preview_file, name='preview_file'),
+
+    # ZIP of a folder or a selection: POST the selection, follow the returned link
+    path('archive/', views.create_archive, name='create_archive'),
+    path('archive/<uuid:archive_id>/', views.download_archive, name='download_archive'),
+
+    # Must come before delete/<file_id>/, which would swallow "bulk"
+    path('delete/bulk/', views.bulk_delete, name='bulk_delete'),
     path("delete/<str:file_id>/", views.delete_file, name="delete_file"),
 ]
\ No newline at end of file
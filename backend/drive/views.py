@@ -1,62 +1,220 @@
-import os
-from rest_framework.decorators import api_view, parser_classes
+import uuid
+from rest_framework.decorators import api_view, parser_classes, throttle_classes, permission_classes
+from rest_framework.permissions import AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import NotAuthenticated
 from django.db import transaction
-from .models import PhysicalBlob, FileReference
-from .serializers import FileReferenceSerializer, FileUploadSerializer
+from django.conf import settings
+from django.utils import timezone
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from core.cache import user_cache_key
+from core.throttles import ChunkUploadThrottle, DownloadThrottle, PreviewThrottle
+from user import quota
+from user.quota import QuotaExceeded
+from .models import PhysicalBlob, FileReference, UploadSession, Folder, Derivative
+from .serializers import (
+    FileReferenceSerializer, FileUploadSerializer, UploadPreflightSerializer,
+    UploadSessionSerializer, UploadSessionCreateSerializer, FolderSerializer, BulkDeleteSerializer,
+    ArchiveSerializer
+)
 from django.db.models import F
+from .uploadhandlers import HashingFileUploadHandler
+from .pagination import paginate_keyset, paginate_ranked, InvalidCursor
+from . import search
+from .downloads import build_download_response, build_preview_response, check_download_token
+from .previews import preview_kinds
+from .archives import iter_selection, iter_zip
+from . import summary
+from .services import (
+    create_file_reference, link_existing_blobs, UploadError,
+    write_chunk, commit_upload_session, discard_session, upload_batch,
+    delete_references, charge_storage, hold_chunks, queue_previews
+)
 
-def get_unique_filename(user, full_path):
+# Columns the file listing actually serializes
+LISTING_FIELDS = (
+    'id', 'filename', 'upload_timestamp', 'is_primary_uploader',
+    'blob__sha256_hash', 'blob__size', 'blob__content_type', 'blob__ref_count', 'blob__file',
+    'blob__chunked',
+)
+
+# Cached listings embed signed download links, so they live well under DOWNLOAD_URL_MAX_AGE
+LISTING_CACHE_TIMEOUT = 5 * 60
+
+def listing_cache_key(request, name):
+    # The host is part of the key because download links are absolute
+    return user_cache_key(request.user.id, name, request.get_host(), sorted(request.query_params.lists()))
+
+
+def file_listing(request):
     """
-    Ensures the path is unique for the current user.
-    If duplicate add a (counter)
+    The get_files payload, served from the user's versioned cache when nothing changed.
+    Raises InvalidCursor.
     """
-    # Split path and file name
-    directory, filename = os.path.split(full_path)
-    
-    # Split extension and name
-    name, ext = os.path.splitext(filename)
-    
-    counter = 1
-    unique_path = full_path
-    
-    # 3. Check repeatedly if this user already has a file with this exact path
-    while FileReference.objects.filter(user=user, filename=unique_path).exists():
-        # Create new name: image(1).png
-        new_filename = f"{name}({counter}){ext}"
-        
-        # Recombine: folder/subfolder/image(1).png
-        unique_path = os.path.join(directory, new_filename).replace("\\", "/")
-        counter += 1
-        
-    return unique_path
+    key = listing_cache_key(request, "drive:files")
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    # 1. Query the Database, pulling the blob in the same query (no N+1 in the serializer)
+    files = (
+        FileReference.objects
+        .filter(user=request.user)
+        .select_related('blob')
+        .only(*LISTING_FIELDS)
+    )
+
+    folder = request.query_params.get('folder')
+    if folder:
+        files = files.filter(filename__startswith=folder.rstrip('/') + '/')
+
+    content_type = request.query_params.get('content_type')
+    if content_type:
+        if content_type.endswith('/'):
+            files = files.filter(blob__content_type__startswith=content_type)
+        else:
+            files = files.filter(blob__content_type=content_type)
 
+    name = request.query_params.get('name')
+    if name:
+        files = files.filter(filename__icontains=name)
 
+    page, next_cursor = paginate_keyset(files, request)
+
+    # 2. CALL THE SERIALIZER
+    # 'many=True' tells it we are converting a list, not just one item.
+    # 'context' is passed so the serializer can build full URLs (http://localhost...).
+    serializer = FileReferenceSerializer(page, many=True, context={'request': request})
+
+    # 3. Cache the JSON data
+    data = {"results": serializer.data, "next": next_cursor}
+    cache.set(key, data, LISTING_CACHE_TIMEOUT)
+    return data
 
 @api_view(['GET'])
 def get_files(request):
     """
-    Returns a list of all files uploaded by the current user.
+    Returns one page of the current user's files, newest first.
+    Optional filters: folder (path prefix), content_type (exact, or a prefix like image/), name (substring).
+    Pass the returned 'next' value as ?cursor= to get the following page.
     """
-    # 1. Query the Database
-    files = FileReference.objects.filter(user=request.user)
-    
-    # 2. CALL THE SERIALIZER
-    # 'many=True' tells it we are converting a list, not just one item.
-    # 'context' is passed so the serializer can build full URLs (http://localhost...).
-    serializer = FileReferenceSerializer(files, many=True, context={'request': request})
-    
-    # 3. Return the JSON data
-    return Response(serializer.data)
+    try:
+        return Response(file_listing(request))
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+def search_files(request):
+    """
+    Searches the current user's filenames: ?q= (substring or close match), optional ?folder= prefix.
+    Best matches first, paginated with ?cursor= like get_files.
+    """
+    query = request.query_params.get('q', '').strip()
+    if not search.MIN_QUERY_LENGTH <= len(query) <= search.MAX_QUERY_LENGTH:
+        return Response(
+            {"error": f"q must be {search.MIN_QUERY_LENGTH} to {search.MAX_QUERY_LENGTH} characters"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    key = listing_cache_key(request, "drive:search")
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+
+    files = (
+        search.search_files(request.user, query, request.query_params.get('folder', ''))
+        .select_related('blob')
+        .only(*LISTING_FIELDS)
+    )
+    try:
+        page, next_cursor = paginate_ranked(files, request)
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    data = {"results": FileReferenceSerializer(page, many=True, context={'request': request}).data, "next": next_cursor}
+    cache.set(key, data, LISTING_CACHE_TIMEOUT)
+    return Response(data)
+
+@api_view(['GET'])
+def list_folder(request):
+    """
+    Lists the direct children of ?path= (the root when empty).
+    Sub folders come from the folder index and are only sent with the first page,
+    files are keyset-paginated like get_files.
+    """
+    path = request.query_params.get('path', '').strip('/')
+
+    key = listing_cache_key(request, "drive:folder")
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+
+    if path and not Folder.objects.filter(user=request.user, path=path).exists():
+        return Response({"error": "Folder not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    files = (
+        FileReference.objects
+        .filter(user=request.user, parent_path=path)
+        .select_related('blob')
+        .only(*LISTING_FIELDS)
+    )
+
+    try:
+        page, next_cursor = paginate_keyset(files, request)
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    folders = []
+    if not request.query_params.get('cursor'):
+        folders = FolderSerializer(
+            Folder.objects.filter(user=request.user, parent_path=path), many=True
+        ).data
+
+    data = {
+        "path": path,
+        "folders": folders,
+        "files": FileReferenceSerializer(page, many=True, context={'request': request}).data,
+        "next": next_cursor
+    }
+    cache.set(key, data, LISTING_CACHE_TIMEOUT)
+    return Response(data)
+
+def request_body_size(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
 
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def upload_file(request):
     """
     Handles file upload with deduplication logic.
+    Quota is reserved from Content-Length before the body is read. When that doesn't fit,
+    the hash lookup decides: content someone still references is free, anything else is refused.
     """
+    try:
+        reservation = quota.reserve(request.user, request_body_size(request))
+    except QuotaExceeded:
+        reservation = None
+
+    try:
+        return store_upload(request, reservation)
+    except QuotaExceeded as e:
+        return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    finally:
+        # Stored bytes were charged to storage_used when the file was created
+        quota.release(reservation)
+
+def store_upload(request, reservation):
+    # Hash the stream as it's written, has to be set before request.data is touched
+    request._request.upload_handlers = [HashingFileUploadHandler(request._request)]
+
     # Validate the hash/filename before even looking at the file content
     meta_serializer = FileUploadSerializer(data=request.data)
     
@@ -70,33 +228,47 @@ def upload_file(request):
 
     if not uploaded_file:
         return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
-    
-    unqiue_filename = get_unique_filename(request.user, filename)
 
-    with transaction.atomic():
-        # Check if the blob already exists
-        blob, created = PhysicalBlob.objects.get_or_create(
-            sha256_hash=file_hash,
-            defaults={
-                'file': uploaded_file,
-                'size': uploaded_file.size,
-                'content_type': uploaded_file.content_type
-            }
+    # Never let a client-supplied hash into the dedup table
+    if uploaded_file.sha256_hash != file_hash:
+        uploaded_file.close()
+        return Response(
+            {"error": "Uploaded content does not match the declared hash"},
+            status=status.HTTP_400_BAD_REQUEST
         )
 
-        # Store reference count
-        blob.ref_count = F('ref_count') + 1
-        blob.save()
+    late_reservation = None
+    try:
+        with transaction.atomic():
+            blobs = PhysicalBlob.objects.select_for_update()
+            if reservation is None and not blobs.filter(sha256_hash=file_hash, ref_count__gt=0).exists():
+                # Nothing was reserved up front (over quota, or no Content-Length), new content has to fit now
+                late_reservation = quota.reserve(request.user, uploaded_file.size)
 
-        blob.refresh_from_db()
+            # Check if the blob already exists, locked so the GC can't reclaim a tombstone we're reviving
+            blob, created = blobs.get_or_create(
+                sha256_hash=file_hash,
+                defaults={
+                    'file': uploaded_file,
+                    'size': uploaded_file.size,
+                    'content_type': uploaded_file.content_type
+                }
+            )
 
-        # Create the user's reference to this blob
-        file_ref = FileReference.objects.create(
-            user=request.user,
-            blob=blob,
-            filename = unqiue_filename,
-            is_primary_uploader = created
-        )
+            # Reviving a tombstone brings the content back just like storing it, so it's charged the same
+            is_primary = created or not blob.is_live
+
+            # Store reference count, re-uploaded content comes back from the tombstone without any I/O
+            blob.ref_count = F('ref_count') + 1
+            blob.deleted_at = None
+            blob.save()
+
+            blob.refresh_from_db()
+
+            # Create the user's reference to this blob, under a name that's free
+            file_ref = create_file_reference(request.user, blob, filename, is_primary)
+    finally:
+        quota.release(late_reservation)
 
     # 3. CALL SERIALIZER FOR RESPONSE
     # Return the newly created file data to the frontend
@@ -105,12 +277,296 @@ def upload_file(request):
     return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
 
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+def upload_batch_files(request):
+    """
+    Uploads many files in one multipart request.
+    Send repeated file / filename / hash / size fields, matched by position.
+    Each file gets its own result, bad entries don't fail the rest of the batch.
+    Quota works like single uploads: when the request doesn't fit as a whole,
+    files whose content is already stored still go through.
+    """
+    try:
+        reservation = quota.reserve(request.user, request_body_size(request))
+    except QuotaExceeded:
+        reservation = None
+
+    try:
+        return store_batch(request, reservation)
+    finally:
+        quota.release(reservation)
+
+def new_content_size(entries):
+    """
+    Bytes of content in entries nobody references yet (tombstones included), counted once per hash.
+    """
+    sizes = {entry['hash']: entry['file'].size for entry in entries}
+    stored = PhysicalBlob.objects.filter(sha256_hash__in=sizes, ref_count__gt=0).values_list('sha256_hash', flat=True)
+    for file_hash in stored:
+        sizes.pop(file_hash)
+    return sum(sizes.values())
+
+def store_batch(request, reservation):
+    request._request.upload_handlers = [HashingFileUploadHandler(request._request)]
+
+    uploaded_files = request.FILES.getlist('file')
+    filenames = request.data.getlist('filename')
+    hashes = request.data.getlist('hash')
+    sizes = request.data.getlist('size')
+
+    if not uploaded_files:
+        return Response({"error": "No file provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not len(uploaded_files) == len(filenames) == len(hashes) == len(sizes):
+        return Response(
+            {"error": "file, filename, hash and size must be sent once per file"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = [None] * len(uploaded_files)
+    accepted = []
+    for index, uploaded_file in enumerate(uploaded_files):
+        meta_serializer = FileUploadSerializer(data={
+            'filename': filenames[index],
+            'hash': hashes[index],
+            'size': sizes[index]
+        })
+
+        if not meta_serializer.is_valid():
+            results[index] = {"filename": filenames[index], "errors": meta_serializer.errors}
+            continue
+
+        # Same server-side check as a single upload
+        if uploaded_file.sha256_hash != meta_serializer.validated_data['hash']:
+            results[index] = {
+                "filename": filenames[index],
+                "error": "Uploaded content does not match the declared hash"
+            }
+            continue
+
+        accepted.append((index, {**meta_serializer.validated_data, 'file': uploaded_file}))
+
+    late_reservation = None
+    if accepted and reservation is None:
+        # Nothing was reserved up front (over quota, or no Content-Length), new content has to fit now
+        try:
+            late_reservation = quota.reserve(request.user, new_content_size([entry for _, entry in accepted]))
+        except QuotaExceeded as e:
+            duplicates = []
+            for index, entry in accepted:
+                if new_content_size([entry]):
+                    results[index] = {"filename": filenames[index], "error": str(e)}
+                else:
+                    duplicates.append((index, entry))
+            accepted = duplicates
+
+    try:
+        if accepted:
+            refs = upload_batch(request.user, [entry for _, entry in accepted])
+            data = FileReferenceSerializer(refs, many=True, context={'request': request}).data
+            for (index, _), file_data in zip(accepted, data):
+                results[index] = {"filename": filenames[index], "file": file_data}
+    finally:
+        quota.release(late_reservation)
+
+    return Response({"results": results}, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+def upload_preflight(request):
+    """
+    Hash-first dedup handshake.
+    Files whose content the user already has are linked right away,
+    only the hashes that still need their bytes are returned.
+    """
+    serializer = UploadPreflightSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    created, missing = link_existing_blobs(request.user, serializer.validated_data['files'])
+
+    response_serializer = FileReferenceSerializer(created, many=True, context={'request': request})
+
+    return Response(
+        {"linked": response_serializer.data, "missing": missing},
+        status=status.HTTP_200_OK
+    )
+
+
+@api_view(['POST'])
+def create_upload_session(request):
+    """
+    Opens a resumable upload keyed by the expected SHA-256.
+    The client then sends fixed-size chunks in any order and commits.
+    With the chunk store on, the client can send its content-defined chunks instead ("chunks": [{hash, size}]),
+    only the ones the server doesn't have are reported missing.
+    """
+    meta_serializer = UploadSessionCreateSerializer(data=request.data)
+
+    if not meta_serializer.is_valid():
+        return Response(meta_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = meta_serializer.validated_data
+
+    # Content someone still references is free, everything else (tombstones too) is reserved up front
+    reservation = None
+    if not PhysicalBlob.objects.filter(sha256_hash=data['hash'], ref_count__gt=0).exists():
+        try:
+            reservation = quota.reserve(request.user, data['size'])
+        except QuotaExceeded as e:
+            return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    manifest = None
+    if data.get('chunks') is not None:
+        manifest = [[chunk['hash'], chunk['size']] for chunk in data['chunks']]
+        hold_chunks({chunk_hash for chunk_hash, _ in manifest})
+
+    session = UploadSession.objects.create(
+        reservation=reservation,
+        user=request.user,
+        sha256_hash=data['hash'],
+        filename=data['filename'],
+        size=data['size'],
+        content_type=data['content_type'],
+        chunk_size=settings.UPLOAD_CHUNK_SIZE,
+        chunk_manifest=manifest
+    )
+
+    return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+def get_session_or_none(request, session_id):
+    # Sessions are private to the user who opened them
+    return UploadSession.objects.filter(id=session_id, user=request.user).first()
+
+@api_view(['GET', 'DELETE'])
+def upload_session(request, session_id):
+    """
+    GET reports which chunks are still missing, DELETE aborts the upload.
+    """
+    session = get_session_or_none(request, session_id)
+    if session is None:
+        return Response({"error": "Upload session not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'DELETE':
+        discard_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    return Response(UploadSessionSerializer(session).data)
+
+@api_view(['PUT'])
+@throttle_classes([ChunkUploadThrottle])
+def upload_chunk(request, session_id, index):
+    """
+    Receives one chunk as the raw request body.
+    Chunks can arrive out of order and in parallel, re-sending one just overwrites it.
+    """
+    session = get_session_or_none(request, session_id)
+    if session is None:
+        return Response({"error": "Upload session not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        write_chunk(session, index, request.stream)
+    except UploadError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['POST'])
+def commit_session(request, session_id):
+    """
+    Puts the chunks together into the blob store and adds the file to the user's drive.
+    """
+    session = get_session_or_none(request, session_id)
+    if session is None:
+        return Response({"error": "Upload session not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        file_ref = commit_upload_session(session)
+    except UploadError as e:
+        return Response(
+            {"error": str(e), "session": UploadSessionSerializer(session).data},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    response_serializer = FileReferenceSerializer(file_ref, context={'request': request})
+
+    return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
+
+def downloadable_reference(request, file_id):
+    """
+    The FileReference this request may download: the owner's (JWT) or any (signed token).
+    None when there is no such file, raises NotAuthenticated without credentials.
+    """
+    files = FileReference.objects.select_related('blob')
+
+    if request.user.is_authenticated:
+        file_ref = files.filter(id=file_id, user=request.user).first()
+    elif check_download_token(request.query_params.get('token', ''), file_id):
+        file_ref = files.filter(id=file_id).first()
+    else:
+        raise NotAuthenticated()
+
+    # Loaded here, the async download streams from the I/O pool where the ORM can't be used
+    if file_ref is not None and file_ref.blob.chunked:
+        file_ref.blob.manifest
+    return file_ref
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([AllowAny])
+@throttle_classes([DownloadThrottle])
+def download_file(request, file_id):
+    """
+    Streams a file by FileReference id.
+    Accepts either the usual JWT header (owner only) or the signed token from download_url.
+    Supports Range / If-Range, and If-None-Match against the SHA-256 ETag.
+    """
+    try:
+        file_ref = downloadable_reference(request, file_id)
+    except NotAuthenticated:
+        return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if file_ref is None:
+        return Response({"error": "File not found or unauthorized"}, status=status.HTTP_404_NOT_FOUND)
+
+    # Plain Django response: DRF content negotiation has nothing to do here
+    return build_download_response(request, file_ref)
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([AllowAny])
+@throttle_classes([PreviewThrottle])
+def preview_file(request, file_id, kind):
+    """
+    A thumbnail ('256', '1024': longest side in pixels) or text excerpt ('text') of a file, same auth as downloads.
+    Previews are made in the background (generate_previews command): the first request queues them
+    and gets 202 with Retry-After until they're ready.
+    """
+    try:
+        file_ref = downloadable_reference(request, file_id)
+    except NotAuthenticated:
+        return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if file_ref is None:
+        return Response({"error": "File not found or unauthorized"}, status=status.HTTP_404_NOT_FOUND)
+    if kind not in preview_kinds(file_ref.blob.content_type):
+        return Response({"error": "No such preview for this file"}, status=status.HTTP_404_NOT_FOUND)
+
+    derivative = Derivative.objects.filter(blob=file_ref.blob, kind=kind).first()
+    if derivative is None:
+        queue_previews(file_ref.blob)
+    elif derivative.status == Derivative.READY:
+        return build_preview_response(request, derivative)
+    elif derivative.status == Derivative.FAILED:
+        return Response({"error": "No preview could be made for this file"}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({"status": Derivative.PENDING}, status=status.HTTP_202_ACCEPTED, headers={'Retry-After': '2'})
+
 @api_view(['DELETE'])
 def delete_file(request, file_id):
     """
     Handles file deletion with reference counting logic.
     """
-    print(file_id)
     try:
         # Ensure only the owner can delete their reference
         file_ref = FileReference.objects.get(id=file_id, user=request.user)
@@ -137,19 +593,109 @@ def delete_file(request, file_id):
         if blob.ref_count == 1:
             # Find last surviving reference
             last_survivor = FileReference.objects.filter(blob=blob).first()
-            if last_survivor:
-                # Promote them to Primary
+            if last_survivor and not last_survivor.is_primary_uploader:
+                # Promote them to Primary, the physical bytes are now theirs
                 last_survivor.is_primary_uploader = True
                 last_survivor.save()
+                charge_storage({last_survivor.user_id: blob.size})
+                summary.record_promotions({last_survivor.user_id: (1, blob.size)})
 
-        # If no one else is pointing to this blob, delete it and the physical file
+        # If no one else is pointing to this blob, leave a tombstone for the GC
+        # (the file is only removed after the grace period, outside this request)
         if blob.ref_count <= 0:
-            blob.file.delete(save=False)
-            
-            # Delete the blob record entirely
-            blob.delete()
+            PhysicalBlob.objects.filter(pk=blob.pk, ref_count=0).update(deleted_at=timezone.now())
 
     return Response(
         {"message": "File removed successfully"}, 
         status=status.HTTP_204_NO_CONTENT
-    )
\ No newline at end of file
+    )
+
+
+@api_view(['POST'])
+def bulk_delete(request):
+    """
+    Deletes many files at once, by list of ids or by folder prefix.
+    """
+    serializer = BulkDeleteSerializer(data=request.data)
+
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    if 'ids' in serializer.validated_data:
+        refs = FileReference.objects.filter(id__in=serializer.validated_data['ids'])
+    else:
+        folder = serializer.validated_data['folder'].strip('/')
+        refs = FileReference.objects.filter(filename__startswith=folder + '/')
+
+    # delete_references scopes the queryset to the current user
+    deleted = delete_references(request.user, refs)
+
+    return Response({"deleted": deleted}, status=status.HTTP_200_OK)
+
+
+# Archive links only have to last until the browser follows them
+ARCHIVE_LINK_TIMEOUT = 15 * 60
+
+def archive_cache_key(archive_id):
+    return f"drive:archive:{archive_id}"
+
+@api_view(['POST'])
+def create_archive(request):
+    """
+    Prepares a ZIP download of a folder or a list of file ids.
+    Returns a download_url the browser can follow directly, the archive is built while it downloads.
+    The selection is kept in the shared cache, an id list can be far too long for a URL.
+    """
+    serializer = ArchiveSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    folder = serializer.validated_data.get('folder')
+    ids = serializer.validated_data.get('ids')
+    files = FileReference.objects.filter(user=request.user)
+    if folder is not None:
+        folder = folder.strip('/')
+        files = files.filter(filename__startswith=folder + '/')
+    else:
+        files = files.filter(id__in=ids)
+    if not files.exists():
+        return Response({"error": "No files selected"}, status=status.HTTP_404_NOT_FOUND)
+
+    archive_id = uuid.uuid4()
+    cache.set(
+        archive_cache_key(archive_id),
+        {'user_id': request.user.id, 'folder': folder, 'ids': [str(ref_id) for ref_id in ids or []]},
+        ARCHIVE_LINK_TIMEOUT
+    )
+    url = request.build_absolute_uri(reverse('download_archive', args=[archive_id]))
+    return Response({"download_url": url}, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([DownloadThrottle])
+def download_archive(request, archive_id):
+    """
+    Streams the ZIP prepared by create_archive. The unguessable link is the credential, like a signed download link.
+    No Content-Length: entries are compressed on the fly.
+    """
+    selection = cache.get(archive_cache_key(archive_id))
+    if selection is None:
+        return Response({"error": "Archive link expired or unknown"}, status=status.HTTP_404_NOT_FOUND)
+
+    folder = selection['folder']
+    files = iter_selection(selection['user_id'], folder=folder, ids=selection['ids'] or None)
+    name = f"{folder.rsplit('/', 1)[-1]}.zip" if folder else "files.zip"
+
+    # Plain Django response, like downloads
+    response = StreamingHttpResponse(iter_zip(files), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, name)
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+@api_view(['GET'])
+def drive_stats(request):
+    """
+    Dashboard totals: file count, logical vs physical bytes, dedup savings and a per content_type breakdown.
+    Served from the incrementally maintained summary, never from the file list.
+    """
+    return Response(summary.get_stats(request.user))
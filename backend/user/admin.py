@@ -1,14 +1,26 @@
 from django.contrib import admin
+from core.paginator import EstimatedCountPaginator
 from .models import UserProfile
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'storage_limit_mb', 'storage_used_mb')
-    search_fields = ('user__username', 'user__email')
+    list_display = ('user', 'storage_limit_mb', 'storage_used_mb', 'storage_reserved_mb')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    # Prefix / exact matches can use the username and email indexes, a contains search can't
+    search_fields = ('^user__username', '=user__email')
+    ordering = ('-storage_used',)
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
 
     # Helper to show readable MBs in the list
     def storage_limit_mb(self, obj):
         return f"{obj.storage_limit / (1024*1024):.2f} MB"
     
     def storage_used_mb(self, obj):
-        return f"{obj.storage_used / (1024*1024):.2f} MB"
\ No newline at end of file
+        return f"{obj.storage_used / (1024*1024):.2f} MB"
+
+    def storage_reserved_mb(self, obj):
+        return f"{obj.storage_reserved / (1024*1024):.2f} MB"
\ No newline at end of file
@@ -0,0 +1,33 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .blacklist import revoked_sessions
+from .models import TokenUser
+
+# Claim carrying the jti of the refresh token an access token was minted from
+SESSION_CLAIM = 'sid'
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication without a user query per request.
+    The user is a TokenUser built from the token claims, it can be used in queries like any User.
+    Logged out sessions are rejected through the in-memory blacklist filter.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        session = validated_token.get(SESSION_CLAIM)
+        if session and revoked_sessions.is_revoked(session):
+            raise AuthenticationFailed(_("Token is blacklisted"), code="token_blacklisted")
+
+        field_names, values = ['id'], [TokenUser._meta.pk.to_python(user_id)]
+        if 'username' in validated_token:
+            field_names.append('username')
+            values.append(validated_token['username'])
+
+        return TokenUser.from_db('default', field_names, values)
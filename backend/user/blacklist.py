@@ -0,0 +1,79 @@
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+# Filter sized for this many revoked sessions at ~1% false positives (about 120KB per worker)
+BLOOM_CAPACITY = 100_000
+BLOOM_BITS = BLOOM_CAPACITY * 10
+BLOOM_HASHES = 7
+
+class BloomFilter:
+    """
+    Fixed size set membership: no false negatives, rare false positives.
+    """
+
+    def __init__(self, bits=BLOOM_BITS, hashes=BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.sha256(item.encode()).digest()
+        # Double hashing: k positions out of two 64 bit halves of one digest
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class RevokedSessions:
+    """
+    Per-process view of the token blacklist.
+    Rebuilt from the blacklist table every TOKEN_BLACKLIST_REFRESH seconds, so a logout in another
+    worker takes effect within that delay. Only filter hits are confirmed against the database.
+    """
+
+    def __init__(self):
+        self._filter = BloomFilter()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < settings.TOKEN_BLACKLIST_REFRESH:
+            return
+
+        with self._lock:
+            if self._loaded_at is not None and now - self._loaded_at < settings.TOKEN_BLACKLIST_REFRESH:
+                return
+            # Expired refresh tokens can't mint access tokens anymore, they don't need to be tracked
+            bloom = BloomFilter()
+            jtis = (
+                BlacklistedToken.objects
+                .filter(token__expires_at__gt=timezone.now())
+                .values_list('token__jti', flat=True)
+            )
+            for jti in jtis.iterator():
+                bloom.add(jti)
+            self._filter = bloom
+            self._loaded_at = now
+
+    def add(self, jti):
+        # Takes effect immediately in this worker, the others pick it up on their next refresh
+        self._filter.add(jti)
+
+    def is_revoked(self, jti):
+        self._refresh()
+        if jti not in self._filter:
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+revoked_sessions = RevokedSessions()
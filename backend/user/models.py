@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from core.cache import TTLCache
 
 # Default Quota: 10MB
 DEFAULT_QUOTA = 10 * 1024 * 1024 
@@ -13,5 +15,54 @@ class UserProfile(models.Model):
     storage_limit = models.BigIntegerField(default=DEFAULT_QUOTA, help_text="Storage limit in bytes")
     storage_used = models.BigIntegerField(default=0, help_text="Current usage in bytes")
 
+    # Bytes promised to uploads still in flight, see user.quota
+    storage_reserved = models.BigIntegerField(default=0, help_text="Bytes reserved by in-progress uploads")
+
+    class Meta:
+        indexes = [
+            # Admin change list, biggest users first (the admin adds pk to make the order total)
+            models.Index(fields=['storage_used', 'id'], name='profile_storage_used_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.storage_limit} bytes"
+
+# Full user rows loaded for token users, per worker
+full_users = TTLCache(settings.AUTH_USER_CACHE_TTL, max_entries=4096)
+
+def get_full_user(user_id):
+    user = full_users.get(user_id)
+    if user is None:
+        user = User.objects.get(pk=user_id)
+        full_users.set(user_id, user)
+    return user
+
+class TokenUser(User):
+    """
+    The request user built from access token claims, without a query (see user.authentication).
+    Only id and username are loaded. Touching any other field fills all of them at once
+    from the full row, which is cached for AUTH_USER_CACHE_TTL seconds.
+    """
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if fields is None or not deferred or not set(fields) <= deferred:
+            return super().refresh_from_db(using, fields, from_queryset)
+
+        full = get_full_user(self.pk)
+        for field in deferred:
+            setattr(self, field, getattr(full, field))
+
+class QuotaReservation(models.Model):
+    """
+    Ledger entry for bytes reserved by one in-progress upload.
+    Released when the upload finishes or fails, stale ones are expired by the GC.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quota_reservations')
+    size = models.BigIntegerField(help_text="Reserved bytes")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.size} bytes reserved"
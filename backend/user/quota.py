@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import UserProfile, QuotaReservation
+
+class QuotaExceeded(Exception):
+    pass
+
+def reserve(user, size):
+    """
+    Atomically reserves size bytes of the user's quota.
+    A single conditional UPDATE, so parallel uploads can never overshoot storage_limit together.
+    Returns the ledger entry, or None when there is nothing to reserve.
+    """
+    if size <= 0:
+        return None
+
+    with transaction.atomic():
+        updated = UserProfile.objects.filter(
+            user=user,
+            storage_limit__gte=F('storage_used') + F('storage_reserved') + size
+        ).update(storage_reserved=F('storage_reserved') + size)
+
+        if not updated:
+            raise QuotaExceeded("Storage quota exceeded")
+
+        return QuotaReservation.objects.create(user=user, size=size)
+
+def release(reservation):
+    """
+    Gives reserved bytes back. Safe to call twice, only the first call has an effect.
+    The bytes actually stored are charged to storage_used separately (drive.signals).
+    """
+    if reservation is None:
+        return
+
+    with transaction.atomic():
+        deleted, _ = QuotaReservation.objects.filter(pk=reservation.pk).delete()
+        if deleted:
+            UserProfile.objects.filter(user_id=reservation.user_id).update(
+                storage_reserved=F('storage_reserved') - reservation.size
+            )
+
+def expire_reservations(max_age, dry_run=False):
+    """
+    Releases reservations left behind by crashed requests.
+    Reservations held by a resumable upload session live as long as the session.
+    """
+    stale = QuotaReservation.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=max_age),
+        upload_session__isnull=True
+    )
+    count = 0
+    for reservation in stale.iterator():
+        count += 1
+        if not dry_run:
+            release(reservation)
+    return count
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,3 +23,15 @@ class UserProfileSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'date_joined', 'storage_used', 'storage_quota']
         read_only_fields = ['id', 'date_joined']
+
+class SessionTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Adds the claims user.authentication needs to skip the database: the username,
+    and the refresh token's jti as session id so logout also revokes its access tokens.
+    """
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['sid'] = token[api_settings.JTI_CLAIM]
+        return token
@@ -1,3 +1,107 @@
-from django.test import TestCase
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APIRequestFactory
+from core.cache import TTLCache
+from .authentication import StatelessJWTAuthentication
+from .blacklist import BloomFilter, RevokedSessions
+from .models import UserProfile, TokenUser
 
-# Create your tests here.
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class UserProfileAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(self.admin)
+
+    def test_changelist_lists_biggest_users_first(self):
+        for index, used in enumerate([10, 300, 20]):
+            user = User.objects.create_user(f'user{index}', password='secret')
+            UserProfile.objects.filter(user=user).update(storage_used=used)
+
+        response = self.client.get(reverse('admin:user_userprofile_changelist'))
+
+        self.assertEqual(response.status_code, 200)
+        profiles = list(response.context['cl'].result_list)
+        self.assertEqual([profile.storage_used for profile in profiles], [300, 20, 10, 0])
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class StatelessAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        self.client = APIClient()
+        # Full rows cached by earlier tests belong to users that no longer exist
+        patcher = mock.patch('user.models.full_users', TTLCache(60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def obtain(self):
+        response = self.client.post(reverse('get_token'), {'username': 'alice', 'password': 'secret'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['access'], response.data['refresh']
+
+    def authenticate(self, access):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        return StatelessJWTAuthentication().authenticate(request)
+
+    def test_user_comes_from_the_token(self):
+        access, _ = self.obtain()
+        self.authenticate(access)
+
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(access)
+            self.assertIsInstance(user, TokenUser)
+            self.assertEqual((user.pk, user.username), (self.user.pk, 'alice'))
+
+        # Other fields come from the full row, loaded once per worker
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'alice@example.com')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(access)[0].email, 'alice@example.com')
+
+    def test_views_work_with_token_users(self):
+        access, _ = self.obtain()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        response = self.client.get(reverse('profile'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'alice@example.com')
+        self.assertEqual(self.client.get(reverse('get_files')).status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_the_session(self):
+        access, refresh = self.obtain()
+        other_access, _ = self.obtain()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+        response = self.client.post(reverse('logout'), {'refresh': refresh}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, status.HTTP_401_UNAUTHORIZED)
+        refreshed = APIClient().post(reverse('refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(refreshed.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # Other sessions of the same user keep working
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other_access}')
+        self.assertEqual(self.client.get(reverse('profile')).status_code, status.HTTP_200_OK)
+
+    def test_other_workers_load_revocations_from_the_blacklist(self):
+        access, refresh = self.obtain()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.client.post(reverse('logout'), {'refresh': refresh}, format='json')
+
+        worker = RevokedSessions()
+        token = StatelessJWTAuthentication().get_validated_token(access)
+
+        self.assertTrue(worker.is_revoked(token['sid']))
+        self.assertFalse(worker.is_revoked('never-issued'))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(bits=1024, hashes=3)
+        items = [f'jti-{index}' for index in range(50)]
+        for item in items:
+            bloom.add(item)
+
+        self.assertTrue(all(item in bloom for item in items))
+        self.assertNotIn('jti-x', BloomFilter())
@@ -6,10 +6,17 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework.generics import RetrieveAPIView
 from .serializers import UserProfileSerializer
+from .blacklist import revoked_sessions
+from django.core.cache import cache
+from core.cache import user_cache_key
 from core.throttles import TwoSecondThrottle
 
+# Profiles are also bumped on every drive write, the timeout covers quota changes made in the admin
+PROFILE_CACHE_TIMEOUT = 5 * 60
+
 class CreateUserView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer;
@@ -29,6 +36,9 @@ class LogoutView(APIView):
             # 3. Blacklist it (it can no longer be used to get access tokens)
             token.blacklist()
 
+            # 4. Access tokens of this session stop working right away in this worker
+            revoked_sessions.add(token.get('sid', token[api_settings.JTI_CLAIM]))
+
             return Response({"message": "Logout successful"}, status=status.HTTP_205_RESET_CONTENT)
         except Exception as e:
             return Response({"error": "Invalid token"}, status=status.HTTP_400_BAD_REQUEST)
@@ -43,4 +53,12 @@ class UserProfileView(RetrieveAPIView):
 
     def get_object(self):
         # Return the user associated with the token in the request
-        return self.request.user
\ No newline at end of file
+        return self.request.user
+
+    def retrieve(self, request, *args, **kwargs):
+        key = user_cache_key(request.user.id, "user:profile")
+        data = cache.get(key)
+        if data is None:
+            data = self.get_serializer(self.get_object()).data
+            cache.set(key, data, PROFILE_CACHE_TIMEOUT)
+        return Response(data)
\ No newline at end of file
@@ -4,14 +4,36 @@ import { calculateHash } from "../utils/hashUtils";
 
 export async function fetchFiles(): Promise<FileItem[]> {
   try {
-    const response = await api.get("/drive/files/");
-    return response.data;
+    // Follow the cursor until every page is loaded
+    const files: FileItem[] = [];
+    let cursor: string | null = null;
+    do {
+      const response = await api.get("/drive/files/", {
+        params: { page_size: 500, ...(cursor ? { cursor } : {}) },
+      });
+      files.push(...response.data.results);
+      cursor = response.data.next;
+    } while (cursor);
+    return files;
   } catch (error) {
     console.error("Drive Fetch Error:", error);
     return [];
   }
 }
 
+export async function searchFiles(query: string): Promise<FileItem[]> {
+  try {
+    // Ranked on the server, the first page holds the best matches
+    const response = await api.get("/drive/search/", {
+      params: { q: query, page_size: 100 },
+    });
+    return response.data.results;
+  } catch (error) {
+    console.error("Search Error:", error);
+    return [];
+  }
+}
+
 export async function deleteFile(id: string) {
   try {
     await api.delete("/drive/delete/" + id + "/");
@@ -21,32 +43,30 @@ export async function deleteFile(id: string) {
 }
 
 export async function downloadFile(file: FileItem) {
-  try {
-    const response = await fetch(file.download_url);
-    const blob = await response.blob();
-
-    // 2. Create a temporary URL for that blob
-    const url = window.URL.createObjectURL(blob);
+  // download_url is signed and streamed by the server, so the browser
+  // downloads it directly instead of buffering the whole file in memory
+  const link = document.createElement("a");
+  link.href = file.download_url;
+  link.download = file.filename;
 
-    // 3. Create a hidden link element
-    const link = document.createElement("a");
-    link.href = url;
-
-    // 4. FORCE the filename to be what you have in your database
-    link.download = file.filename;
+  document.body.appendChild(link);
+  link.click();
+  document.body.removeChild(link);
+}
 
-    // 5. Append to body, click, and remove
-    document.body.appendChild(link);
-    link.click();
-    document.body.removeChild(link);
+export async function downloadArchive(selection: {
+  folder?: string;
+  ids?: string[];
+}) {
+  // The selection goes in the body, the server answers with a short-lived
+  // link the browser then downloads while the ZIP is built
+  const response = await api.post("/drive/archive/", selection);
+  const link = document.createElement("a");
+  link.href = response.data.download_url;
 
-    // 6. Clean up memory
-    window.URL.revokeObjectURL(url);
-  } catch (error) {
-    console.error("Download failed:", error);
-    // Fallback: Just open the URL if the fancy download fails
-    window.open(file.download_url, "_blank");
-  }
+  document.body.appendChild(link);
+  link.click();
+  document.body.removeChild(link);
 }
 
 export async function uploadFiles(
@@ -58,24 +78,56 @@ export async function uploadFiles(
     alert("You cannot upload more than 10 files!");
     return;
   }
-  // Multiple file upload
+  // Hash everything first so already stored content never gets sent
+  const entries = [];
   for (const file of Array.from(fileList)) {
-    try {
-      const hash = await calculateHash(file);
-      const fullPath = currentPath + file.name;
+    const hash = await calculateHash(file);
+    entries.push({ file, hash, filename: currentPath + file.name });
+  }
 
-      const formData = new FormData();
-      formData.append("file", file);
-      formData.append("filename", fullPath);
-      formData.append("hash", hash);
-      formData.append("size", file.size.toString());
+  let missing = new Set(entries.map((entry) => entry.hash));
+  try {
+    const response = await api.post("/drive/upload/preflight/", {
+      files: entries.map((entry) => ({
+        filename: entry.filename,
+        hash: entry.hash,
+        size: entry.file.size,
+      })),
+    });
+    missing = new Set(response.data.missing);
+  } catch (error) {
+    // Fall back to uploading everything
+    console.error("Preflight failed:", error);
+  }
 
-      await api.post("/drive/upload/", formData, {
-        headers: { "Content-Type": "multipart/form-data" },
-      });
-      console.debug("Uploaded file: " + file.name);
-    } catch (error) {
-      console.error(`Failed to upload ${file.name}:`, error);
+  // Everything that still needs its bytes goes up in one batch request
+  const formData = new FormData();
+  let pending = 0;
+  for (const { file, hash, filename } of entries) {
+    if (!missing.has(hash)) {
+      console.debug("Linked existing file: " + file.name);
+      continue;
     }
+    formData.append("file", file);
+    formData.append("filename", filename);
+    formData.append("hash", hash);
+    formData.append("size", file.size.toString());
+    pending++;
+  }
+  if (pending === 0) return;
+
+  try {
+    const response = await api.post("/drive/upload/batch/", formData, {
+      headers: { "Content-Type": "multipart/form-data" },
+    });
+    for (const result of response.data.results) {
+      if (result.file) {
+        console.debug("Uploaded file: " + result.filename);
+      } else {
+        console.error(`Failed to upload ${result.filename}:`, result);
+      }
+    }
+  } catch (error) {
+    console.error("Batch upload failed:", error);
   }
 }
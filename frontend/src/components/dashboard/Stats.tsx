@@ -32,8 +32,7 @@ export const Stats = ({ files, session }: Props) => {
             Storage Used
           </p>
           <p className=" text-xs text-gray-700 dark:text-gray-300 font-light ">
-            (Calculated on the basis of size of files upload regardless of
-            deduplication)
+            (Only content you stored counts, deduplicated files are free)
           </p>
           <p className="text-xl font-black text-gray-900 dark:text-white">
             {formatSize(usedSpace)} / {formatSize(MAX_QUOTA)}
@@ -1,9 +1,11 @@
 import React from "react";
 import api from "../../api/api";
 import { calculateHash } from "../../utils/hashUtils";
+import { downloadArchive } from "../../api/files";
 import {
   ArrowLeft,
   ChevronRight,
+  Download,
   FolderPlus,
   Home,
   LayoutGrid,
@@ -169,6 +171,18 @@ const Toolbar = ({
             </button>
           </div>
 
+          {/* Download Folder Button */}
+          {currentPath !== "" && !isSearching && (
+            <button
+              onClick={() => downloadArchive({ folder: currentPath })}
+              className="flex items-center gap-2 px-3 py-1.5 bg-gray-100 hover:bg-gray-200 dark:bg-zinc-800 dark:hover:bg-zinc-700 text-gray-700 dark:text-zinc-300 text-sm font-bold rounded-xl transition-colors active:scale-95"
+              title="Download folder as ZIP"
+            >
+              <Download size={16} />
+              <span className="hidden sm:inline">ZIP</span>
+            </button>
+          )}
+
           {/* Create Folder Button */}
           <button
             onClick={handleCreateFolder}
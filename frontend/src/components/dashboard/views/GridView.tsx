@@ -1,3 +1,4 @@
+import { useState } from "react";
 import { Download, FolderIcon, Share2, Trash2 } from "lucide-react";
 import { formatSize } from "../../../utils/formats";
 import type { FileItem, ViewItem } from "../../../types/drive";
@@ -11,6 +12,29 @@ interface Props {
   handleDownload: (fileItem: FileItem) => void;
 }
 
+// Server side thumbnail, the icon stands in until it's generated (the server answers 202 meanwhile)
+const FileThumbnail = ({ file }: { file: FileItem }) => {
+  const [failed, setFailed] = useState(false);
+
+  if (!file.preview_url || failed) {
+    return (
+      <div className="transform group-hover:scale-110 transition-transform duration-300">
+        <FileIcon filename={file.filename} type={file.content_type} size={40} />
+      </div>
+    );
+  }
+  return (
+    <img
+      src={file.preview_url}
+      alt={file.filename}
+      loading="lazy"
+      decoding="async"
+      onError={() => setFailed(true)}
+      className="w-full h-full object-cover rounded-xl"
+    />
+  );
+};
+
 const GridView = ({
   viewItems,
   handleNavigate,
@@ -63,14 +87,8 @@ const GridView = ({
             onClick={() => handleFileClick(item)}
             className="group relative bg-white dark:bg-zinc-900 rounded-2xl border border-gray-300 dark:border-zinc-700 p-4 hover:shadow-lg hover:border-gray-200 dark:hover:border-zinc-700 transition-all cursor-pointer"
           >
-            <div className="aspect-square bg-gray-50 dark:bg-zinc-800 rounded-xl flex items-center justify-center mb-3 group-hover:bg-blue-50 dark:group-hover:bg-blue-900/10 transition-colors">
-              <div className="transform group-hover:scale-110 transition-transform duration-300">
-                <FileIcon
-                  filename={file.filename}
-                  type={file.content_type}
-                  size={40}
-                />
-              </div>
+            <div className="aspect-square bg-gray-50 dark:bg-zinc-800 rounded-xl flex items-center justify-center mb-3 overflow-hidden group-hover:bg-blue-50 dark:group-hover:bg-blue-900/10 transition-colors">
+              <FileThumbnail file={file} />
             </div>
             <div className="space-y-1">
               <p
@@ -15,6 +15,7 @@ import {
   deleteFile,
   downloadFile,
   fetchFiles,
+  searchFiles,
   uploadFiles,
 } from "../../api/files";
 import Toolbar from "../dashboard/Toolbar";
@@ -32,6 +33,7 @@ export default function Dashboard({ session }: Props) {
   const [loading, setLoading] = useState(true);
   const [viewMode, setViewMode] = useState<ViewMode>("grid");
   const [searchQuery, setSearchQuery] = useState("");
+  const [searchResults, setSearchResults] = useState<FileItem[]>([]);
   const [currentPath, setCurrentPath] = useState<string>("");
   const [currentFile, setCurrentFile] = useState<ViewItem | null>(null);
   const [fileToDelete, setFileToDelete] = useState<FileItem | null>(null);
@@ -55,6 +57,24 @@ export default function Dashboard({ session }: Props) {
     setSearchQuery(query);
   }, []);
 
+  // Server side search, debounced so typing doesn't fire a request per key
+  useEffect(() => {
+    const query = searchQuery.trim();
+    if (query.length < 2) {
+      setSearchResults([]);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      const results = await searchFiles(query);
+      if (!cancelled) setSearchResults(results);
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchQuery]);
+
   const handleConfirmUpload = async () => {
     setLoading(true);
     await uploadFiles(filesToUpload, currentPath);
@@ -119,11 +139,9 @@ export default function Dashboard({ session }: Props) {
     // 1. Searching: Flatten view
     if (isSearching) {
       setCurrentFile(null);
-      const matches = files
-        .filter((f) =>
-          f.filename.toLowerCase().includes(searchQuery.toLowerCase())
-        )
-        .map((f) => ({ type: "file", data: f } as FileViewItem));
+      const matches = searchResults.map(
+        (f) => ({ type: "file", data: f } as FileViewItem)
+      );
       return { viewItems: matches, isSearching };
     }
 
@@ -167,7 +185,7 @@ export default function Dashboard({ session }: Props) {
       viewItems: [...folderItems, ...currentFolderItems],
       isSearching,
     };
-  }, [files, currentPath, searchQuery]);
+  }, [files, currentPath, searchQuery, searchResults]);
 
   // --- Navigation Actions ---
   const handleNavigate = (path: string) => {
@@ -7,6 +7,8 @@ export interface FileItem {
   upload_timestamp: string;
   is_duplicate: boolean;
   download_url: string;
+  // Signed thumbnail link, null when the file type has none
+  preview_url: string | null;
 }
 
 export interface FolderItem {